@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""
+Approximate nearest-neighbour search over the embedding index (IVF-flat).
+
+Vectors are partitioned into `nlist` clusters by spherical k-means; a query
+scores only the vectors in its `nprobe` closest clusters, reading their int8
+rows (see embedding_utils.QuantizedVectors). The index is pure NumPy (no
+GPU), lives next to the index vectors as ivf.npz and is updated
+incrementally: unchanged chunks keep their cluster, new chunks are assigned
+to the nearest centroid, and centroids are retrained only when the corpus
+has grown a lot since the last training.
+
+Knobs: more clusters (nlist) make each probe cheaper, more probes (nprobe)
+raise recall at the cost of latency. `python ann_utils.py --check INDEX_DIR`
+reports recall@k against a full scan for a range of nprobe values.
+"""
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+from pathlib import Path
+from typing import Optional, Tuple
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from embedding_utils import (
+    QuantizedVectors,
+    load_index,
+    normalize_embeddings,
+    resolve_index_dir,
+    top_k_indices,
+)
+
+IVF_FILENAME = "ivf.npz"
+IVF_FORMAT_VERSION = 1
+
+# Below this many chunks exact search is fast enough and no ANN index is built
+ANN_MIN_CHUNKS = int(os.environ.get("LIZI_ANN_MIN_CHUNKS", "5000"))
+# Clusters probed per query; higher means better recall, slower queries
+ANN_NPROBE = int(os.environ.get("LIZI_ANN_NPROBE", "16"))
+# Retrain centroids once the corpus is this many times the training size
+RETRAIN_GROWTH = 2.0
+
+KMEANS_ITERATIONS = 10
+# Training sample per cluster; k-means on the full corpus adds little
+TRAIN_POINTS_PER_LIST = 64
+# Rows scored against the centroids at a time, bounds temporary memory
+ASSIGN_BLOCK = 65536
+
+
+def default_nlist(n: int) -> int:
+    """About 4 * sqrt(n) clusters, the usual IVF rule of thumb."""
+    return max(1, min(n, int(4 * np.sqrt(n))))
+
+
+def _assign(embeddings: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Nearest centroid (max inner product) for every row."""
+    assignments = np.empty(len(embeddings), dtype=np.int32)
+    for start in range(0, len(embeddings), ASSIGN_BLOCK):
+        block = np.asarray(embeddings[start : start + ASSIGN_BLOCK], dtype=np.float32)
+        assignments[start : start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+
+def train_centroids(
+    embeddings: np.ndarray, nlist: int, iterations: int = KMEANS_ITERATIONS, seed: int = 0
+) -> np.ndarray:
+    """Spherical k-means on a sample of the (normalized) vectors."""
+    rng = np.random.default_rng(seed)
+    n = len(embeddings)
+    sample_size = min(n, nlist * TRAIN_POINTS_PER_LIST)
+    sample = np.asarray(
+        embeddings[np.sort(rng.choice(n, sample_size, replace=False))], dtype=np.float32
+    )
+    centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+
+    for _ in range(iterations):
+        assignments = _assign(sample, centroids)
+        order = np.argsort(assignments, kind="stable")
+        counts = np.bincount(assignments, minlength=nlist)
+        filled = np.flatnonzero(counts)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[filled]
+        centroids[filled] = np.add.reduceat(sample[order], starts, axis=0)
+        # Re-seed empty clusters with random sample points
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            centroids[empty] = sample[rng.choice(sample_size, len(empty), replace=False)]
+        centroids = normalize_embeddings(centroids)
+    return centroids
+
+
+class IVFIndex:
+    """Inverted-file index: centroids plus the cluster of every index row."""
+
+    def __init__(self, centroids: np.ndarray, assignments: np.ndarray, trained_n: int):
+        self.centroids = centroids
+        self.assignments = assignments
+        self.trained_n = trained_n
+        # Rows grouped by cluster: rows of list c are order[offsets[c]:offsets[c + 1]]
+        self.order = np.argsort(assignments, kind="stable")
+        self.offsets = np.concatenate(
+            ([0], np.cumsum(np.bincount(assignments, minlength=len(centroids))))
+        )
+
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids)
+
+    def __len__(self) -> int:
+        return len(self.assignments)
+
+    @classmethod
+    def build(cls, embeddings: np.ndarray, nlist: Optional[int] = None) -> "IVFIndex":
+        nlist = min(nlist or default_nlist(len(embeddings)), len(embeddings))
+        centroids = train_centroids(embeddings, nlist)
+        return cls(centroids, _assign(embeddings, centroids), len(embeddings))
+
+    def update(self, embeddings: np.ndarray, previous_rows: np.ndarray) -> "IVFIndex":
+        """
+        Index for a rebuilt embedding matrix. previous_rows[i] is the row the
+        i-th vector had in this index, or -1 for a new/changed chunk. Kept
+        rows keep their cluster, new rows go to the nearest centroid; the
+        centroids are retrained once the corpus outgrows them.
+        """
+        if len(embeddings) > RETRAIN_GROWTH * self.trained_n:
+            return IVFIndex.build(embeddings)
+        previous_rows = np.asarray(previous_rows, dtype=np.int64)
+        assignments = np.empty(len(embeddings), dtype=np.int32)
+        kept = previous_rows >= 0
+        assignments[kept] = self.assignments[previous_rows[kept]]
+        fresh = np.flatnonzero(~kept)
+        if len(fresh):
+            assignments[fresh] = _assign(embeddings[fresh], self.centroids)
+        return IVFIndex(self.centroids, assignments, self.trained_n)
+
+    def search(
+        self,
+        embeddings: np.ndarray,
+        query: np.ndarray,
+        top_k: int,
+        nprobe: int = ANN_NPROBE,
+        mask: Optional[np.ndarray] = None,
+        rescore: bool = True,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        (row indices, scores) of the approximate top_k, best first. The
+        probed rows of a QuantizedVectors are scored from their int8 form
+        and only the best candidates are rescored (see
+        QuantizedVectors.search); a float32 matrix is scored directly.
+
+        With a boolean row mask only the probed rows it selects are scored.
+        nprobe is scaled by 1 / (fraction of rows selected), so about as many
+        rows are scored as without a mask, then doubled until the probed
+        lists hold top_k selected rows (or every list is probed): a
+        selective mask still yields top_k hits.
+        """
+        centroid_scores = self.centroids @ query
+        if mask is not None:
+            selected = max(int(np.count_nonzero(mask)), 1)
+            nprobe = -(-nprobe * len(mask) // selected)
+        nprobe = min(nprobe, self.nlist)
+        while True:
+            probes = top_k_indices(centroid_scores, nprobe)
+            candidates = np.concatenate(
+                [self.order[self.offsets[c] : self.offsets[c + 1]] for c in probes]
+            )
+            if mask is None:
+                break
+            candidates = candidates[mask[candidates]]
+            if len(candidates) >= top_k or nprobe == self.nlist:
+                break
+            nprobe = min(nprobe * 2, self.nlist)
+        candidates.sort()  # sequential access into (possibly memory-mapped) rows
+        if isinstance(embeddings, QuantizedVectors):
+            return embeddings.search(query, top_k, candidates, rescore)
+        scores = np.asarray(embeddings[candidates], dtype=np.float32) @ query
+        best = top_k_indices(scores, top_k)
+        return candidates[best], scores[best]
+
+    def save(self, index_dir: str) -> None:
+        path = Path(index_dir) / IVF_FILENAME
+        temp_path = path.with_name(f"{IVF_FILENAME}.{os.getpid()}.tmp.npz")
+        np.savez(
+            temp_path,
+            format=IVF_FORMAT_VERSION,
+            centroids=self.centroids,
+            assignments=self.assignments,
+            trained_n=self.trained_n,
+        )
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, index_dir: str, n_rows: int) -> Optional["IVFIndex"]:
+        """Load ivf.npz; None if missing, unreadable or not matching n_rows."""
+        path = Path(index_dir) / IVF_FILENAME
+        if not path.exists():
+            return None
+        try:
+            with np.load(path) as data:
+                if int(data["format"]) != IVF_FORMAT_VERSION:
+                    return None
+                index = cls(data["centroids"], data["assignments"], int(data["trained_n"]))
+        except (OSError, KeyError, ValueError):
+            return None
+        return index if len(index) == n_rows else None
+
+
+def update_ann_index(
+    index_dir: str,
+    embeddings: np.ndarray,
+    previous_rows: np.ndarray,
+    previous_count: int,
+    previous_dir: Optional[str] = None,
+) -> Optional[IVFIndex]:
+    """
+    Bring ivf.npz in line with a freshly written embedding matrix.
+    previous_rows maps each row to its row in the previous matrix (-1 if new),
+    previous_count is the number of rows that matrix had. The previous ANN
+    index is read from previous_dir (default: index_dir). Small corpora get
+    no ANN index, and a leftover one is removed.
+    """
+    path = Path(index_dir) / IVF_FILENAME
+    if len(embeddings) < ANN_MIN_CHUNKS:
+        if path.exists():
+            path.unlink()
+        return None
+    old = IVFIndex.load(previous_dir or index_dir, previous_count)
+    if old is None:
+        index = IVFIndex.build(embeddings)
+    else:
+        index = old.update(embeddings, previous_rows)
+    index.save(index_dir)
+    return index
+
+
+def full_scan(embeddings: np.ndarray, query: np.ndarray, k: int) -> np.ndarray:
+    """Top-k rows scoring every vector the way a search without ANN does."""
+    if isinstance(embeddings, QuantizedVectors):
+        return embeddings.search(query, k)[0]
+    return top_k_indices(np.asarray(embeddings, dtype=np.float32) @ query, k)
+
+
+def recall_at_k(
+    index: IVFIndex,
+    embeddings: np.ndarray,
+    queries: np.ndarray,
+    k: int = 10,
+    nprobe: int = ANN_NPROBE,
+) -> float:
+    """Mean fraction of the full-scan top-k that the ANN search also returns."""
+    found = 0
+    for query in queries:
+        exact = full_scan(embeddings, query, k)
+        approx, _ = index.search(embeddings, query, k, nprobe)
+        found += len(np.intersect1d(exact, approx))
+    return found / (k * len(queries))
+
+
+def _sample_queries(embeddings: np.ndarray, count: int, seed: int = 1) -> np.ndarray:
+    """Perturbed index vectors, so queries are near but not on the data."""
+    rng = np.random.default_rng(seed)
+    rows = np.asarray(
+        embeddings[rng.choice(len(embeddings), min(count, len(embeddings)), replace=False)],
+        dtype=np.float32,
+    )
+    noise = rng.standard_normal(rows.shape).astype(np.float32) * 0.05
+    return normalize_embeddings(rows + noise)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="IVF ANN index maintenance")
+    parser.add_argument("--check", metavar="INDEX_DIR", help="Report recall@k and latency")
+    parser.add_argument("--build", metavar="INDEX_DIR", help="(Re)build ivf.npz")
+    parser.add_argument("--nlist", type=int, help="Clusters (default: 4*sqrt(n))")
+    parser.add_argument("--k", type=int, default=10, help="k for recall@k")
+    parser.add_argument("--queries", type=int, default=200, help="Number of queries")
+    args = parser.parse_args()
+
+    index_dir = args.check or args.build
+    if not index_dir:
+        parser.print_help()
+        return
+    data = load_index(index_dir)
+    if data is None or len(data["embeddings"]) == 0:
+        print(f"No embedding index in {index_dir}", file=sys.stderr)
+        sys.exit(1)
+    embeddings = data["embeddings"]
+    index_dir = str(resolve_index_dir(index_dir))
+
+    if args.build:
+        index = IVFIndex.build(embeddings, args.nlist)
+        index.save(index_dir)
+        print(f"Built IVF index: {len(index)} vectors, {index.nlist} lists")
+        return
+
+    index = IVFIndex.load(index_dir, len(embeddings))
+    if index is None or args.nlist:
+        index = IVFIndex.build(embeddings, args.nlist)
+    queries = _sample_queries(embeddings, args.queries)
+
+    start = time.perf_counter()
+    for query in queries:
+        full_scan(embeddings, query, args.k)
+    exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+    print(
+        f"{len(embeddings)} vectors, {index.nlist} lists; full scan {exact_ms:.2f} ms/query"
+    )
+    print(f"{'nprobe':>7} {f'recall@{args.k}':>10} {'ms/query':>9}")
+    nprobe = 1
+    while True:
+        start = time.perf_counter()
+        for query in queries:
+            index.search(embeddings, query, args.k, nprobe)
+        ann_ms = (time.perf_counter() - start) * 1000 / len(queries)
+        recall = recall_at_k(index, embeddings, queries, args.k, nprobe)
+        print(f"{nprobe:>7} {recall:>10.3f} {ann_ms:>9.2f}")
+        if nprobe >= index.nlist:
+            break
+        nprobe = min(nprobe * 2, index.nlist)
+
+
+if __name__ == "__main__":
+    main()
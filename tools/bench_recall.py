@@ -0,0 +1,423 @@
+#!/usr/bin/env python3
+"""
+回忆检索基准测试 - 用合成记忆文件测量 BM25 / 关键词检索的性能。
+
+按真实格式（# 分类 / ## 标题 / ### 标题（日期） / - 内容）生成中英混合的记忆文件，
+每个规模分两个子进程跑，互不影响峰值内存：
+- build：从零建 BM25 索引和关键词索引，记录耗时与峰值 RSS
+- query：从磁盘加载索引后，分别用 keyword / semantic / auto 模式逐条查询，
+  记录加载耗时、每条查询延迟的 p50 / p99 与峰值 RSS
+- --shards N 时再对比 N 个分片（ShardedBM25）与单进程 BM25 的建分片耗时和
+  查询延迟，并校验两者结果一致；分片默认关闭，开启前先用它确认确实更快
+
+用法：
+  python bench_recall.py                          # 默认 1k / 10k / 100k
+  python bench_recall.py --sizes 1000,10000 --queries 100 --out bench.json
+  python bench_recall.py --sizes 100000 --shards 4
+  python bench_recall.py --tokenize [记忆文件 ...]   # 只跑分词基准
+结果以 JSON 保存，便于不同版本之间对比。
+"""
+
+import os
+import sys
+import re
+import json
+import math
+import time
+import random
+import shutil
+import argparse
+import platform
+import resource
+import subprocess
+import tempfile
+from datetime import datetime
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+DEFAULT_QUERIES = 200
+MODES = ["keyword", "semantic", "auto"]
+CATEGORIES = ["work", "projects", "learning", "hobby", "invest", "thoughts", "life"]
+
+_HAN_CHARS = (
+    "的是我在有他这中大来上个国到说们为子和你地出道也时年得就那要下以生会自着去之过"
+    "家学对可里后小么心多天而能好都然没日于起还发成事只作当想看文无开手十用主行方又如"
+    "前所本见经头面公同三已老从动两长知民样现分将外但身些与高意进把法此实回二理美点月"
+    "明其种声全工己话儿者向情部正名定女问力机给等几很业最间新什打便位因重被走电四第门"
+    "相次东政海口使教西再平真听世气信北少关并内加化由却代军产入先山五太水万市眼体别处"
+    "总才场师书比住员九笑性通目华报立马命张活难神数件安表原车白应路期叫死常提感金何更"
+    "反合放做系计或司利受光王果亲界及今京务制解各任至清物台象记边共风战干接它许八特觉"
+)
+_EN_WORDS = (
+    "bm25 index memory dds autosar python rust latency cache server socket vector "
+    "embedding token query stock fund docker kernel linux qos topic publisher subscriber"
+).split()
+
+
+def _mixed_text(rng: random.Random, length: int) -> str:
+    """约 80% 汉字、20% 英文词的混合文本。"""
+    out = []
+    for _ in range(length):
+        if rng.random() < 0.2:
+            out.append(f" {rng.choice(_EN_WORDS)} ")
+        else:
+            out.append(rng.choice(_HAN_CHARS))
+    return "".join(out)
+
+
+def generate_corpus(memories_dir: str, n_sections: int, seed: int = 42) -> Dict:
+    """
+    在 memories_dir 下生成 n_sections 个 "## " 段落，平均分到各分类文件。
+    每个段落含 1~3 条 "### 标题（日期）" 记忆。返回文件数与总字节数。
+    """
+    rng = random.Random(seed)
+    os.makedirs(memories_dir, exist_ok=True)
+    total_bytes = 0
+    for i, category in enumerate(CATEGORIES):
+        count = n_sections // len(CATEGORIES) + (i < n_sections % len(CATEGORIES))
+        lines = [f"# {category}\n"]
+        for _ in range(count):
+            lines.append(f"\n## {_mixed_text(rng, 6)}\n")
+            for _ in range(rng.randint(1, 3)):
+                date = f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+                lines.append(f"\n### {_mixed_text(rng, 4)}（{date}）\n")
+                lines.append(f"- {_mixed_text(rng, rng.randint(20, 300))}\n")
+        path = os.path.join(memories_dir, f"{category}.md")
+        with open(path, "w", encoding="utf-8") as f:
+            f.writelines(lines)
+        total_bytes += os.path.getsize(path)
+    return {"files": len(CATEGORIES), "bytes": total_bytes}
+
+
+def make_queries(sections: List[str], n_queries: int, seed: int = 7) -> List[str]:
+    """
+    从语料中取查询：约一半是段落里截出的 2~4 字片段（关键词能命中），
+    其余是英文词和随机汉字组合（关键词多半落空，auto 会转 BM25）。
+    """
+    rng = random.Random(seed)
+    queries = []
+    for i in range(n_queries):
+        if i % 2 == 0:
+            # 从段落最后一条记忆的正文里截取，避开标题行的 "#" 与日期
+            text = rng.choice(sections).rsplit("\n- ", 1)[-1]
+            start = rng.randrange(max(len(text) - 4, 1))
+            queries.append(text[start : start + rng.randint(2, 4)].strip() or "栗子")
+        elif i % 4 == 1:
+            queries.append(f"{rng.choice(_EN_WORDS)} {_mixed_text(rng, 3).strip()}")
+        else:
+            queries.append(_mixed_text(rng, 5).strip())
+    return queries
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    """最近秩法分位数，sorted_values 须已升序。"""
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(p / 100 * len(sorted_values)), 1)
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+_TOKENIZE_SAMPLE = """## DDS 项目
+### QoS 配置（2025-03-12）
+- 伞木在公司负责 AUTOSAR 上的 DDS 中间件，今天排查了 reliable QoS 下 history depth=10 时的丢包问题，
+  最后发现是 shared memory transport 的 buffer 太小。顺手把 latency benchmark 从 120us 压到了 85us。
+### 投资复盘（2025-04-02）
+- 定投的沪深300 ETF 本月收益 3.2%，美股 QQQ 回撤 5%，计划下个月继续按 plan B 加仓。
+"""
+
+
+def _legacy_tokenize(text: str) -> List[str]:
+    """旧版逐字符拼接的分词，只作为 bm25_utils.tokenize 的基准与一致性对照。"""
+    tokens = []
+
+    # 1. 提取英文/数字词（转小写）
+    english_tokens = re.findall(r"[a-zA-Z0-9]+", text)
+    tokens.extend(t.lower() for t in english_tokens)
+
+    # 2. 中文字符提取 bigram
+    chinese_chars = re.findall(r"[\u4e00-\u9fff]", text)
+    for i in range(len(chinese_chars)):
+        tokens.append(chinese_chars[i])  # unigram
+        if i + 1 < len(chinese_chars):
+            tokens.append(chinese_chars[i] + chinese_chars[i + 1])  # bigram
+
+    return tokens
+
+
+def bench_tokenize(texts: List[str], rounds: int = 5) -> None:
+    """对比旧版分词与 bm25_utils.tokenize 的耗时，并校验两者输出一致。"""
+    from bm25_utils import tokenize
+
+    total_chars = sum(len(t) for t in texts)
+    for text in texts:
+        assert tokenize(text) == _legacy_tokenize(text), "分词结果与旧实现不一致"
+
+    cases = [
+        ("legacy tokenize", _legacy_tokenize),
+        ("tokenize", tokenize),
+    ]
+    print(f"{len(texts)} 篇文档，{total_chars} 字符，每项 {rounds} 轮")
+    baseline = None
+    for name, fn in cases:
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for text in texts:
+                fn(text)
+        elapsed = (time.perf_counter() - start) / rounds
+        baseline = baseline or elapsed
+        print(
+            f"  {name:<26} {elapsed * 1000:8.2f} ms"
+            f"  {total_chars / elapsed / 1e6:6.2f} M字符/s  x{baseline / elapsed:.2f}"
+        )
+
+
+def _peak_rss_mb() -> float:
+    # Linux 上 ru_maxrss 单位是 KB，macOS 上是字节
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def _use_memories_dir(memories_dir: str):
+    """导入 lizi_recalling 并把记忆目录及派生的索引路径指向 memories_dir。"""
+    import lizi_recalling as recall
+
+    index_dir = os.path.join(memories_dir, ".index")
+    recall.MEMORIES_DIR = memories_dir
+    recall.INDEX_DIR = index_dir
+    recall.ACCESS_LOG_PATH = os.path.join(index_dir, "access_log.json")
+    recall.BM25_INDEX_PATH = os.path.join(index_dir, "bm25_index.pkl")
+    recall.KEYWORD_INDEX_DIR = os.path.join(index_dir, "keyword")
+    recall.CATALOG_DIR = os.path.join(index_dir, "catalog")
+    recall.RESULT_CACHE_PATH = os.path.join(index_dir, "recall_cache.json")
+    return recall
+
+
+def _worker_build(memories_dir: str) -> Dict:
+    """子进程：从零建 BM25 索引与关键词索引。"""
+    recall = _use_memories_dir(memories_dir)
+    shutil.rmtree(recall.INDEX_DIR, ignore_errors=True)
+
+    start = time.perf_counter()
+    bm25 = recall.load_bm25_index()
+    bm25_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    signatures = recall.get_file_signatures()
+    for filename, signature in signatures.items():
+        recall.load_keyword_index(filename, signature)
+    keyword_s = time.perf_counter() - start
+
+    return {
+        "documents": bm25.n,
+        "bm25_build_s": round(bm25_s, 4),
+        "keyword_build_s": round(keyword_s, 4),
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+    }
+
+
+def _bench_shards(bm25, queries: List[str], num_shards: int) -> Dict:
+    """单进程 BM25.search 与 num_shards 个分片逐条对比，结果必须一致。"""
+    from bm25_utils import ShardedBM25
+
+    start = time.perf_counter()
+    sharded = ShardedBM25(bm25, num_shards)
+    setup_s = time.perf_counter() - start
+    single, parallel = [], []
+    try:
+        for query in queries:
+            start = time.perf_counter()
+            expected = bm25.search(query, top_k=5)
+            single.append((time.perf_counter() - start) * 1000)
+            start = time.perf_counter()
+            actual = sharded.search(query, top_k=5)
+            parallel.append((time.perf_counter() - start) * 1000)
+            assert actual == expected, f"分片结果与单进程不一致：{query!r}"
+    finally:
+        sharded.close()
+    single.sort()
+    parallel.sort()
+    return {
+        "shards": num_shards,
+        "cpus": os.cpu_count(),
+        "setup_s": round(setup_s, 4),
+        "single_p50_ms": round(percentile(single, 50), 3),
+        "single_p99_ms": round(percentile(single, 99), 3),
+        "sharded_p50_ms": round(percentile(parallel, 50), 3),
+        "sharded_p99_ms": round(percentile(parallel, 99), 3),
+    }
+
+
+def _worker_query(memories_dir: str, n_queries: int, num_shards: int = 1) -> Dict:
+    """
+    子进程：加载已建好的索引，逐条测三种模式的查询延迟。
+    BM25 索引加载一次后常驻（冷启动加载耗时单独报告），
+    查询走 _compute_recall，不经过结果缓存。num_shards > 1 时附带分片对比。
+    """
+    recall = _use_memories_dir(memories_dir)
+
+    start = time.perf_counter()
+    bm25 = recall.load_bm25_index()
+    load_s = time.perf_counter() - start
+    recall.load_bm25_index = lambda: bm25
+
+    queries = make_queries([text for text in bm25.corpus if text], n_queries)
+    latency = {}
+    for mode in MODES:
+        timings = []
+        hits = 0
+        for query in queries:
+            request = {"query": query, "mode": mode, "top_k": 5, "match": "phrase"}
+            start = time.perf_counter()
+            output = recall._compute_recall([request])[0]
+            timings.append((time.perf_counter() - start) * 1000)
+            hits += bool(output["results"])
+        timings.sort()
+        latency[mode] = {
+            "p50_ms": round(percentile(timings, 50), 3),
+            "p99_ms": round(percentile(timings, 99), 3),
+            "mean_ms": round(sum(timings) / len(timings), 3),
+            "hit_rate": round(hits / len(queries), 3),
+        }
+
+    result = {
+        "index_load_s": round(load_s, 4),
+        "latency": latency,
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+    }
+    if num_shards > 1:
+        result["sharded"] = _bench_shards(bm25, queries, num_shards)
+    return result
+
+
+def _run_worker(*args: str) -> Dict:
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--worker", *args],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def run_benchmark(
+    sizes: List[int], n_queries: int, workdir: str, num_shards: int = 1
+) -> Dict:
+    results = []
+    for n_sections in sizes:
+        memories_dir = os.path.join(workdir, f"memories_{n_sections}")
+        shutil.rmtree(memories_dir, ignore_errors=True)
+        print(f"[{n_sections} 段] 生成语料...", file=sys.stderr)
+        corpus = generate_corpus(memories_dir, n_sections)
+        print(f"[{n_sections} 段] 建索引...", file=sys.stderr)
+        build = _run_worker("build", memories_dir)
+        print(f"[{n_sections} 段] 查询 {n_queries} 条 x {len(MODES)} 种模式...", file=sys.stderr)
+        query = _run_worker("query", memories_dir, str(n_queries), str(num_shards))
+        results.append(
+            {"sections": n_sections, **corpus, "build": build, "query": query}
+        )
+    try:
+        import numpy  # noqa: F401
+
+        has_numpy = True
+    except ImportError:
+        has_numpy = False
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "numpy": has_numpy,
+        "queries": n_queries,
+        "results": results,
+    }
+
+
+def print_report(report: Dict) -> None:
+    print(
+        f"{'段落数':>8} {'BM25建索引':>10} {'关键词建索引':>12} {'建索引RSS':>10}"
+        f" {'加载':>8} {'查询RSS':>9}  模式      p50(ms)   p99(ms)"
+    )
+    for row in report["results"]:
+        build, query = row["build"], row["query"]
+        prefix = (
+            f"{row['sections']:>10} {build['bm25_build_s']:>12.2f}s"
+            f" {build['keyword_build_s']:>15.2f}s {build['peak_rss_mb']:>11.1f}M"
+            f" {query['index_load_s']:>9.2f}s {query['peak_rss_mb']:>10.1f}M"
+        )
+        for mode in MODES:
+            stats = query["latency"][mode]
+            print(f"{prefix}  {mode:<8} {stats['p50_ms']:>8.2f}  {stats['p99_ms']:>8.2f}")
+            prefix = " " * len(prefix)
+
+    for row in report["results"]:
+        sharded = row["query"].get("sharded")
+        if sharded:
+            print(
+                f"{row['sections']:>10} 段 BM25 {sharded['shards']} 分片"
+                f"（{sharded['cpus']} 核）：建分片 {sharded['setup_s']:.2f}s，"
+                f"p50 {sharded['single_p50_ms']:.2f} → {sharded['sharded_p50_ms']:.2f} ms，"
+                f"p99 {sharded['single_p99_ms']:.2f} → {sharded['sharded_p99_ms']:.2f} ms"
+            )
+
+
+def main():
+    if len(sys.argv) > 2 and sys.argv[1] == "--worker":
+        if sys.argv[2] == "build":
+            result = _worker_build(sys.argv[3])
+        else:
+            result = _worker_query(sys.argv[3], int(sys.argv[4]), int(sys.argv[5]))
+        print(json.dumps(result))
+        return
+
+    parser = argparse.ArgumentParser(description="回忆检索基准测试")
+    parser.add_argument(
+        "--sizes",
+        default=",".join(map(str, DEFAULT_SIZES)),
+        help="逗号分隔的段落数，默认 1000,10000,100000",
+    )
+    parser.add_argument(
+        "--queries", type=int, default=DEFAULT_QUERIES, help="每种模式的查询条数"
+    )
+    parser.add_argument(
+        "--out", default="bench_recall.json", help="结果 JSON 路径"
+    )
+    parser.add_argument(
+        "--workdir", help="语料与索引的存放目录，默认临时目录，跑完删除"
+    )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=1,
+        help="大于 1 时对比该分片数的 ShardedBM25 与单进程打分（默认不对比）",
+    )
+    parser.add_argument(
+        "--tokenize",
+        nargs="*",
+        metavar="FILE",
+        help="只跑分词基准：对比旧版分词与 tokenize()，不给文件时用内置样例",
+    )
+    args = parser.parse_args()
+
+    if args.tokenize is not None:
+        from bm25_utils import _read_bench_texts
+
+        bench_tokenize(_read_bench_texts(args.tokenize) or [_TOKENIZE_SAMPLE] * 2000)
+        return
+
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    workdir = args.workdir or tempfile.mkdtemp(prefix="lizi_bench_")
+    try:
+        report = run_benchmark(sizes, args.queries, workdir, args.shards)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print_report(report)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n结果已保存到 {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,60 @@
 #!/usr/bin/env python3
 """
 BM25 语义搜索工具 - 纯标准库实现，零依赖。
+装了 NumPy 时自动改用向量化打分，并用 MaxScore 动态剪枝跳过进不了 top_k 的文档，
+结果与纯标准库路径一致。
 
 分词策略：
 - 中文字符级 bigram（"老板我是" → ["老板", "板我", "我是"]）
 - 英文/数字按空格和标点切词
 - 两者合并作为词袋
+
+剪枝一致性校验：python bm25_utils.py --check [记忆文件 ...]
 """
 
+import os
 import re
+import sys
 import math
-from typing import List, Dict, Tuple
+import time
+import heapq
+import pickle
+import operator
+from array import array
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor
+from itertools import accumulate
+from typing import Callable, List, Dict, Tuple, Optional, Set
 
+try:
+    import numpy as np
+except ImportError:  # NumPy 是可选加速，缺失时走纯标准库路径
+    np = None
 
 # BM25 参数
 BM25_K1 = 1.5  # 词频饱和参数，越大词频权重越高
 BM25_B = 0.75  # 文档长度归一化参数
 
+# 持久化索引格式版本，结构变化时递增，旧文件自动失效
+INDEX_FORMAT_VERSION = 6
+
+# 墓碑（已删除文档）超过该比例时建议 compact()
+COMPACT_RATIO = 0.25
+
+# 分片并行打分默认关闭（分片数 1）：建分片要解码全部倒排并拉起 worker 进程，
+# 只有在常驻进程（recall_server.py）里建一次、之后反复使用才可能划算。
+# 先用 bench_recall.py --shards N 确认分片比单进程 NumPy 打分快，再设环境变量
+# LIZI_BM25_SHARDS=N 开启；有效文档数达到 SHARD_MIN_DOCS（LIZI_BM25_SHARD_MIN_DOCS）才生效
+SHARD_MIN_DOCS = int(os.environ.get("LIZI_BM25_SHARD_MIN_DOCS", "50000"))
+SHARD_COUNT = max(1, int(os.environ.get("LIZI_BM25_SHARDS", "1")))
+
+# MaxScore 剪枝比较时留的相对余量：部分和与最终分数的累加顺序不同，
+# 舍入误差不能让本该进 top_k 的文档被剪掉
+_PRUNE_SLACK = 1e-9
+
+_WORD_RE = re.compile(r"[a-zA-Z0-9]+")
+_HAN_RE = re.compile(r"[\u4e00-\u9fff]")
+
 
 def tokenize(text: str) -> List[str]:
     """
@@ -25,89 +63,807 @@ def tokenize(text: str) -> List[str]:
       "老板我是神人" → ["老板", "板我", "我是", "是神", "神人"]
       "BM25 算法" → ["bm25", "算法"]
       "老板 bm25" → ["老板", "bm2", "m25", "bm25"]
-    """
-    tokens = []
 
+    unigram/bigram 的拼接都在 C 层完成，不逐字符走 Python 循环；
+    与逐字符拼接的旧写法对比：python bench_recall.py --tokenize [记忆文件 ...]
+    """
     # 1. 提取英文/数字词（转小写）
-    english_tokens = re.findall(r"[a-zA-Z0-9]+", text)
-    tokens.extend(t.lower() for t in english_tokens)
-
-    # 2. 中文字符提取 bigram
-    chinese_chars = re.findall(r"[\u4e00-\u9fff]", text)
-    for i in range(len(chinese_chars)):
-        tokens.append(chinese_chars[i])  # unigram
-        if i + 1 < len(chinese_chars):
-            tokens.append(chinese_chars[i] + chinese_chars[i + 1])  # bigram
+    tokens = list(map(str.lower, _WORD_RE.findall(text)))
 
+    # 2. 中文 unigram 与 bigram 交错排列：[c0, c0c1, c1, c1c2, ..., cn]
+    chars = _HAN_RE.findall(text)
+    if chars:
+        grams = [None] * (2 * len(chars) - 1)
+        grams[0::2] = chars
+        grams[1::2] = map(operator.add, chars, chars[1:])
+        tokens.extend(grams)
     return tokens
 
 
+def _atomic_pickle_dump(obj, path: str) -> None:
+    """先写临时文件再 rename，读者不会看到写了一半的文件；写失败静默忽略。"""
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(temp_path, "wb") as f:
+            pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path)
+    except OSError:
+        # 索引/缓存写失败不影响检索
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def _pickle_load(path: str, fmt: int) -> Optional[Dict]:
+    """读取带格式版本号的 pickle，缺失、损坏或版本不符时返回 None。"""
+    try:
+        with open(path, "rb") as f:
+            state = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ValueError):
+        return None
+    if not isinstance(state, dict) or state.get("format") != fmt:
+        return None
+    return state
+
+
+def _encode_postings(postings: Dict[int, int]) -> bytes:
+    """倒排表编码：按 doc_id 升序，依次写 (doc_id 差值, tf) 的 varint。"""
+    out = bytearray()
+    prev = 0
+    for doc_id in sorted(postings):
+        for value in (doc_id - prev, postings[doc_id]):
+            while value >= 0x80:
+                out.append(value & 0x7F | 0x80)
+                value >>= 7
+            out.append(value)
+        prev = doc_id
+    return bytes(out)
+
+
+def _decode_postings(blob: bytes) -> Dict[int, int]:
+    """_encode_postings 的逆过程，返回 {doc_id: tf}。"""
+    if max(blob) < 0x80:
+        # 高频 term 的差值和 tf 基本都是单字节，整段交给 C 层解码
+        values = list(blob)
+    else:
+        values = []
+        value = shift = 0
+        for byte in blob:
+            value |= (byte & 0x7F) << shift
+            if byte & 0x80:
+                shift += 7
+            else:
+                values.append(value)
+                value = shift = 0
+    return dict(zip(accumulate(values[0::2]), values[1::2]))
+
+
 class BM25:
     """BM25 检索器，纯标准库实现。"""
 
-    def __init__(self, corpus: List[str]):
+    def __init__(
+        self,
+        corpus: List[str],
+        tokenizer: Optional[Callable[[str], List[str]]] = None,
+    ):
         """
         corpus: 文档文本列表
+        tokenizer: 分词函数，默认 tokenize
         """
-        self.corpus = corpus
-        self.n = len(corpus)
-        self.tokenized = [tokenize(doc) for doc in corpus]
-        self.avgdl = sum(len(t) for t in self.tokenized) / max(self.n, 1)
+        self.tokenizer = tokenizer or tokenize
+        self.corpus: List[Optional[str]] = []
+        self.n = 0  # 有效文档数（不含墓碑）
+        self.doc_len = array("I")
+        self.total_len = 0
+        self.avgdl = 0.0
+        # 已删除文档的 doc_id（墓碑），原文置 None，compact() 时回收
+        self.deleted: Set[int] = set()
+        # 调用方自定义的附加信息（如语料版本），随索引一起持久化
+        self.meta: Dict = {}
 
-        # 构建倒排索引：term → {doc_id: count}
+        # 倒排索引分两层：
+        # - packed: term → varint 编码的紧凑倒排（见 _encode_postings），占内存小
+        # - inverted: term → {doc_id: count}，pack() 之后新增/修改的倒排；
+        #   count 为 0 表示把 packed 里的这条删掉
+        self.packed: Dict[str, bytes] = {}
         self.inverted: Dict[str, Dict[int, int]] = {}
-        for doc_id, tokens in enumerate(self.tokenized):
-            for token in tokens:
-                if token not in self.inverted:
-                    self.inverted[token] = {}
-                self.inverted[token][doc_id] = self.inverted[token].get(doc_id, 0) + 1
-
-        # 文档频率
-        self.df: Dict[str, int] = {
-            term: len(docs) for term, docs in self.inverted.items()
-        }
+        # 文档频率，也是"term 是否存在"的唯一依据
+        self.df: Dict[str, int] = {}
+        # term → (倒排中最大的 tf, 含该 term 的最短文档长度)，MaxScore 剪枝的上界
+        # （见 _upper_bound）。删文档后只会偏松；新增文档涉及的 term 先移除，
+        # pack()（save() 时必调）再算准
+        self.bounds: Dict[str, Tuple[int, int]] = {}
+
+        self._reset_caches()
+        self.add_documents(corpus)
+        self.pack()
+
+    def _reset_caches(self) -> None:
+        """清空由 n / df / avgdl / 倒排推导出的缓存，任何增删改之后都要调用。"""
+        self.use_numpy = np is not None
+        self._idf_cache: Dict[str, float] = {}
+        # 解码后的倒排（packed 与 inverted 合并结果）
+        self._decoded: Dict[str, Dict[int, int]] = {}
+        # NumPy 打分用：按需物化的 CSR 行（term → (doc_ids, weights)）与文档长度归一项
+        self._rows: Dict[str, Tuple] = {}
+        self._norms = None
+
+    def _postings(self, token: str) -> Dict[int, int]:
+        """term 的完整倒排 {doc_id: tf}，只读；按需解码并缓存。"""
+        postings = self._decoded.get(token)
+        if postings is not None:
+            return postings
+
+        blob = self.packed.get(token)
+        overlay = self.inverted.get(token)
+        if blob is None:
+            postings = overlay or {}
+        else:
+            postings = _decode_postings(blob)
+            for doc_id, tf in (overlay or {}).items():
+                if tf:
+                    postings[doc_id] = tf
+                else:
+                    postings.pop(doc_id, None)
+        self._decoded[token] = postings
+        return postings
+
+    def _drop_term(self, token: str) -> None:
+        self.packed.pop(token, None)
+        self.inverted.pop(token, None)
+        self.bounds.pop(token, None)
+        del self.df[token]
+
+    def pack(self) -> None:
+        """把 inverted 中的增量合并进紧凑的 packed 倒排，之后 inverted 为空。"""
+        for token in list(self.inverted):
+            postings = self._postings(token)
+            if postings:
+                self.packed[token] = _encode_postings(postings)
+                self.bounds[token] = (
+                    max(postings.values()),
+                    min(map(self.doc_len.__getitem__, postings)),
+                )
+            else:
+                self.packed.pop(token, None)
+        self.inverted = {}
+        self._decoded = {}
+
+    def _index_doc(self, doc_id: int, text: str) -> None:
+        """把一篇文档的词频写入倒排表，并更新 df 与长度统计。"""
+        tokens = self.tokenizer(text)
+        doc_len = len(tokens)
+        counts: Dict[str, int] = {}
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        if self.bounds:
+            # 新文档可能抬高上界；这些 term 在 pack() 重算之前不参与剪枝
+            for token in counts:
+                self.bounds.pop(token, None)
+        for token, count in counts.items():
+            overlay = self.inverted.get(token)
+            if overlay is None:
+                overlay = self.inverted[token] = {}
+            overlay[doc_id] = count
+            self.df[token] = self.df.get(token, 0) + 1
+
+        self.doc_len[doc_id] = doc_len
+        self.total_len += doc_len
+
+    def _unindex_doc(self, doc_id: int) -> None:
+        """从倒排表中撤下一篇文档（重新分词原文找到它出现过的 term）。"""
+        for token in set(self.tokenizer(self.corpus[doc_id])):
+            if token not in self.df:
+                continue
+            if self.df[token] == 1:
+                self._drop_term(token)
+                continue
+            self.df[token] -= 1
+            if token in self.packed:
+                self.inverted.setdefault(token, {})[doc_id] = 0
+            else:
+                del self.inverted[token][doc_id]
+
+        self.total_len -= self.doc_len[doc_id]
+        self.doc_len[doc_id] = 0
+
+    def _update_avgdl(self) -> None:
+        self.avgdl = self.total_len / max(self.n, 1)
+        self._reset_caches()
+
+    def add_documents(self, docs: List[str]) -> List[int]:
+        """追加文档，只对新文档分词，返回分配到的 doc_id 列表。"""
+        doc_ids = []
+        for text in docs:
+            doc_id = len(self.corpus)
+            self.corpus.append(text)
+            self.doc_len.append(0)
+            self._index_doc(doc_id, text)
+            doc_ids.append(doc_id)
+        self.n += len(doc_ids)
+        self._update_avgdl()
+        return doc_ids
+
+    def remove_documents(self, doc_ids: List[int]) -> None:
+        """删除文档：撤下倒排项并留下墓碑，doc_id 保持稳定直到 compact()。"""
+        for doc_id in doc_ids:
+            if doc_id in self.deleted or not 0 <= doc_id < len(self.corpus):
+                continue
+            self._unindex_doc(doc_id)
+            self.corpus[doc_id] = None
+            self.deleted.add(doc_id)
+            self.n -= 1
+        self._update_avgdl()
+
+    def update_document(self, doc_id: int, text: str) -> None:
+        """原地替换一篇文档的内容，doc_id 不变。"""
+        if doc_id in self.deleted or not 0 <= doc_id < len(self.corpus):
+            raise IndexError(f"doc_id {doc_id} 不存在")
+        self._unindex_doc(doc_id)
+        self.corpus[doc_id] = text
+        self._index_doc(doc_id, text)
+        self._update_avgdl()
+
+    def needs_compaction(self) -> bool:
+        """墓碑占比超过 COMPACT_RATIO 时应当压缩。"""
+        return len(self.deleted) > COMPACT_RATIO * max(len(self.corpus), 1)
+
+    def compact(self) -> Dict[int, int]:
+        """
+        回收墓碑，把有效文档重新编号为连续的 doc_id。
+        返回 {旧 doc_id: 新 doc_id}，调用方据此更新自己保存的 doc_id。
+        """
+        mapping = {}
+        corpus = []
+        doc_len = array("I")
+        for old_id, text in enumerate(self.corpus):
+            if old_id in self.deleted:
+                continue
+            mapping[old_id] = len(corpus)
+            corpus.append(text)
+            doc_len.append(self.doc_len[old_id])
+
+        packed = {}
+        for token in self.df:
+            postings = {
+                mapping[doc_id]: tf for doc_id, tf in self._postings(token).items()
+            }
+            packed[token] = _encode_postings(postings)
+        self.packed = packed
+        self.inverted = {}
+        self.corpus = corpus
+        self.doc_len = doc_len
+        self.deleted = set()
+        self._reset_caches()
+        return mapping
+
+    def idf(self, token: str) -> float:
+        """词的 IDF，按 term 缓存，避免每个候选文档重复算 log。"""
+        idf = self._idf_cache.get(token)
+        if idf is None:
+            df = self.df[token]
+            idf = math.log((self.n - df + 0.5) / (df + 0.5) + 1)
+            self._idf_cache[token] = idf
+        return idf
 
     def score(self, query_tokens: List[str], doc_id: int) -> float:
         """计算单文档的 BM25 分数。"""
-        doc_len = len(self.tokenized[doc_id])
+        doc_len = self.doc_len[doc_id]
         score = 0.0
         for token in query_tokens:
-            if token not in self.inverted:
+            if token not in self.df:
                 continue
-            tf = self.inverted[token].get(doc_id, 0)
+            tf = self._postings(token).get(doc_id, 0)
             if tf == 0:
                 continue
-            df = self.df[token]
-            idf = math.log((self.n - df + 0.5) / (df + 0.5) + 1)
-            tf_norm = (tf * (BM25_K1 + 1)) / (
-                tf + BM25_K1 * (1 - BM25_B + BM25_B * doc_len / self.avgdl)
-            )
-            score += idf * tf_norm
+            score += self.idf(token) * self._tf_norm(tf, doc_len)
         return score
 
     def search(
         self, query: str, top_k: int = 5, threshold: float = 0.0
     ) -> List[Tuple[int, float]]:
         """
-        搜索，返回 [(doc_id, score), ...] 按分数降序。
+        搜索，返回 [(doc_id, score), ...] 按分数降序（同分按 doc_id 升序）。
         threshold: 最低分数过滤（0 表示不过滤）
         """
-        query_tokens = tokenize(query)
-        if not query_tokens:
+        return self._search_tokens(self.tokenizer(query), top_k, threshold)
+
+    def search_many(
+        self, queries: List[str], top_k: int = 5, threshold: float = 0.0
+    ) -> List[List[Tuple[int, float]]]:
+        """
+        批量搜索，返回与 queries 一一对应的结果列表。
+        重复的 query 只分词、打分一次；各 query 共用解码后的倒排、idf
+        和 term 权重（NumPy），所以共享 term 越多越省。
+        """
+        results: Dict[str, List[Tuple[int, float]]] = {}
+        for query in queries:
+            if query not in results:
+                results[query] = self._search_tokens(
+                    self.tokenizer(query), top_k, threshold
+                )
+        return [results[query] for query in queries]
+
+    def _search_tokens(
+        self, query_tokens: List[str], top_k: int, threshold: float
+    ) -> List[Tuple[int, float]]:
+        if not query_tokens or self.n == 0:
             return []
+        if self.use_numpy:
+            return self._search_maxscore(query_tokens, top_k, threshold)
+        return self._search_python(query_tokens, top_k, threshold)
 
-        # 只对包含至少一个 query token 的文档打分（效率优化）
-        candidate_ids = set()
+    def _tf_norm(self, tf: int, doc_len: int) -> float:
+        return (tf * (BM25_K1 + 1)) / (
+            tf + BM25_K1 * (1 - BM25_B + BM25_B * doc_len / self.avgdl)
+        )
+
+    def _search_python(
+        self, query_tokens: List[str], top_k: int, threshold: float
+    ) -> List[Tuple[int, float]]:
+        """
+        纯标准库打分（没有 NumPy 时）：按 query token 顺序逐个累加倒排上的贡献，
+        累加顺序与 _search_numpy 相同，分数逐位一致；用容量为 top_k 的堆取前 k。
+        """
+        if top_k <= 0:
+            return []
+        doc_len = self.doc_len
+        scores: Dict[int, float] = {}
         for token in query_tokens:
-            if token in self.inverted:
-                candidate_ids.update(self.inverted[token].keys())
+            if token not in self.df:
+                continue
+            idf = self.idf(token)
+            for doc_id, tf in self._postings(token).items():
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * self._tf_norm(
+                    tf, doc_len[doc_id]
+                )
 
-        scored = [
-            (doc_id, self.score(query_tokens, doc_id)) for doc_id in candidate_ids
-        ]
-        scored.sort(key=lambda x: x[1], reverse=True)
+        hits = scores.items()
+        if threshold > 0:
+            hits = [(doc_id, score) for doc_id, score in hits if score >= threshold]
+        return heapq.nsmallest(top_k, hits, key=lambda x: (-x[1], x[0]))
+
+    def _term_row(self, token: str):
+        """
+        一个 term 的 CSR 行 (doc_ids, 每个文档的 idf × tf_norm)，首次用到时才物化。
+        在下一次增删改之前一直缓存，多个 query 共用同一 term 时只算一次。
+        """
+        row = self._rows.get(token)
+        if row is None:
+            postings = self._postings(token)
+            count = len(postings)
+            doc_ids = np.fromiter(postings.keys(), dtype=np.int64, count=count)
+            tfs = np.fromiter(postings.values(), dtype=np.float64, count=count)
+            if count > 1 and not (doc_ids[1:] > doc_ids[:-1]).all():
+                # update_document 之后的倒排不再按 doc_id 有序，_row_weights 要二分查找
+                order = np.argsort(doc_ids)
+                doc_ids, tfs = doc_ids[order], tfs[order]
+            row = self._rows[token] = (doc_ids, self._weights(token, tfs, doc_ids))
+        return row
+
+    def _weights(self, token: str, tfs, doc_ids):
+        """idf × tf_norm 的向量化版本；各处用同一个表达式，分数逐位一致。"""
+        if self._norms is None:
+            doc_len = np.asarray(self.doc_len, dtype=np.float64)
+            self._norms = BM25_K1 * (1 - BM25_B + BM25_B * doc_len / self.avgdl)
+        return self.idf(token) * ((tfs * (BM25_K1 + 1)) / (tfs + self._norms[doc_ids]))
+
+    def _row_weights(self, token: str, doc_ids):
+        """term 在给定文档（升序）上的权重，不含该 term 的文档为 0。"""
+        row_ids, weights = self._term_row(token)
+        pos = np.minimum(np.searchsorted(row_ids, doc_ids), len(row_ids) - 1)
+        return np.where(row_ids[pos] == doc_ids, weights[pos], 0.0)
+
+    def _upper_bound(self, token: str) -> float:
+        """term 出现一次对任一文档分数的贡献上界：tf_norm 随 tf 增大、随文档变长减小。"""
+        max_tf, min_len = self.bounds[token]
+        return self.idf(token) * self._tf_norm(max_tf, min_len)
 
+    def _search_numpy(
+        self, query_tokens: List[str], top_k: int, threshold: float
+    ) -> List[Tuple[int, float]]:
+        """
+        向量化打分：IDF 与文档长度归一项只算一次，所有候选一次性用数组运算打分。
+        运算顺序与 score() 一致（按 query token 顺序累加），分数逐位相同。
+        """
+        id_parts = []
+        weight_parts = []
+        for token in query_tokens:
+            if token not in self.df:
+                continue
+            doc_ids, weights = self._term_row(token)
+            id_parts.append(doc_ids)
+            weight_parts.append(weights)
+        if not id_parts:
+            return []
+
+        all_ids = np.concatenate(id_parts)
+        totals = np.bincount(all_ids, weights=np.concatenate(weight_parts))
+        candidates = np.unique(all_ids)
+        return self._top_k(candidates, totals[candidates], top_k, threshold)
+
+    def _top_k(self, candidates, scores, top_k: int, threshold: float):
+        """从候选及其分数中取前 top_k（分数降序，同分 doc_id 升序）。"""
         if threshold > 0:
-            scored = [(doc_id, s) for doc_id, s in scored if s >= threshold]
+            keep = scores >= threshold
+            candidates, scores = candidates[keep], scores[keep]
+        if len(candidates) > top_k > 0:
+            # 先用 partition 找到第 k 大的分数，只对不低于它的候选排序
+            kth = np.partition(scores, len(scores) - top_k)[len(scores) - top_k]
+            keep = scores >= kth
+            candidates, scores = candidates[keep], scores[keep]
+
+        order = np.lexsort((candidates, -scores))[:top_k]
+        return [(int(candidates[i]), float(scores[i])) for i in order]
+
+    def _search_maxscore(
+        self, query_tokens: List[str], top_k: int, threshold: float
+    ) -> List[Tuple[int, float]]:
+        """
+        MaxScore 动态剪枝，结果与 _search_numpy 逐位相同：
+        1. query 的 term 按分数上界（_upper_bound × 出现次数）从大到小逐个累加
+           部分分数；当前第 top_k 大的部分分数 θ 超过剩余 term 的上界之和时，
+           没出现过的文档不可能进 top_k，剩下的 term 不再需要整条倒排。
+        2. 剩下的 term 只在候选上求值，每求一个就用新的 θ 和剩余上界再剪一次。
+           它们多是"的"这类高频、低 idf 的字：候选原文比倒排短时直接把候选
+           重新分词数出 tf，代价只和候选数有关，不随语料增长。
+        3. 剩下的候选按 query token 顺序精确打分。
+        分片 worker 没有原文和上界，退回 _search_numpy。
+        """
+        counts: Dict[str, int] = {}
+        for token in query_tokens:
+            if token in self.df:
+                counts[token] = counts.get(token, 0) + 1
+        if top_k <= 0 or not counts or any(t not in self.bounds for t in counts):
+            return self._search_numpy(query_tokens, top_k, threshold)
+
+        bound = {t: counts[t] * self._upper_bound(t) for t in counts}
+        terms = sorted(counts, key=bound.__getitem__, reverse=True)
+        # rest[j]：第 j 个及之后 term 的上界之和
+        rest = list(accumulate(reversed([bound[t] for t in terms])))[::-1] + [0.0]
+
+        def beaten(upper, theta):
+            return upper * (1 + _PRUNE_SLACK) < theta * (1 - _PRUNE_SLACK)
+
+        def kth_largest(scores):
+            return np.partition(scores, len(scores) - top_k)[len(scores) - top_k]
+
+        partial = np.zeros(len(self.doc_len))
+        seen = []
+        theta = threshold
+        essential = 0
+        while essential < len(terms) and not beaten(rest[essential], theta):
+            token = terms[essential]
+            doc_ids, weights = self._term_row(token)
+            partial[doc_ids] += counts[token] * weights
+            seen.append(doc_ids)
+            essential += 1
+            candidates = np.unique(np.concatenate(seen))
+            if len(candidates) >= top_k:
+                theta = max(theta, kth_largest(partial[candidates]))
+        if essential == 0:
+            return []  # 连全部上界加起来都够不到 threshold
+        if essential == len(terms):
+            return self._search_numpy(query_tokens, top_k, threshold)  # 无可剪枝
+
+        keep = ~beaten(partial[candidates] + rest[essential], theta)
+        candidates = candidates[keep]
+        partial = partial[candidates]
+        weights = {t: self._row_weights(t, candidates) for t in terms[:essential]}
+        doc_counts = None  # 候选原文重新分词得到的 [{term: tf}]，与 candidates 对齐
+        for j in range(essential, len(terms)):
+            token = terms[j]
+            if doc_counts is None and token not in self._rows:
+                unread = sum(self.df[t] for t in terms[j:] if t not in self._rows)
+                if unread > len(candidates) * self.avgdl:
+                    doc_counts = self._count_terms(candidates, set(terms[j:]))
+            if doc_counts is not None:
+                tfs = np.array([c.get(token, 0) for c in doc_counts], dtype=np.float64)
+                weights[token] = self._weights(token, tfs, candidates)
+            else:
+                weights[token] = self._row_weights(token, candidates)
+            partial += counts[token] * weights[token]
+            if len(candidates) >= top_k:
+                theta = max(theta, kth_largest(partial))
+            keep = ~beaten(partial + rest[j + 1], theta)
+            if not keep.all():
+                candidates, partial = candidates[keep], partial[keep]
+                weights = {t: w[keep] for t, w in weights.items()}
+                if doc_counts is not None:
+                    doc_counts = [doc_counts[i] for i in np.flatnonzero(keep)]
+
+        scores = np.zeros(len(candidates))
+        for token in query_tokens:
+            if token in weights:
+                scores += weights[token]
+        return self._top_k(candidates, scores, top_k, threshold)
+
+    def _count_terms(self, doc_ids, wanted: Set[str]) -> List[Dict[str, int]]:
+        """把文档原文重新分词，数出 wanted 中各 term 的 tf。"""
+        doc_counts = []
+        for doc_id in doc_ids.tolist():
+            tf: Dict[str, int] = {}
+            for token in self.tokenizer(self.corpus[doc_id]):
+                if token in wanted:
+                    tf[token] = tf.get(token, 0) + 1
+            doc_counts.append(tf)
+        return doc_counts
+
+    def save(self, path: str) -> None:
+        """
+        序列化索引到磁盘（倒排表、文档长度、df、avgdl、原文、meta）。
+        先写临时文件再 rename，读者不会看到写了一半的索引。
+        """
+        self.pack()
+        state = {
+            "format": INDEX_FORMAT_VERSION,
+            "corpus": self.corpus,
+            "doc_len": self.doc_len,
+            "total_len": self.total_len,
+            "avgdl": self.avgdl,
+            "deleted": self.deleted,
+            "packed": self.packed,
+            "df": self.df,
+            "bounds": self.bounds,
+            "meta": self.meta,
+        }
+        _atomic_pickle_dump(state, path)
+
+    @classmethod
+    def load(
+        cls, path: str, tokenizer: Optional[Callable[[str], List[str]]] = None
+    ) -> Optional["BM25"]:
+        """从磁盘加载索引，文件缺失、损坏或格式版本不符时返回 None。"""
+        state = _pickle_load(path, INDEX_FORMAT_VERSION)
+        if state is None:
+            return None
+
+        bm25 = cls.__new__(cls)
+        bm25.tokenizer = tokenizer or tokenize
+        bm25.corpus = state["corpus"]
+        bm25.doc_len = state["doc_len"]
+        bm25.total_len = state["total_len"]
+        bm25.avgdl = state["avgdl"]
+        bm25.deleted = state["deleted"]
+        bm25.n = len(bm25.corpus) - len(bm25.deleted)
+        bm25._reset_caches()
+        bm25.packed = state["packed"]
+        bm25.inverted = {}
+        bm25.df = state["df"]
+        bm25.bounds = state["bounds"]
+        bm25.meta = state["meta"]
+        return bm25
+
+
+# 分片 worker 进程内的 BM25 分片，由 _shard_init 在进程启动时建好
+_shard: Optional[BM25] = None
+
+
+def _shard_init(state: Dict) -> None:
+    """
+    worker 进程初始化：用主进程切好的倒排建一个只含本分片文档的 BM25。
+    doc_id 保持全局编号，n / avgdl 用全局值；本地 df 只用来判断 term 是否出现，
+    idf 由主进程随查询下发。
+    """
+    global _shard
+    shard = BM25.__new__(BM25)
+    shard.tokenizer = tokenize
+    shard.corpus = []  # 原文留在主进程
+    shard.doc_len = state["doc_len"]
+    shard.total_len = 0
+    shard.avgdl = state["avgdl"]
+    shard.deleted = set()
+    shard.n = state["n"]
+    shard.meta = {}
+    shard._reset_caches()
+    shard.packed = {}
+    shard.inverted = {}
+    shard.df = {}
+    shard.bounds = {}  # 分片没有原文，不剪枝（见 _search_maxscore）
+    for token, (doc_ids, tfs) in state["postings"].items():
+        shard.inverted[token] = dict(zip(doc_ids, tfs))
+        shard.df[token] = len(doc_ids)
+    _shard = shard
+
+
+def _shard_search(
+    token_lists: List[List[str]],
+    idfs: Dict[str, float],
+    top_k: int,
+    threshold: float,
+) -> List[List[Tuple[int, float]]]:
+    """在本分片上执行一批查询，返回各查询的分片内 top_k。"""
+    _shard._idf_cache.update(idfs)
+    return [_shard._search_tokens(tokens, top_k, threshold) for tokens in token_lists]
+
+
+class ShardedBM25:
+    """
+    BM25 的分片并行版本：按 doc_id 区间把倒排切成若干分片，每个分片常驻一个
+    worker 进程（ProcessPoolExecutor）。n / df / avgdl 用全局统计，idf 由主进程
+    算好随查询下发，各分片打分与不分片时逐位相同；分片各取 top_k 后主进程按
+    (分数降序, doc_id 升序) 归并，结果与 BM25.search 完全一致。
+
+    分片是建立时的快照，源索引增删改之后需要重新建立；用完调用 close()。
+    """
+
+    def __init__(self, bm25: BM25, num_shards: int = SHARD_COUNT):
+        self.bm25 = bm25
+        self.tokenizer = bm25.tokenizer
+        self.corpus = bm25.corpus
+        self.n = bm25.n
+        self.meta = bm25.meta
+
+        size = len(bm25.corpus)
+        num_shards = max(1, min(num_shards, size))
+        edges = [size * i // num_shards for i in range(num_shards + 1)]
+        states = [
+            {"doc_len": bm25.doc_len, "avgdl": bm25.avgdl, "n": bm25.n, "postings": {}}
+            for _ in range(num_shards)
+        ]
+        for token in bm25.df:
+            postings = bm25._postings(token)
+            doc_ids = sorted(postings)
+            tfs = list(map(postings.__getitem__, doc_ids))
+            start = 0
+            for shard, state in enumerate(states):
+                end = bisect_left(doc_ids, edges[shard + 1], start)
+                if end > start:
+                    state["postings"][token] = (
+                        array("I", doc_ids[start:end]),
+                        array("I", tfs[start:end]),
+                    )
+                start = end
+
+        self._executors = [
+            ProcessPoolExecutor(
+                max_workers=1, initializer=_shard_init, initargs=(state,)
+            )
+            for state in states
+        ]
+
+    def search(
+        self, query: str, top_k: int = 5, threshold: float = 0.0
+    ) -> List[Tuple[int, float]]:
+        """与 BM25.search 相同的接口和结果。"""
+        return self.search_many([query], top_k, threshold)[0]
+
+    def search_many(
+        self, queries: List[str], top_k: int = 5, threshold: float = 0.0
+    ) -> List[List[Tuple[int, float]]]:
+        """
+        批量搜索：整批查询一次性发给所有分片并行打分，每个分片一次进程间往返。
+        重复的 query 只算一次。
+        """
+        unique = list(dict.fromkeys(queries))
+        token_lists = [self.tokenizer(query) for query in unique]
+        df = self.bm25.df
+        idfs = {
+            token: self.bm25.idf(token)
+            for tokens in token_lists
+            for token in tokens
+            if token in df
+        }
+        futures = [
+            executor.submit(_shard_search, token_lists, idfs, top_k, threshold)
+            for executor in self._executors
+        ]
+        per_shard = [future.result() for future in futures]
+
+        results: Dict[str, List[Tuple[int, float]]] = {}
+        for i, query in enumerate(unique):
+            hits = [hit for shard_hits in per_shard for hit in shard_hits[i]]
+            results[query] = heapq.nsmallest(
+                top_k, hits, key=lambda x: (-x[1], x[0])
+            )
+        return [results[query] for query in queries]
+
+    def close(self) -> None:
+        """关闭所有分片 worker 进程。"""
+        for executor in self._executors:
+            executor.shutdown()
+        self._executors = []
+
+    def __enter__(self) -> "ShardedBM25":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def shard_if_large(
+    bm25: BM25, min_docs: int = SHARD_MIN_DOCS, num_shards: int = SHARD_COUNT
+):
+    """
+    有效文档数达到 min_docs 且分片数大于 1（默认不满足，见 SHARD_COUNT）时
+    返回 ShardedBM25，否则原样返回 bm25。返回 ShardedBM25 时调用方负责 close()。
+    """
+    if num_shards > 1 and bm25.n >= min_docs:
+        return ShardedBM25(bm25, num_shards)
+    return bm25
+
+
+def _check_pruning(texts: List[str], n_queries: int = 300, seed: int = 1) -> bool:
+    """
+    剪枝一致性校验：随机 query（原文片段、高频字组合）在不同 top_k / threshold
+    下对比 MaxScore 与不剪枝的 _search_numpy，结果必须逐位相同；
+    再做一轮增删改并 pack()（上界按剩余倒排重算）之后重复一次。
+    同时报告冷缓存下两者的平均耗时。
+    """
+    import random
+
+    if np is None:
+        print("没有 NumPy，MaxScore 剪枝不启用，无需校验")
+        return True
+    rng = random.Random(seed)
+    bm25 = BM25(texts)
+    frequent = "".join(
+        sorted(
+            (t for t in bm25.df if len(t) == 1 and _HAN_RE.match(t)),
+            key=bm25.df.get,
+            reverse=True,
+        )[:20]
+    )
+
+    def sample_query() -> str:
+        text = rng.choice(texts)
+        start = rng.randrange(max(len(text) - 12, 1))
+        piece = text[start : start + rng.randint(2, 12)]
+        if frequent and rng.random() < 0.5:
+            piece += " " + "".join(rng.sample(frequent, rng.randint(1, 3)))
+        return piece
+
+    queries = [sample_query() for _ in range(n_queries)]
+    ok = True
+    for phase in ("初始索引", "增删改并 pack() 之后"):
+        mismatches = 0
+        timings = {"maxscore": 0.0, "exhaustive": 0.0}
+        for i, query in enumerate(queries):
+            tokens = bm25.tokenizer(query)
+            top_k = (1, 5, 20)[i % 3]
+            threshold = (0.0, 2.0)[i % 2]
+            results = {}
+            for name, method in (
+                ("maxscore", bm25._search_maxscore),
+                ("exhaustive", bm25._search_numpy),
+            ):
+                bm25._reset_caches()
+                start = time.perf_counter()
+                results[name] = method(tokens, top_k, threshold) if tokens else []
+                timings[name] += time.perf_counter() - start
+            if results["maxscore"] != results["exhaustive"]:
+                mismatches += 1
+                print(f"  不一致: {query!r} top_k={top_k} threshold={threshold}")
+        print(
+            f"{phase}: {len(queries)} 条 query，不一致 {mismatches} 条；平均耗时 "
+            f"MaxScore {timings['maxscore'] / len(queries) * 1000:.2f} ms，"
+            f"不剪枝 {timings['exhaustive'] / len(queries) * 1000:.2f} ms"
+        )
+        ok = ok and mismatches == 0
+        # 改写一部分文档、删掉一部分、再追加几篇
+        live = [i for i in range(len(bm25.corpus)) if i not in bm25.deleted]
+        for doc_id in rng.sample(live, min(len(live) // 10, 500)):
+            bm25.update_document(doc_id, rng.choice(texts)[: rng.randint(10, 400)])
+        bm25.remove_documents(rng.sample(live, min(len(live) // 20, 200)))
+        bm25.add_documents([rng.choice(texts) + sample_query() for _ in range(50)])
+        bm25.pack()
+    return ok
+
+
+def _read_bench_texts(paths: List[str]) -> List[str]:
+    texts = []
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            texts.extend(re.split(r"\n(?=## )", f.read()))
+    return texts
+
 
-        return scored[:top_k]
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--check":
+        check_texts = _read_bench_texts(sys.argv[2:])
+        if not check_texts:
+            print("用法: python bm25_utils.py --check 记忆文件 [...]")
+            sys.exit(2)
+        sys.exit(0 if _check_pruning(check_texts) else 1)
+    else:
+        print("用法: python bm25_utils.py --check 记忆文件 [...]")
@@ -0,0 +1,442 @@
+#!/usr/bin/env python3
+"""
+Chunk catalog: one way of splitting the long-term memory files, shared by
+every index.
+
+A memory file splits into
+- sections: the "## " pieces recall works with (BM25, the keyword index,
+  random recall, the access log), as "【category】\n<text>";
+- chunks: sections cut to embedding size (semantic index, deduplication),
+  streamed by iter_chunks, each carrying the ID of the section it came from.
+Both carry stable content-addressed IDs (blake2b, identical across
+processes, unlike hash()), so access-log entries, caches and statistics
+keyed on them line up between tools and runs.
+
+The catalog persists only what is costly to recompute and small to store:
+per file, the section IDs and the byte range of each section in the file
+(<catalog dir>/<file>.pkl, reused while the file's (mtime_ns, size)
+signature is unchanged). Section text is sliced from the file by those
+ranges; only files with \r line endings keep their section text in the
+catalog. Chunks are never stored. This module only uses the standard
+library, so recall can use it without NumPy.
+"""
+
+import os
+import re
+import pickle
+import hashlib
+from array import array
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+CATALOG_VERSION = 2
+CHUNK_MAX_CHARS = 500
+
+# Long-term memory files, in catalog order
+MEMORY_FILES = [
+    "work.md",
+    "hobby.md",
+    "invest.md",
+    "learning.md",
+    "life.md",
+    "thoughts.md",
+    "projects.md",
+]
+
+_SECTION_SPLIT_RE = re.compile(r"\n(?=## )")
+_SECTION_SPLIT_BYTES_RE = re.compile(rb"\n(?=## )")
+# Entry dates: "### title（YYYY-MM-DD）" headers
+_ENTRY_DATE = re.compile(r"^###\s.*?[（(](\d{4}-\d{2}-\d{2})[）)]", re.M)
+_HEADER_DATE = re.compile(r"[（(](\d{4}-\d{2}-\d{2})[）)]")
+
+
+def split_sections(content: str) -> List[Tuple[int, int]]:
+    """
+    (start, end) character spans of the "## " sections of a memory file,
+    stripped of surrounding whitespace, skipping the # title.
+    """
+    spans = []
+    start = 0
+    ends = [m.start() for m in _SECTION_SPLIT_RE.finditer(content)]
+    for end in ends + [len(content)]:
+        piece = content[start:end]
+        section = piece.strip()
+        if section and not section.startswith("# "):
+            lead = len(piece) - len(piece.lstrip())
+            spans.append((start + lead, start + lead + len(section)))
+        start = end + 1
+    return spans
+
+
+def chunk_markdown(
+    text: str,
+    source_file: str = "unknown",
+    category: str = "unknown",
+    max_chars: int = CHUNK_MAX_CHARS,
+) -> List[Dict]:
+    """
+    Split markdown text into chunks by ## headers.
+    Long sections are recursively split.
+
+    Returns list of dicts with keys:
+    - text: chunk content
+    - source: source filename
+    - category: memory category
+    - section: header hierarchy (e.g., "Work > Projects")
+    - char_range: (start, end) tuple
+    - hash: content hash (see chunk_hash)
+    - date: latest entry date "YYYY-MM-DD" (see entry_date), or None
+    - section_id: ID of the section the chunk belongs to (see section_id)
+    """
+    return list(
+        iter_chunks(_SECTION_SPLIT_RE.split(text), source_file, category, max_chars)
+    )
+
+
+def iter_file_sections(path: str) -> Iterator[str]:
+    """
+    Stream a markdown file as the sections chunk_markdown splits it into
+    (a new one at every "## " line), reading line by line.
+    """
+    lines = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if lines and line.startswith("## "):
+                yield "".join(lines)[:-1]  # the newline before the header
+                lines = []
+            lines.append(line)
+    if lines:
+        yield "".join(lines)
+
+
+def iter_chunks(
+    sections: Iterable[str],
+    source_file: str = "unknown",
+    category: str = "unknown",
+    max_chars: int = CHUNK_MAX_CHARS,
+) -> Iterator[Dict]:
+    """
+    Chunks of a stream of "## " sections, in order, skipping exact
+    duplicates within the file. See chunk_markdown for the chunk keys.
+    """
+    seen = set()
+    current_pos = 0
+    header_stack = []
+
+    for section in sections:
+        section = section.strip()
+        if not section:
+            current_pos += 1
+            continue
+
+        # Skip top-level # headers (file title)
+        if section.startswith("# ") and not section.startswith("## "):
+            current_pos += len(section) + 1
+            continue
+        # The section as recall returns it (see ChunkCatalog.sections)
+        parent_id = section_id(f"【{category}】\n{section}")
+
+        # Extract header if present
+        lines = section.split("\n", 1)
+        if lines[0].startswith("## "):
+            # Track header hierarchy, reset for ## level
+            header_stack = [lines[0][3:].strip()]
+        elif lines[0].startswith("### "):
+            header = lines[0][4:].strip()
+            if header_stack:
+                header_stack = [header_stack[0], header]
+            else:
+                header_stack = [header]
+
+        section_path = " > ".join(header_stack) if header_stack else "Untitled"
+
+        # Handle long sections by splitting
+        if len(section) > max_chars:
+            sub_chunks = _split_long_text(section, max_chars)
+            pieces = []
+            for i, sub_chunk in enumerate(sub_chunks):
+                pieces.append(
+                    (
+                        sub_chunk.strip(),
+                        f"{section_path} (part {i + 1})"
+                        if len(sub_chunks) > 1
+                        else section_path,
+                        (current_pos, current_pos + len(sub_chunk)),
+                    )
+                )
+                current_pos += len(sub_chunk)
+        else:
+            pieces = [(section, section_path, (current_pos, current_pos + len(section)))]
+
+        # A part of a split section without an entry header of its own
+        # continues the last entry of the part before it; leading parts
+        # (e.g. just the ## header) take the first entry that follows
+        piece_dates = []
+        carried = None
+        for chunk_text, path, _ in pieces:
+            dates = _ENTRY_DATE.findall(chunk_text) or _HEADER_DATE.findall(path)
+            piece_dates.append(max(dates) if dates else carried)
+            carried = dates[-1] if dates else carried
+        following = None
+        for i in range(len(pieces) - 1, -1, -1):
+            following = piece_dates[i] = piece_dates[i] or following
+
+        for (chunk_text, path, char_range), chunk_date in zip(pieces, piece_dates):
+            key = chunk_hash(chunk_text)
+            if key in seen:
+                continue
+            seen.add(key)
+            yield {
+                "text": chunk_text,
+                "source": source_file,
+                "category": category,
+                "section": path,
+                "char_range": char_range,
+                "hash": key,
+                "date": chunk_date,
+                "section_id": parent_id,
+            }
+
+        current_pos += len(section) + 1
+
+
+def entry_date(text: str, section: str = "") -> Optional[str]:
+    """
+    Date of a chunk: the latest （YYYY-MM-DD） of the ### entries it contains,
+    else the one in its section header (a part of a split entry), else None.
+    """
+    dates = _ENTRY_DATE.findall(text) or _HEADER_DATE.findall(section)
+    return max(dates) if dates else None
+
+
+def _split_long_text(text: str, max_chars: int) -> List[str]:
+    """Split long text at paragraph/sentence boundaries."""
+    if len(text) <= max_chars:
+        return [text]
+
+    chunks = []
+    # The chunk being filled, as pieces joined on flush, and its joined length
+    parts: List[str] = []
+    size = 0
+
+    def flush():
+        nonlocal parts, size
+        if size:
+            chunks.append("".join(parts))
+        parts, size = [], 0
+
+    def add(piece: str, separator: str):
+        nonlocal size
+        if size:
+            parts.append(separator)
+            size += len(separator)
+        parts.append(piece)
+        size += len(piece)
+
+    # Split by paragraphs first
+    for para in text.split("\n\n"):
+        if size + len(para) + 2 <= max_chars:
+            add(para, "\n\n")
+            continue
+        flush()
+        if len(para) > max_chars:
+            # A single paragraph that is too long is split by sentences
+            for sent in re.split(r"(?<=[.!?。！？])\s+", para):
+                if size + len(sent) + 1 > max_chars:
+                    flush()
+                add(sent, " ")
+        else:
+            add(para, "\n\n")
+
+    flush()
+    return chunks
+
+
+def chunk_hash(text: str) -> str:
+    """Stable content hash of a chunk; unlike hash(), identical across processes."""
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def section_id(section: str) -> str:
+    """Stable ID of a section: the chunk_hash of its text as recall returns it."""
+    return chunk_hash(section)
+
+
+def parse_file(path: str, filename: str) -> Dict:
+    """
+    Split one memory file into its sections (see split_sections):
+    - sections: "【category】\n<text>" sections
+    - byte_ranges: flat array('Q') of (start, end) byte offsets of each
+      section's text in the file, None if the file has \r line endings
+      (text mode changes offsets; the text is then normalized like it)
+    The file is split as bytes, so offsets need no re-encoding of the text.
+    """
+    with open(path, "rb") as f:
+        raw = f.read()
+    prefix = f"【{filename.replace('.md', '')}】\n"
+
+    if b"\r" in raw:
+        content = raw.decode("utf-8").replace("\r\n", "\n").replace("\r", "\n")
+        sections = [prefix + content[s:e] for s, e in split_sections(content)]
+        return {"sections": sections, "byte_ranges": None}
+
+    # Same pieces as split_sections; "\n" never occurs inside a UTF-8
+    # sequence, so each piece decodes on its own
+    sections = []
+    byte_ranges = array("Q")
+    start = 0
+    ends = [m.start() for m in _SECTION_SPLIT_BYTES_RE.finditer(raw)]
+    for end in ends + [len(raw)]:
+        piece = raw[start:end].decode("utf-8")
+        section = piece.strip()
+        if section and not section.startswith("# "):
+            lead = piece[: len(piece) - len(piece.lstrip())]
+            trail = piece[len(piece.rstrip()) :]
+            sections.append(prefix + section)
+            byte_ranges.append(start + len(lead.encode("utf-8")))
+            byte_ranges.append(end - len(trail.encode("utf-8")))
+        start = end + 1
+    return {"sections": sections, "byte_ranges": byte_ranges}
+
+
+def _slice_sections(path: str, filename: str, byte_ranges: array) -> List[str]:
+    """Sections of an unchanged file, cut out by their recorded byte ranges."""
+    with open(path, "rb") as f:
+        raw = f.read()
+    prefix = f"【{filename.replace('.md', '')}】\n"
+    return [
+        prefix + raw[byte_ranges[i] : byte_ranges[i + 1]].decode("utf-8")
+        for i in range(0, len(byte_ranges), 2)
+    ]
+
+
+class ChunkCatalog:
+    """
+    Sections, section IDs and byte ranges of the memory files in
+    memories_dir; IDs and ranges persisted under catalog_dir (None: not
+    persisted), everything cached in-process.
+    """
+
+    def __init__(
+        self,
+        memories_dir: str,
+        catalog_dir: Optional[str],
+        files: Optional[List[str]] = None,
+    ):
+        self.memories_dir = memories_dir
+        self.catalog_dir = catalog_dir
+        self.files = list(files or MEMORY_FILES)
+        self._entries: Dict[str, Dict] = {}
+
+    def entry(self, filename: str) -> Optional[Dict]:
+        """
+        {"signature", "sections", "byte_ranges", "section_ids"} of one file
+        (see parse_file; section_ids: the 16-byte IDs concatenated), None if
+        the file does not exist.
+        """
+        path = os.path.join(self.memories_dir, filename)
+        try:
+            st = os.stat(path)
+        except OSError:
+            self._entries.pop(filename, None)
+            return None
+        signature = [st.st_mtime_ns, st.st_size]
+
+        entry = self._entries.get(filename)
+        if entry is not None and entry["signature"] == signature:
+            return entry
+        entry = self._load(filename)
+        if entry is None or entry["signature"] != signature:
+            entry = None
+        elif entry["byte_ranges"] is not None:
+            # An empty array (file without sections) is a valid entry too
+            try:
+                entry["sections"] = _slice_sections(path, filename, entry["byte_ranges"])
+            except (OSError, UnicodeDecodeError):
+                entry = None  # changed under us; parse it again
+        elif "sections" not in entry:
+            entry = None
+        if entry is None:
+            # Signature taken before reading: an edit during the parse is
+            # picked up on the next call
+            entry = parse_file(path, filename)
+            entry["signature"] = signature
+            entry["section_ids"] = b"".join(
+                bytes.fromhex(section_id(section)) for section in entry["sections"]
+            )
+            self._save(filename, entry)
+        self._entries[filename] = entry
+        return entry
+
+    def _path(self, filename: str) -> str:
+        return os.path.join(self.catalog_dir, filename + ".pkl")
+
+    def _load(self, filename: str) -> Optional[Dict]:
+        if not self.catalog_dir:
+            return None
+        try:
+            with open(self._path(filename), "rb") as f:
+                entry = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ValueError):
+            return None
+        if not isinstance(entry, dict) or entry.get("version") != CATALOG_VERSION:
+            return None
+        return entry
+
+    def _save(self, filename: str, entry: Dict) -> None:
+        if not self.catalog_dir:
+            return
+        stored = {
+            "version": CATALOG_VERSION,
+            "signature": entry["signature"],
+            "byte_ranges": entry["byte_ranges"],
+            "section_ids": entry["section_ids"],
+        }
+        if entry["byte_ranges"] is None:
+            # \r line endings: offsets into the file do not match the
+            # normalized text, so the sections themselves are kept
+            stored["sections"] = entry["sections"]
+        path = self._path(filename)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(self.catalog_dir, exist_ok=True)
+            with open(temp_path, "wb") as f:
+                pickle.dump(stored, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, path)
+        except OSError:
+            # The catalog is a cache; parsing again next time is always correct
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def sections(self, filename: Optional[str] = None) -> List[str]:
+        """Sections of one file, or of all files in catalog order."""
+        names = [filename] if filename else self.files
+        return [
+            section
+            for name in names
+            for section in (self.entry(name) or {}).get("sections", [])
+        ]
+
+    def byte_ranges(self, filename: str) -> Optional[List[Tuple[int, int]]]:
+        """(start, end) byte offsets of each section of a file, None if unknown."""
+        ranges = (self.entry(filename) or {}).get("byte_ranges")
+        if ranges is None:
+            return None
+        return list(zip(ranges[0::2], ranges[1::2]))
+
+    def section_ids(self, filename: str) -> List[str]:
+        """IDs of the sections of a file (see section_id), in order."""
+        ids = (self.entry(filename) or {}).get("section_ids", b"")
+        return [ids[i : i + 16].hex() for i in range(0, len(ids), 16)]
+
+
+_catalogs: Dict[Tuple, ChunkCatalog] = {}
+
+
+def get_catalog(
+    memories_dir: str, catalog_dir: Optional[str], files: Optional[List[str]] = None
+) -> ChunkCatalog:
+    """Shared catalog instance per (memories_dir, catalog_dir, files)."""
+    key = (memories_dir, catalog_dir, tuple(files or MEMORY_FILES))
+    if key not in _catalogs:
+        _catalogs[key] = ChunkCatalog(memories_dir, catalog_dir, files)
+    return _catalogs[key]
@@ -2,254 +2,1404 @@
 """Embedding utilities for semantic memory search."""
 
 import os
-import re
+import sys
 import json
+import time
+import shutil
+import queue
+import hashlib
+import sqlite3
+import tempfile
+import threading
+import multiprocessing
 import numpy as np
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
 from pathlib import Path
-from typing import List, Dict, Optional, Tuple
-from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+from datetime import date, datetime
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from chunk_catalog import (  # noqa: F401  (chunking API re-exported here)
+    MEMORY_FILES,
+    chunk_hash,
+    chunk_markdown,
+    entry_date,
+    iter_chunks,
+    iter_file_sections,
+)
+
+MODEL_NAME = "all-MiniLM-L6-v2"
+
+# Encoder backend: "torch" (sentence_transformers) or "onnx" (onnx_encoder.py,
+# ONNX Runtime on CPU without importing torch); LIZI_ONNX_INT8=1 selects the
+# dynamically quantized ONNX model
+EMBED_BACKEND = os.environ.get("LIZI_EMBED_BACKEND", "torch")
+ONNX_INT8 = os.environ.get("LIZI_ONNX_INT8", "") == "1"
+
+# Resident worker (embedding_worker.py) socket; one per user, inside a private
+# 0700 directory under $XDG_RUNTIME_DIR or the temp dir (ipc_utils.private_socket_dir)
+WORKER_SOCKET_PATH = os.environ.get("LIZI_EMBED_SOCKET") or os.path.join(
+    os.environ.get("XDG_RUNTIME_DIR") or tempfile.gettempdir(),
+    f"lizi-{os.getuid()}",
+    "embed.sock",
+)
+WORKER_TIMEOUT = 600.0
+
+# Persistent embedding cache shared by all tools; set LIZI_EMBED_CACHE="" to disable
+EMBEDDING_CACHE_PATH = os.environ.get(
+    "LIZI_EMBED_CACHE", os.path.expanduser("~/.cache/lizi/embedding_cache.sqlite")
+)
+EMBEDDING_CACHE_MAX_BYTES = (
+    int(os.environ.get("LIZI_EMBED_CACHE_MAX_MB", "256")) * 1024 * 1024
+)
+# float16 halves the cache size at ~1e-3 precision loss per component
+EMBEDDING_CACHE_DTYPE = os.environ.get("LIZI_EMBED_CACHE_DTYPE", "float32")
+
+# Index builds: encoding processes (1 = in-process) and texts per model call
+EMBED_WORKERS = int(os.environ.get("LIZI_EMBED_WORKERS", "1"))
+ENCODE_BATCH_SIZE = 64
+# New chunks encoded per step while a build is still chunking the files
+PIPELINE_FLUSH = 1024
+# How far the chunking thread may run ahead of the encoder, in batches of
+# PIPELINE_BATCH chunks (bounds the memory held by parsed, unencoded chunks)
+PIPELINE_BATCH = 256
+PIPELINE_QUEUE_BATCHES = 8
+
+# On-disk index layout (see save_index). Each build is written to a fresh
+# generation directory SEMANTIC_DIR_PREFIX<ns> inside the index directory and
+# published by atomically replacing the CURRENT_FILE pointer (see publish_index)
+INDEX_VERSION = 1
+CURRENT_FILE = "semantic.current"
+SEMANTIC_DIR_PREFIX = "semantic."
+MANIFEST_FILE = "manifest.json"
+QUANT_VECTORS_FILE = "vectors.i8.npy"
+QUANT_SCALES_FILE = "scales.npy"
+# Optional float32 copy of the vectors, written only with LIZI_INDEX_FLOAT32=1;
+# searches then rescore their best candidates exactly (see QuantizedVectors)
+FLOAT32_FILE = "embeddings.npy"
+KEEP_FLOAT32 = os.environ.get("LIZI_INDEX_FLOAT32", "") == "1"
+CHUNKS_FILE = "chunks.meta.npz"
+CHUNK_TEXT_FILE = "chunks.text"
+# Chunk catalog shared with recall (see chunk_catalog), inside the index directory
+# Metadata files of earlier layouts, removed on the next save
+LEGACY_CHUNK_FILES = ["chunks.json", "chunks.jsonl", "chunks.idx.npy"]
+# mtimes this close to the build time are not trusted (coarse clock resolution)
+RACY_MTIME_NS = 2_000_000_000
+# With a float32 copy, this many int8 candidates per result are rescored
+RESCORE_FACTOR = 4
+# Rows dequantized at a time while scanning, bounds temporary memory
+SCAN_BLOCK = 65536
+
+# Entry dates (see chunk_catalog.entry_date) are stored as days since 1970-01-01
+NO_DATE = np.iinfo(np.int32).min
 
 # Lazy-loaded model
 _model = None
+# Intra-op threads for the model, set in encoding processes (0 = library default)
+_encode_threads = 0
+# Encoding processes, kept across _encode calls of a build (see close_encode_pool)
+_encode_pool = None
+_encode_pool_size = 0
 
 
 def load_model():
-    """Load SentenceTransformer model (lazy, cached)."""
-    global _model
+    """
+    Load the embedding model (lazy, cached): a SentenceTransformer, or with
+    EMBED_BACKEND "onnx" an OnnxEncoder with the same encode() interface.
+    Falls back to the SentenceTransformer if the ONNX model is unavailable;
+    EMBED_BACKEND then becomes "torch", so embedding_model_key() and the
+    embedding cache follow the model that actually loaded.
+    """
+    global _model, EMBED_BACKEND
+    if _model is None and EMBED_BACKEND == "onnx":
+        try:
+            from onnx_encoder import OnnxEncoder
+
+            _model = OnnxEncoder(quantized=ONNX_INT8, threads=_encode_threads)
+        except (ImportError, OSError, RuntimeError, ValueError) as e:
+            print(
+                f"Warning: ONNX backend unavailable ({e}), using sentence_transformers; "
+                "run onnx_encoder.py --export",
+                file=sys.stderr,
+            )
+            EMBED_BACKEND = "torch"
+            if _embedding_cache is not None:
+                _embedding_cache.model = embedding_model_key()
     if _model is None:
         # Set offline mode if model already cached
         os.environ.setdefault("HF_HUB_OFFLINE", "1")
         from sentence_transformers import SentenceTransformer
 
-        _model = SentenceTransformer("all-MiniLM-L6-v2")
+        _model = SentenceTransformer(MODEL_NAME)
     return _model
 
 
-def chunk_markdown(
-    text: str,
-    source_file: str = "unknown",
-    category: str = "unknown",
-    max_chars: int = 500,
-) -> List[Dict]:
+def embedding_model_key() -> str:
     """
-    Split markdown text into chunks by ## headers.
-    Long sections are recursively split.
+    Model identity for cached vectors. The int8 ONNX model gives slightly
+    different vectors, so it is kept apart; fp32 ONNX matches torch.
+    """
+    if EMBED_BACKEND == "onnx" and ONNX_INT8:
+        return f"{MODEL_NAME}/onnx-int8"
+    return MODEL_NAME
+
 
-    Returns list of dicts with keys:
-    - text: chunk content
-    - source: source filename
-    - category: memory category
-    - section: header hierarchy (e.g., "Work > Projects")
-    - char_range: (start, end) tuple
+def _encode_via_worker(texts: List[str]) -> Optional[np.ndarray]:
     """
-    chunks = []
+    Encode with the resident worker; None if it is not running, fails, or
+    serves a different model (the request carries embedding_model_key()).
+    """
+    if not os.path.exists(WORKER_SOCKET_PATH):
+        return None
+    from ipc_utils import IPCError, owned_socket, request
 
-    # Split by ## headers
-    sections = re.split(r"\n(?=## )", text)
+    if not owned_socket(WORKER_SOCKET_PATH):
+        return None
+    try:
+        header, payload = request(
+            WORKER_SOCKET_PATH,
+            {"op": "encode", "texts": texts, "model_key": embedding_model_key()},
+            timeout=WORKER_TIMEOUT,
+        )
+    except (OSError, IPCError):
+        return None
+    if not header.get("ok"):
+        # Includes a worker running a different backend/model: its vectors
+        # would not match the cache or the index, so encode locally
+        return None
+    return np.frombuffer(payload, dtype=np.float32).reshape(header["shape"])
 
-    current_pos = 0
-    header_stack = []
 
-    for section in sections:
-        section = section.strip()
-        if not section:
-            current_pos += 1
-            continue
+def day_number(value: Union[str, date, None]) -> int:
+    """Days since 1970-01-01 of a date or "YYYY-MM-DD"; NO_DATE if missing/invalid."""
+    if value is None:
+        return NO_DATE
+    try:
+        return int(np.datetime64(value, "D").astype(np.int64))
+    except ValueError:
+        return NO_DATE
 
-        # Skip top-level # headers (file title)
-        if section.startswith("# ") and not section.startswith("## "):
-            current_pos += len(section) + 1
-            continue
 
-        # Extract header if present
-        lines = section.split("\n", 1)
-        header = ""
-        content = section
-
-        if lines[0].startswith("## "):
-            header = lines[0][3:].strip()
-            content = lines[1].strip() if len(lines) > 1 else ""
-            # Track header hierarchy
-            header_stack = [header]  # Reset for ## level
-        elif lines[0].startswith("### "):
-            header = lines[0][4:].strip()
-            content = lines[1].strip() if len(lines) > 1 else ""
-            if header_stack:
-                header_stack = [header_stack[0], header]
-            else:
-                header_stack = [header]
-
-        section_path = " > ".join(header_stack) if header_stack else "Untitled"
-
-        # Handle long sections by splitting
-        if len(section) > max_chars:
-            sub_chunks = _split_long_text(section, max_chars)
-            for i, sub_chunk in enumerate(sub_chunks):
-                chunks.append(
-                    {
-                        "text": sub_chunk.strip(),
-                        "source": source_file,
-                        "category": category,
-                        "section": f"{section_path} (part {i + 1})"
-                        if len(sub_chunks) > 1
-                        else section_path,
-                        "char_range": (current_pos, current_pos + len(sub_chunk)),
-                    }
-                )
-                current_pos += len(sub_chunk)
+class EmbeddingCache:
+    """
+    Persistent content-addressed embedding store (SQLite), keyed by
+    (model name, text hash). Vectors are kept as float32 or float16; once
+    the stored vectors exceed max_bytes, the least recently used are evicted.
+    Hit/miss counters are kept per instance and cumulatively in the file.
+    """
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS embeddings (
+            id INTEGER PRIMARY KEY,
+            model TEXT NOT NULL,
+            key BLOB NOT NULL,
+            dtype TEXT NOT NULL,
+            vector BLOB NOT NULL,
+            last_used REAL NOT NULL,
+            UNIQUE (model, key)
+        );
+        CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used);
+        CREATE TABLE IF NOT EXISTS stats (
+            id INTEGER PRIMARY KEY CHECK (id = 0),
+            hits INTEGER NOT NULL,
+            misses INTEGER NOT NULL,
+            bytes_saved INTEGER NOT NULL
+        );
+        INSERT OR IGNORE INTO stats VALUES (0, 0, 0, 0);
+    """
+
+    # SQLite limits the number of bound parameters per statement
+    _LOOKUP_BATCH = 500
+
+    def __init__(
+        self,
+        path: str,
+        model: str = MODEL_NAME,
+        dtype: str = EMBEDDING_CACHE_DTYPE,
+        max_bytes: int = EMBEDDING_CACHE_MAX_BYTES,
+    ):
+        self.path = path
+        self.model = model
+        self.dtype = np.dtype(dtype)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0  # UTF-8 bytes of text served without encoding
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.executescript(self._SCHEMA)
+
+    @staticmethod
+    def _key(text: str) -> bytes:
+        return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+    def get_many(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """Cached float32 vector for each text, None for misses."""
+        keys = [self._key(text) for text in texts]
+        found = {}
+        unique = list(dict.fromkeys(keys))
+        for i in range(0, len(unique), self._LOOKUP_BATCH):
+            batch = unique[i : i + self._LOOKUP_BATCH]
+            rows = self.conn.execute(
+                "SELECT key, dtype, vector FROM embeddings "
+                f"WHERE model = ? AND key IN ({','.join('?' * len(batch))})",
+                [self.model, *batch],
+            )
+            for key, dtype, blob in rows:
+                found[key] = np.frombuffer(blob, dtype=dtype).astype(np.float32)
+
+        results = [found.get(key) for key in keys]
+        hits = sum(vector is not None for vector in results)
+        saved = sum(
+            len(text.encode("utf-8"))
+            for text, vector in zip(texts, results)
+            if vector is not None
+        )
+        self.hits += hits
+        self.misses += len(texts) - hits
+        self.bytes_saved += saved
+
+        now = time.time()
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE model = ? AND key = ?",
+                [(now, self.model, key) for key in found],
+            )
+            self.conn.execute(
+                "UPDATE stats SET hits = hits + ?, misses = misses + ?, "
+                "bytes_saved = bytes_saved + ? WHERE id = 0",
+                (hits, len(texts) - hits, saved),
+            )
+        return results
+
+    def put_many(self, texts: List[str], vectors: np.ndarray) -> None:
+        """Store vectors for texts, then evict down to max_bytes."""
+        now = time.time()
+        rows = [
+            (
+                self.model,
+                self._key(text),
+                self.dtype.name,
+                np.ascontiguousarray(vector, dtype=self.dtype).tobytes(),
+                now,
+            )
+            for text, vector in zip(texts, vectors)
+        ]
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO embeddings "
+                "(model, key, dtype, vector, last_used) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._evict()
+
+    def _evict(self) -> None:
+        total = self.size_bytes()
+        if total <= self.max_bytes:
+            return
+        doomed = []
+        for row_id, size in self.conn.execute(
+            "SELECT id, LENGTH(vector) FROM embeddings ORDER BY last_used"
+        ):
+            if total <= self.max_bytes:
+                break
+            doomed.append((row_id,))
+            total -= size
+        self.conn.executemany("DELETE FROM embeddings WHERE id = ?", doomed)
+
+    def size_bytes(self) -> int:
+        return self.conn.execute(
+            "SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+        ).fetchone()[0]
+
+    def stats(self) -> Dict:
+        """Cumulative statistics across all processes that used this file."""
+        entries = self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        hits, misses, saved = self.conn.execute(
+            "SELECT hits, misses, bytes_saved FROM stats WHERE id = 0"
+        ).fetchone()
+        return {
+            "path": self.path,
+            "dtype": self.dtype.name,
+            "entries": entries,
+            "size_bytes": self.size_bytes(),
+            "max_bytes": self.max_bytes,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / (hits + misses), 4) if hits + misses else 0.0,
+            "bytes_saved": saved,
+        }
+
+
+_embedding_cache = None
+
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """Shared cache instance; None if disabled or the file cannot be opened."""
+    global _embedding_cache
+    if _embedding_cache is None and EMBEDDING_CACHE_PATH:
+        try:
+            _embedding_cache = EmbeddingCache(
+                EMBEDDING_CACHE_PATH, model=embedding_model_key()
+            )
+        except (sqlite3.Error, OSError, TypeError) as e:
+            print(f"Warning: embedding cache disabled: {e}", file=sys.stderr)
+            return None
+    return _embedding_cache
+
+
+def _init_encode_process(threads: int, backend: str, onnx_int8: bool) -> None:
+    """Encoding process setup: split the CPU between processes, load the model."""
+    global EMBED_BACKEND, ONNX_INT8, _encode_threads
+    EMBED_BACKEND, ONNX_INT8, _encode_threads = backend, onnx_int8, threads
+    if backend != "onnx":
+        try:
+            import torch
+
+            torch.set_num_threads(threads)
+        except ImportError:
+            pass
+    load_model()
+
+
+def _encode_batch(texts: List[str]) -> Tuple[np.ndarray, str]:
+    """Encode one bucket in an encoding process; also returns the backend it loaded."""
+    embeddings = (
+        load_model()
+        .encode(
+            texts,
+            batch_size=len(texts),
+            show_progress_bar=False,
+            convert_to_numpy=True,
+        )
+        .astype(np.float32)
+    )
+    return embeddings, EMBED_BACKEND
+
+
+def _get_encode_pool(workers: int) -> ProcessPoolExecutor:
+    global _encode_pool, _encode_pool_size
+    if _encode_pool is None or _encode_pool_size != workers:
+        close_encode_pool()
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        _encode_pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_encode_process,
+            initargs=(threads, EMBED_BACKEND, ONNX_INT8),
+        )
+        _encode_pool_size = workers
+    return _encode_pool
+
+
+def close_encode_pool() -> None:
+    """Stop the encoding processes started for workers > 1, if any."""
+    global _encode_pool
+    if _encode_pool is not None:
+        _encode_pool.shutdown()
+        _encode_pool = None
+
+
+def _adopt_backend(backends: set) -> None:
+    """Take over the backend the encoding processes fell back to, if any."""
+    global EMBED_BACKEND
+    if len(backends) > 1:
+        raise RuntimeError(f"encoding processes loaded different backends: {backends}")
+    (backend,) = backends
+    if backend != EMBED_BACKEND:
+        EMBED_BACKEND = backend
+        if _embedding_cache is not None:
+            _embedding_cache.model = embedding_model_key()
+
+
+def _encode(texts: List[str], show_progress: bool, workers: int = 1) -> np.ndarray:
+    """
+    Encode with the resident worker if it is running, else here.
+    Texts are sorted by length and cut into ENCODE_BATCH_SIZE buckets, so each
+    model batch pads to a similar length; with workers > 1 the buckets are
+    spread over that many processes, longest first. Output is in input order.
+    """
+    if not texts:
+        return np.empty((0, 0), dtype=np.float32)
+
+    start = time.perf_counter()
+    embeddings = _encode_via_worker(texts)
+    source = "resident worker"
+    if embeddings is None:
+        source = f"{workers} process(es)" if workers > 1 else "in-process"
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        ordered = [texts[i] for i in order]
+        buckets = [
+            ordered[i : i + ENCODE_BATCH_SIZE]
+            for i in range(0, len(ordered), ENCODE_BATCH_SIZE)
+        ]
+        if workers > 1 and len(buckets) > 1:
+            pool = _get_encode_pool(workers)
+            parts, backends = zip(*list(pool.map(_encode_batch, buckets[::-1]))[::-1])
+            _adopt_backend(set(backends))
         else:
-            if section.strip():
-                chunks.append(
-                    {
-                        "text": section.strip(),
-                        "source": source_file,
-                        "category": category,
-                        "section": section_path,
-                        "char_range": (current_pos, current_pos + len(section)),
-                    }
+            model = load_model()
+            parts = [
+                model.encode(
+                    ordered,
+                    batch_size=ENCODE_BATCH_SIZE,
+                    show_progress_bar=show_progress,
+                    convert_to_numpy=True,
                 )
+            ]
+        embeddings = np.empty((len(texts), parts[0].shape[1]), dtype=np.float32)
+        embeddings[order] = np.concatenate(parts)
+
+    if show_progress and len(texts) > 1:
+        elapsed = time.perf_counter() - start
+        print(
+            f"Encoded {len(texts)} chunks in {elapsed:.1f}s "
+            f"({len(texts) / elapsed:.1f} chunks/s, {source})",
+            file=sys.stderr,
+        )
+    return embeddings
+
+
+def generate_embeddings(
+    texts: List[str],
+    show_progress: bool = True,
+    use_cache: bool = True,
+    workers: int = 1,
+) -> np.ndarray:
+    """
+    Generate embeddings for a list of texts.
+    Vectors already in the embedding cache are reused and only cache misses
+    are encoded. Encoding uses the resident embedding worker when it is
+    running, so the caller skips the torch import and model load; otherwise
+    the model is loaded here, or in `workers` processes (see _encode).
+    """
+    cache = get_embedding_cache() if use_cache and texts else None
+    if cache is None:
+        return _encode(texts, show_progress, workers)
 
-        current_pos += len(section) + 1
+    saved_before = cache.bytes_saved
+    model_key = cache.model
+    try:
+        cached = cache.get_many(texts)
+    except sqlite3.Error:
+        return _encode(texts, show_progress, workers)
+    hits = sum(vector is not None for vector in cached)
+
+    missing = {}
+    for text, vector in zip(texts, cached):
+        if vector is None:
+            missing.setdefault(text, len(missing))
+    if missing:
+        fresh = _encode(list(missing), show_progress, workers)
+        try:
+            cache.put_many(list(missing), fresh)
+        except sqlite3.Error:
+            pass  # cache write failures never block encoding
+        if hits and cache.model != model_key:
+            # The ONNX model failed to load and encoding fell back to torch:
+            # the hits came from the other model, look them up again
+            return generate_embeddings(texts, show_progress, use_cache, workers)
+        cached = [
+            fresh[missing[text]] if vector is None else vector
+            for text, vector in zip(texts, cached)
+        ]
+
+    if show_progress and len(texts) > 1:
+        print(
+            f"Embedding cache: {hits}/{len(texts)} hits ({hits / len(texts):.1%}), "
+            f"{(cache.bytes_saved - saved_before) / 1024:.1f} KB of text not re-encoded",
+            file=sys.stderr,
+        )
+    return np.stack(cached).astype(np.float32, copy=False)
+
+
+def normalize_embeddings(embeddings: np.ndarray) -> np.ndarray:
+    """L2-normalize rows as float32; all-zero rows stay zero."""
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return embeddings / norms
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first (argpartition, not a full sort)."""
+    if k <= 0 or len(scores) == 0:
+        return np.empty(0, dtype=np.int64)
+    if k < len(scores):
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
 
-    # Remove exact duplicates within file
-    seen = set()
-    unique_chunks = []
-    for chunk in chunks:
-        text_hash = hash(chunk["text"])
-        if text_hash not in seen:
-            seen.add(text_hash)
-            unique_chunks.append(chunk)
 
-    return unique_chunks
+def quantize_embeddings(embeddings: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Symmetric int8 scalar quantization with one float32 scale per vector."""
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    scales = np.abs(embeddings).max(axis=1) / 127.0 if len(embeddings) else np.empty(0)
+    scales[scales == 0] = 1.0
+    vectors = np.round(embeddings / scales[:, None]).astype(np.int8)
+    return vectors, scales.astype(np.float32)
 
 
-def _split_long_text(text: str, max_chars: int) -> List[str]:
-    """Split long text at paragraph/sentence boundaries."""
-    if len(text) <= max_chars:
-        return [text]
+def quantized_scores(
+    vectors: np.ndarray, scales: np.ndarray, query: np.ndarray
+) -> np.ndarray:
+    """Approximate dot products against int8 vectors, scanned in blocks."""
+    scores = np.empty(len(vectors), dtype=np.float32)
+    for start in range(0, len(vectors), SCAN_BLOCK):
+        block = np.asarray(vectors[start : start + SCAN_BLOCK], dtype=np.float32)
+        scores[start : start + len(block)] = block @ query
+    return scores * scales
 
-    chunks = []
-    current = ""
 
-    # Split by paragraphs first
-    paragraphs = text.split("\n\n")
+class QuantizedVectors:
+    """
+    The index vectors as stored: int8 rows with one float32 scale each
+    (vectors.i8.npy + scales.npy, see quantize_embeddings), plus the float32
+    matrix (embeddings.npy) only for indexes built with KEEP_FLOAT32.
+
+    Indexing returns float32 rows, taken from the float32 copy when there is
+    one and dequantized otherwise, so code that needs vectors (k-means,
+    deduplication, incremental builds) works the same on either. search()
+    scores the int8 rows and rescores only the best candidates.
+    """
 
-    for para in paragraphs:
-        if len(current) + len(para) + 2 <= max_chars:
-            current += ("\n\n" if current else "") + para
+    def __init__(
+        self, vectors: np.ndarray, scales: np.ndarray, exact: Optional[np.ndarray] = None
+    ):
+        self.vectors = vectors
+        self.scales = scales
+        self.exact = exact
+
+    def __len__(self) -> int:
+        return len(self.vectors)
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return self.vectors.shape
+
+    @property
+    def ndim(self) -> int:
+        return self.vectors.ndim
+
+    def __getitem__(self, rows) -> np.ndarray:
+        if self.exact is not None:
+            return np.asarray(self.exact[rows], dtype=np.float32)
+        scales = np.asarray(self.scales[rows], dtype=np.float32)
+        return np.asarray(self.vectors[rows], dtype=np.float32) * scales[..., None]
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        matrix = self[:]
+        return matrix if dtype is None else matrix.astype(dtype, copy=False)
+
+    def search(
+        self,
+        query: np.ndarray,
+        top_k: int,
+        rows: Optional[np.ndarray] = None,
+        rescore: bool = True,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        (row indices, scores) of the top_k rows, or of the top_k among
+        `rows` (sorted, for sequential reads), best first. Only the int8 rows
+        are scanned. With a float32 copy and `rescore`, the best
+        RESCORE_FACTOR * top_k of them are rescored exactly; without one the
+        int8 scores are final (dequantizing would reproduce them).
+        """
+        if rows is None:
+            approx = quantized_scores(self.vectors, self.scales, query)
         else:
-            if current:
-                chunks.append(current)
-            # If single paragraph is too long, split by sentences
-            if len(para) > max_chars:
-                sentences = re.split(r"(?<=[.!?。！？])\s+", para)
-                current = ""
-                for sent in sentences:
-                    if len(current) + len(sent) + 1 <= max_chars:
-                        current += (" " if current else "") + sent
-                    else:
-                        if current:
-                            chunks.append(current)
-                        current = sent
-            else:
-                current = para
+            approx = quantized_scores(self.vectors[rows], self.scales[rows], query)
+        if self.exact is None or not rescore:
+            best = top_k_indices(approx, top_k)
+            return (best if rows is None else rows[best]), approx[best]
+        candidates = np.sort(top_k_indices(approx, top_k * RESCORE_FACTOR))
+        if rows is not None:
+            candidates = rows[candidates]
+        exact = np.asarray(self.exact[candidates], dtype=np.float32) @ query
+        best = top_k_indices(exact, top_k)
+        return candidates[best], exact[best]
+
+
+class ChunkStore:
+    """
+    Columnar chunk metadata (chunks.meta.npz): hash, source, category,
+    section, char_range, entry date and parent section ID (see
+    chunk_catalog) as arrays, with repeated strings stored once. The
+    columns back the metadata filters (see mask()).
+
+    Chunk text is not duplicated when it appears verbatim in its memory
+    file; it is stored as a byte range of that file. Other text goes to a
+    side blob (chunks.text). A record, including its text, is materialized
+    only when the chunk is accessed, so a query reads only the hits it
+    returns.
+    """
+
+    def __init__(self, index_path: Path):
+        with np.load(index_path / CHUNKS_FILE) as data:
+            header = json.loads(data["header"].tobytes().decode("utf-8"))
+            self.hash = data["hash"]
+            self.source_ids = data["source"]
+            self.category_ids = data["category"]
+            self.section_offsets = data["section_offsets"]
+            self.section_blob = data["section_blob"].tobytes()
+            self.char_ranges = data["char_range"]
+            self.in_source = data["in_source"]
+            self.text_start = data["text_start"]
+            self.text_len = data["text_len"]
+            # Stores written before entry dates were recorded have no date column
+            self.dates = (
+                data["date"]
+                if "date" in data.files
+                else np.full(len(self.hash), NO_DATE, dtype=np.int32)
+            )
+            # All-zero rows: no section ID recorded
+            self.section_ids = (
+                data["section_id"]
+                if "section_id" in data.files
+                else np.zeros_like(self.hash)
+            )
+        self.memories_dir = header["memories_dir"]
+        self.sources = header["sources"]
+        self.categories = header["categories"]
+        self.text_path = index_path / CHUNK_TEXT_FILE
+        # source -> {hash: text}, for memory files edited since the index was built
+        self._relocated: Dict[str, Dict[str, str]] = {}
+
+    def __len__(self) -> int:
+        return len(self.hash)
+
+    def __getitem__(self, i: int) -> Dict:
+        n = len(self)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError(i)
+        return {
+            "text": self.text(i),
+            "source": self.sources[self.source_ids[i]],
+            "category": self.categories[self.category_ids[i]],
+            "section": self.section_blob[
+                self.section_offsets[i] : self.section_offsets[i + 1]
+            ].decode("utf-8"),
+            "char_range": self.char_ranges[i].tolist(),
+            "hash": self.hash[i].tobytes().hex(),
+            "date": None
+            if self.dates[i] == NO_DATE
+            else str(np.datetime64(int(self.dates[i]), "D")),
+            "section_id": self.section_ids[i].tobytes().hex()
+            if self.section_ids[i].any()
+            else None,
+        }
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def mask(
+        self,
+        category=None,
+        source=None,
+        since: Union[str, date, None] = None,
+        until: Union[str, date, None] = None,
+    ) -> np.ndarray:
+        """Boolean row mask of chunks matching all given filters (see filter_mask)."""
+        mask = np.ones(len(self), dtype=bool)
+        if category is not None:
+            wanted = _as_set(category)
+            ids = [i for i, name in enumerate(self.categories) if name in wanted]
+            mask &= np.isin(self.category_ids, ids)
+        if source is not None:
+            wanted = _as_set(source)
+            ids = [i for i, name in enumerate(self.sources) if name in wanted]
+            mask &= np.isin(self.source_ids, ids)
+        return mask & _date_mask(self.dates, since, until)
+
+    def hashes(self) -> List[str]:
+        """Content hashes of all chunks, without reading any text."""
+        return [row.tobytes().hex() for row in self.hash]
+
+    def text(self, i: int) -> Optional[str]:
+        """
+        Chunk text. A byte range of a memory file is checked against the
+        chunk hash; if the file was edited since the build, the chunk is
+        looked up by hash in the file's current chunks, and None is returned
+        when it no longer exists. None is also returned for side-blob text
+        whose generation was removed by a later publish_index.
+        """
+        start, length = int(self.text_start[i]), int(self.text_len[i])
+        if not self.in_source[i]:
+            try:
+                with open(self.text_path, "rb") as f:
+                    f.seek(start)
+                    return f.read(length).decode("utf-8")
+            except OSError:
+                return None
+
+        source = self.sources[self.source_ids[i]]
+        path = os.path.join(self.memories_dir, source)
+        try:
+            with open(path, "rb") as f:
+                f.seek(start)
+                raw = f.read(length)
+        except OSError:
+            raw = b""
+        digest = self.hash[i].tobytes()
+        if hashlib.blake2b(raw, digest_size=16).digest() == digest:
+            return raw.decode("utf-8")
+
+        if source not in self._relocated:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    current = chunk_markdown(
+                        f.read(),
+                        source_file=source,
+                        category=self.categories[self.category_ids[i]],
+                    )
+            except OSError:
+                current = []
+            self._relocated[source] = {
+                chunk_hash(chunk["text"]): chunk["text"] for chunk in current
+            }
+        return self._relocated[source].get(digest.hex())
+
+    @staticmethod
+    def write(
+        index_path: Path, chunks: Iterable[Dict], memories_dir: Optional[str]
+    ) -> int:
+        """
+        Write chunks.meta.npz and chunks.text, returning the number of chunks.
+        With memories_dir, texts found verbatim in their source file are
+        stored as byte ranges of it. `chunks` is consumed once, in order:
+        side-blob text goes straight to chunks.text and only the columns are
+        kept, along with the contents of the memory file being read.
+        """
+        sources: Dict[str, int] = {}
+        categories: Dict[str, int] = {}
+        current = [None, b"", 0]  # source being read, its content bytes, search position
+        source_ids = array("i")
+        category_ids = array("i")
+        in_source = bytearray()
+        text_start = array("Q")
+        text_len = array("Q")
+        section_offsets = array("Q", [0])
+        sections = bytearray()
+        char_ranges = array("q")
+        dates = array("i")
+        hashes = bytearray()
+        section_ids = bytearray()
+
+        def write_text(path):
+            blob_size = 0
+            with open(path, "wb") as f:
+                for chunk in chunks:
+                    source = chunk["source"]
+                    source_ids.append(sources.setdefault(source, len(sources)))
+                    category_ids.append(
+                        categories.setdefault(chunk["category"], len(categories))
+                    )
+                    sections.extend(chunk["section"].encode("utf-8"))
+                    section_offsets.append(len(sections))
+                    char_ranges.extend(chunk["char_range"])
+                    dates.append(day_number(chunk.get("date")))
+                    hashes.extend(
+                        bytes.fromhex(chunk.get("hash") or chunk_hash(chunk["text"]))
+                    )
+                    section_ids.extend(
+                        bytes.fromhex(chunk["section_id"])
+                        if chunk.get("section_id")
+                        else bytes(16)
+                    )
+
+                    data = chunk["text"].encode("utf-8")
+                    text_len.append(len(data))
+                    if memories_dir:
+                        if current[0] != source:
+                            try:
+                                with open(os.path.join(memories_dir, source), "rb") as src:
+                                    current[:] = [source, src.read(), 0]
+                            except OSError:
+                                current[:] = [source, b"", 0]
+                        # Chunks come in file order, so search forward from the last hit
+                        pos = current[1].find(data, current[2])
+                        if pos < 0:
+                            pos = current[1].find(data)
+                        if pos >= 0:
+                            in_source.append(1)
+                            text_start.append(pos)
+                            current[2] = pos + len(data)
+                            continue
+                    in_source.append(0)
+                    text_start.append(blob_size)
+                    f.write(data)
+                    blob_size += len(data)
+
+        _replace_atomically(index_path / CHUNK_TEXT_FILE, write_text)
+        n = len(source_ids)
+        header = {
+            "memories_dir": os.path.abspath(memories_dir) if memories_dir else None,
+            "sources": list(sources),
+            "categories": list(categories),
+        }
+
+        def write_meta(path):
+            np.savez(
+                path,
+                header=np.frombuffer(json.dumps(header).encode("utf-8"), dtype=np.uint8),
+                hash=np.frombuffer(hashes, dtype=np.uint8).reshape(n, 16),
+                source=np.frombuffer(source_ids, dtype=np.int32),
+                category=np.frombuffer(category_ids, dtype=np.int32),
+                section_offsets=np.frombuffer(section_offsets, dtype=np.uint64),
+                section_blob=np.frombuffer(sections, dtype=np.uint8),
+                char_range=np.frombuffer(char_ranges, dtype=np.int64).reshape(n, 2),
+                in_source=np.frombuffer(in_source, dtype=bool),
+                text_start=np.frombuffer(text_start, dtype=np.uint64),
+                text_len=np.frombuffer(text_len, dtype=np.uint64),
+                date=np.frombuffer(dates, dtype=np.int32),
+                section_id=np.frombuffer(section_ids, dtype=np.uint8).reshape(n, 16),
+            )
 
-    if current:
-        chunks.append(current)
+        _replace_atomically(index_path / CHUNKS_FILE, write_meta)
+        return n
 
-    return chunks
 
+def _as_set(value) -> set:
+    return {value} if isinstance(value, str) else set(value)
 
-def generate_embeddings(texts: List[str], show_progress: bool = True) -> np.ndarray:
-    """Generate embeddings for a list of texts."""
-    model = load_model()
-    embeddings = model.encode(
-        texts, show_progress_bar=show_progress, convert_to_numpy=True
+
+def _date_mask(days: np.ndarray, since, until) -> np.ndarray:
+    """Rows dated within [since, until]; undated rows fail any date filter."""
+    mask = np.ones(len(days), dtype=bool)
+    if since is not None:
+        mask &= days >= day_number(since)
+    if until is not None:
+        mask &= (days <= day_number(until)) & (days != NO_DATE)
+    return mask
+
+
+def filter_mask(
+    chunks,
+    category=None,
+    source=None,
+    since: Union[str, date, None] = None,
+    until: Union[str, date, None] = None,
+) -> Optional[np.ndarray]:
+    """
+    Boolean row mask for metadata filters, None when no filter is given.
+    category / source: a name or a collection of names (source is the file
+    name, e.g. "invest.md"); since / until: inclusive "YYYY-MM-DD" or date
+    bounds on the chunk's entry date. Column lookups for a ChunkStore,
+    a pass over the dicts for a chunk list.
+    """
+    if category is None and source is None and since is None and until is None:
+        return None
+    if isinstance(chunks, ChunkStore):
+        return chunks.mask(category, source, since, until)
+    mask = np.ones(len(chunks), dtype=bool)
+    if category is not None:
+        wanted = _as_set(category)
+        mask &= np.array([chunk["category"] in wanted for chunk in chunks], dtype=bool)
+    if source is not None:
+        wanted = _as_set(source)
+        mask &= np.array([chunk["source"] in wanted for chunk in chunks], dtype=bool)
+    days = np.array(
+        [
+            day_number(chunk.get("date") or entry_date(chunk["text"], chunk["section"]))
+            for chunk in chunks
+        ],
+        dtype=np.int64,
     )
-    return embeddings.astype(np.float32)
+    return mask & _date_mask(days, since, until)
+
+
+def _replace_atomically(path: Path, write) -> None:
+    """Write via a temp file + rename; readers holding an mmap keep the old file."""
+    temp_path = path.with_name(f"{path.stem}.{os.getpid()}.tmp{path.suffix}")
+    try:
+        write(temp_path)
+        os.replace(temp_path, path)
+    finally:
+        if temp_path.exists():
+            temp_path.unlink()
 
 
-def save_index(index_dir: str, embeddings: np.ndarray, chunks: List[Dict]) -> None:
-    """Save embeddings and chunk metadata to disk."""
+def save_index(
+    index_dir: str,
+    embeddings: np.ndarray,
+    chunks: List[Dict],
+    memories_dir: Optional[str] = None,
+) -> None:
+    """
+    Save embeddings and chunk metadata to disk:
+    - vectors.i8.npy + scales.npy: int8 vectors with per-vector scales, the
+      only copy of the vectors by default (see QuantizedVectors)
+    - embeddings.npy: float32 vectors, only with KEEP_FLOAT32 (exact rescoring)
+    - chunks.meta.npz + chunks.text: columnar chunk metadata (see ChunkStore);
+      with memories_dir, chunk text is kept as byte ranges of the memory files
+    """
     index_path = Path(index_dir)
     index_path.mkdir(parents=True, exist_ok=True)
+    ChunkStore.write(index_path, chunks, memories_dir)
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    _save_vectors(
+        index_path,
+        QuantizedVectors(
+            *quantize_embeddings(embeddings), embeddings if KEEP_FLOAT32 else None
+        ),
+    )
+    for legacy in LEGACY_CHUNK_FILES:
+        if (index_path / legacy).exists():
+            (index_path / legacy).unlink()
 
-    np.save(index_path / "embeddings.npy", embeddings)
 
-    with open(index_path / "chunks.json", "w", encoding="utf-8") as f:
-        json.dump(chunks, f, ensure_ascii=False, indent=2)
+def _save_vectors(index_path: Path, vectors: QuantizedVectors) -> None:
+    """vectors.i8.npy + scales.npy, and embeddings.npy if there is a float32 copy."""
+    # Individual files are still replaced atomically, for callers writing
+    # into a live index directory rather than a build directory
+    _replace_atomically(
+        index_path / QUANT_VECTORS_FILE, lambda path: np.save(path, vectors.vectors)
+    )
+    _replace_atomically(
+        index_path / QUANT_SCALES_FILE, lambda path: np.save(path, vectors.scales)
+    )
+    if vectors.exact is not None:
+        _replace_atomically(
+            index_path / FLOAT32_FILE, lambda path: np.save(path, vectors.exact)
+        )
+    elif (index_path / FLOAT32_FILE).exists():
+        (index_path / FLOAT32_FILE).unlink()  # would no longer match the int8 rows
+
+
+def _load_legacy_index(index_path: Path) -> Tuple[np.ndarray, List[Dict]]:
+    """embeddings.npy + chunks.json written before the quantized format."""
+    embeddings = np.load(index_path / FLOAT32_FILE)
+    with open(index_path / "chunks.json", "r", encoding="utf-8") as f:
+        chunks = json.load(f)
+    # Indexes built before vectors were stored normalized
+    if embeddings.ndim == 2 and len(embeddings):
+        norms = np.linalg.norm(embeddings, axis=1)
+        if not np.allclose(norms[norms > 0], 1.0, atol=1e-3):
+            embeddings = normalize_embeddings(embeddings)
+    return embeddings, chunks
 
 
 def load_index(index_dir: str) -> Optional[Dict]:
-    """Load embeddings and chunks from disk. Returns None if not found."""
-    index_path = Path(index_dir)
-    embeddings_file = index_path / "embeddings.npy"
-    chunks_file = index_path / "chunks.json"
-
-    if not embeddings_file.exists() or not chunks_file.exists():
-        return None
+    """
+    Load the index from disk. Returns None if not found.
+    Vectors are memory-mapped and chunk metadata is read lazily, so loading
+    costs next to nothing and a query touches only the pages it needs.
+    Returns {"embeddings", "chunks", "ann"}; "embeddings" is a
+    QuantizedVectors, or a float32 array for the pre-quantization layout.
+    """
+    index_path = resolve_index_dir(index_dir)
+    exact_file = index_path / FLOAT32_FILE
 
     try:
-        embeddings = np.load(embeddings_file)
-        with open(chunks_file, "r", encoding="utf-8") as f:
-            chunks = json.load(f)
-        return {"embeddings": embeddings, "chunks": chunks}
+        if (index_path / CHUNKS_FILE).exists() and (
+            index_path / QUANT_VECTORS_FILE
+        ).exists():
+            embeddings = QuantizedVectors(
+                np.load(index_path / QUANT_VECTORS_FILE, mmap_mode="r"),
+                np.load(index_path / QUANT_SCALES_FILE, mmap_mode="r"),
+                np.load(exact_file, mmap_mode="r") if exact_file.exists() else None,
+            )
+            chunks = ChunkStore(index_path)
+            lengths = {len(embeddings), len(embeddings.scales), len(chunks)}
+            if embeddings.exact is not None:
+                lengths.add(len(embeddings.exact))
+            if len(lengths) > 1:
+                raise ValueError("index files are out of step")
+        elif (index_path / "chunks.json").exists() and exact_file.exists():
+            embeddings, chunks = _load_legacy_index(index_path)
+        else:
+            return None
+
+        from ann_utils import IVFIndex
+
+        ann = IVFIndex.load(str(index_path), len(embeddings))
+        return {"embeddings": embeddings, "chunks": chunks, "ann": ann}
     except Exception as e:
         print(f"Warning: Failed to load index: {e}")
         return None
 
 
-def is_index_stale(index_dir: str, memory_files: List[str]) -> bool:
-    """Check if index is older than any memory file."""
+def resolve_index_dir(index_dir: str) -> Path:
+    """
+    Directory holding the published index files: the generation named by
+    CURRENT_FILE, or index_dir itself for indexes built before generations.
+    """
     index_path = Path(index_dir)
-    embeddings_file = index_path / "embeddings.npy"
+    try:
+        name = (index_path / CURRENT_FILE).read_text(encoding="utf-8").strip()
+    except OSError:
+        return index_path
+    return index_path / name if name else index_path
 
-    if not embeddings_file.exists():
-        return True
 
-    index_mtime = embeddings_file.stat().st_mtime
+def file_digest(path: str) -> str:
+    """blake2b content hash of a file, read in blocks."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
 
+def file_manifest(memory_files: List[str]) -> Dict[str, Dict]:
+    """Size, mtime (ns) and content hash of each existing memory file, by name."""
+    files = {}
     for mem_file in memory_files:
-        if Path(mem_file).exists():
-            if Path(mem_file).stat().st_mtime > index_mtime:
+        try:
+            stat = os.stat(mem_file)
+            files[Path(mem_file).name] = {
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "hash": file_digest(mem_file),
+            }
+        except OSError:
+            continue
+    return files
+
+
+def read_manifest(index_dir: str) -> Optional[Dict]:
+    try:
+        with open(resolve_index_dir(index_dir) / MANIFEST_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def is_index_stale(
+    index_dir: str, memory_files: List[str], check_content: bool = False
+) -> bool:
+    """
+    Check the published index against the memory files via its manifest.
+    Stale when the manifest is missing or from another index version or
+    model, when a file was added or deleted, or when a file's content hash
+    changed. The hash is only computed for files whose size or mtime differ
+    from the manifest, or whose mtime is too close to the build to be trusted
+    (an edit in the same clock tick); check_content=True hashes every file.
+    """
+    manifest = read_manifest(index_dir)
+    if (
+        manifest is None
+        or manifest.get("version") != INDEX_VERSION
+        or manifest.get("model") != embedding_model_key()
+    ):
+        return True
+
+    recorded = manifest.get("files", {})
+    current = {Path(f).name: f for f in memory_files if Path(f).exists()}
+    if set(current) != set(recorded):
+        return True
+
+    built_ns = manifest.get("built_ns", 0)
+    for name, mem_file in current.items():
+        entry = recorded[name]
+        try:
+            stat = os.stat(mem_file)
+            if (
+                not check_content
+                and stat.st_size == entry["size"]
+                and stat.st_mtime_ns == entry["mtime_ns"]
+                and stat.st_mtime_ns < built_ns - RACY_MTIME_NS
+            ):
+                continue
+            if stat.st_size != entry["size"] or file_digest(mem_file) != entry["hash"]:
                 return True
+        except (OSError, KeyError):
+            return True
 
     return False
 
 
+def publish_index(index_dir: str, build_dir: Path) -> Path:
+    """
+    Make a finished build directory the current index: rename it to a new
+    generation and atomically repoint CURRENT_FILE at it. Readers never see
+    a partial index; one that already loaded the previous generation keeps
+    using it (that generation is kept until the next publish). Older
+    generations and files of the pre-generation layout are then removed; a
+    reader still holding one keeps its memory-mapped vectors, and chunk
+    texts it can no longer read come back as None (see ChunkStore.text).
+    """
+    index_path = Path(index_dir)
+    previous = resolve_index_dir(index_dir)
+    generation = index_path / f"{SEMANTIC_DIR_PREFIX}{time.time_ns()}"
+    # mkdtemp creates the build directory as 0700; give the generation the
+    # mode a plain mkdir would, so other readers of the index can open it
+    umask = os.umask(0)
+    os.umask(umask)
+    os.chmod(build_dir, 0o777 & ~umask)
+    os.rename(build_dir, generation)
+    _replace_atomically(
+        index_path / CURRENT_FILE,
+        lambda path: path.write_text(generation.name, encoding="utf-8"),
+    )
+
+    for entry in index_path.iterdir():
+        if (
+            entry.is_dir()
+            and entry.name.startswith(SEMANTIC_DIR_PREFIX)
+            and entry not in (generation, previous)
+        ):
+            shutil.rmtree(entry, ignore_errors=True)
+    if previous == index_path:
+        from ann_utils import IVF_FILENAME
+
+        for name in [
+            FLOAT32_FILE,
+            QUANT_VECTORS_FILE,
+            QUANT_SCALES_FILE,
+            CHUNKS_FILE,
+            CHUNK_TEXT_FILE,
+            IVF_FILENAME,
+            *LEGACY_CHUNK_FILES,
+        ]:
+            if (index_path / name).exists():
+                (index_path / name).unlink()
+    return generation
+
+
 def get_memory_files(memories_dir: str) -> List[str]:
     """Get list of long-term memory files."""
-    categories = ["work", "hobby", "invest", "learning", "life", "thoughts", "projects"]
-    return [str(Path(memories_dir) / f"{cat}.md") for cat in categories]
-
+    return [str(Path(memories_dir) / filename) for filename in MEMORY_FILES]
 
-def build_index(memories_dir: str, index_dir: str) -> Dict:
-    """Build complete index from all memory files."""
-    memory_files = get_memory_files(memories_dir)
-    all_chunks = []
 
-    for mem_file in memory_files:
-        file_path = Path(mem_file)
-        if file_path.exists():
-            category = file_path.stem
-            with open(file_path, "r", encoding="utf-8") as f:
-                content = f.read()
-            chunks = chunk_markdown(
-                content, source_file=file_path.name, category=category
+def iter_memory_chunks(memories_dir: str) -> Iterator[Dict]:
+    """
+    Chunks of all memory files in file order, each with its content hash
+    and section ID (see chunk_catalog.iter_chunks). Files are streamed
+    section by section; only the section being chunked is held in memory.
+    """
+    for file_path in get_memory_files(memories_dir):
+        path = Path(file_path)
+        if path.exists():
+            yield from iter_chunks(
+                iter_file_sections(file_path),
+                source_file=path.name,
+                category=path.stem,
             )
-            all_chunks.extend(chunks)
 
-    if not all_chunks:
-        return {"embeddings": np.array([]), "chunks": []}
 
-    print(f"Generating embeddings for {len(all_chunks)} chunks...")
-    texts = [c["text"] for c in all_chunks]
-    embeddings = generate_embeddings(texts)
+def _prefetch(items: Iterable, batch: int, maxsize: int) -> Iterator:
+    """
+    Iterate `items` on a producer thread that runs at most `maxsize` lists
+    of `batch` items ahead of the consumer (a bounded queue.Queue). An
+    exception in the producer is re-raised here; closing the generator
+    stops the producer.
+    """
+    buffer = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+    done = object()
+
+    def put(value) -> bool:
+        while not stop.is_set():
+            try:
+                buffer.put(value, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            items_iter = iter(items)
+            while True:
+                part = list(islice(items_iter, batch))
+                if not part or not put(part):
+                    break
+        except BaseException as e:
+            put(e)
+        else:
+            put(done)
+
+    producer = threading.Thread(target=produce, name="lizi-chunking", daemon=True)
+    producer.start()
+    try:
+        while True:
+            part = buffer.get()
+            if part is done:
+                return
+            if isinstance(part, BaseException):
+                raise part
+            yield from part
+    finally:
+        stop.set()
+        producer.join()
+
+
+def collect_chunks(memories_dir: str) -> List[Dict]:
+    """Chunk all memory files, tagging each chunk with its content hash."""
+    return list(iter_memory_chunks(memories_dir))
+
+
+def build_index(
+    memories_dir: str,
+    index_dir: str,
+    incremental: bool = True,
+    workers: int = EMBED_WORKERS,
+) -> Dict:
+    """
+    Build the index from all memory files, encoding in `workers` processes.
+
+    With incremental=True, chunks whose content hash is already in the
+    existing index reuse their stored int8 vector and scale unchanged; only
+    new or changed chunks are encoded and chunks that no longer exist are
+    dropped.
+
+    Chunks are streamed from the memory files (see iter_memory_chunks)
+    straight into the chunk store of the new index (see ChunkStore.write);
+    no chunk list is kept. The files are chunked on a producer thread that
+    stays at most PIPELINE_QUEUE_BATCHES x PIPELINE_BATCH chunks ahead (see
+    _prefetch), while this thread encodes new chunks PIPELINE_FLUSH at a
+    time, so parsing continues while the model (or the encoding processes /
+    resident worker) runs. Encoded vectors are quantized right away (see
+    QuantizedVectors); the int8 matrix, plus the float32 one only with
+    KEEP_FLOAT32, is still assembled in memory and grows with the corpus.
+
+    The index is written to a temporary directory with a manifest of the
+    memory files it was built from, then published atomically (see
+    publish_index), so readers and concurrent builds never see a partial one.
+    """
+    # Recorded before parsing: a file edited during the build shows up as
+    # changed on the next is_index_stale check
+    built_ns = time.time_ns()
+    files = file_manifest(get_memory_files(memories_dir))
+
+    # content hash -> (QuantizedVectors, row) of an already-embedded chunk
+    known = {}
+    old_embeddings = None
+    previous_dir = resolve_index_dir(index_dir)
+    # Vectors of another model (e.g. the int8 ONNX one) are not reused
+    previous_model = (read_manifest(index_dir) or {}).get("model", embedding_model_key())
+    incremental = incremental and previous_model == embedding_model_key()
+    previous = load_index(index_dir) if incremental else None
+    if previous is not None:
+        old_chunks = previous["chunks"]
+        if previous["embeddings"].ndim == 2 and len(previous["embeddings"]) == len(
+            old_chunks
+        ):
+            old_embeddings = previous["embeddings"]
+            if not isinstance(old_embeddings, QuantizedVectors):
+                # Pre-quantization layout: quantized once here, then reused
+                old_embeddings = QuantizedVectors(
+                    *quantize_embeddings(old_embeddings), old_embeddings
+                )
+            if isinstance(old_chunks, ChunkStore):
+                old_hashes = old_chunks.hashes()
+            else:
+                old_hashes = [
+                    chunk.get("hash") or chunk_hash(chunk["text"]) for chunk in old_chunks
+                ]
+            for row, key in enumerate(old_hashes):
+                known.setdefault(key, (old_embeddings, row))
+
+    hashes = []  # content hash of each chunk, in index order
+    pending = {}  # content hash -> text, waiting to be encoded
+    encoded = 0
+    encode_s = 0.0
+
+    def flush():
+        nonlocal encoded, encode_s
+        start = time.perf_counter()
+        # Stored L2-normalized, so cosine similarity is a plain dot product
+        vectors = normalize_embeddings(
+            generate_embeddings(list(pending.values()), show_progress=False, workers=workers)
+        )
+        encode_s += time.perf_counter() - start
+        # Only the int8 form is kept unless the index stores float32 too
+        batch = QuantizedVectors(
+            *quantize_embeddings(vectors), vectors if KEEP_FLOAT32 else None
+        )
+        for row, key in enumerate(pending):
+            known[key] = (batch, row)
+        encoded += len(pending)
+        pending.clear()
+
+    def stream():
+        chunks = _prefetch(
+            iter_memory_chunks(memories_dir), PIPELINE_BATCH, PIPELINE_QUEUE_BATCHES
+        )
+        try:
+            for chunk in chunks:
+                key = chunk["hash"]
+                hashes.append(key)
+                if key not in known and key not in pending:
+                    pending[key] = chunk["text"]
+                    if len(pending) >= PIPELINE_FLUSH:
+                        flush()
+                yield chunk
+        finally:
+            chunks.close()  # stops the chunking thread if the build fails
+        if pending:
+            flush()
+
+    Path(index_dir).mkdir(parents=True, exist_ok=True)
+    build_dir = Path(tempfile.mkdtemp(prefix=".semantic-build-", dir=index_dir))
+    try:
+        try:
+            count = ChunkStore.write(build_dir, stream(), memories_dir)
+        finally:
+            close_encode_pool()
+        if not count:
+            shutil.rmtree(build_dir, ignore_errors=True)
+            return {"embeddings": np.array([]), "chunks": [], "ann": None}
+        if encoded:
+            print(
+                f"Embedded {encoded} new/changed chunks "
+                f"({count - encoded} reused) in {encode_s:.1f}s "
+                f"({encoded / max(encode_s, 1e-9):.1f} chunks/s)",
+                file=sys.stderr,
+            )
 
-    save_index(index_dir, embeddings, all_chunks)
-    print(f"Index saved: {len(all_chunks)} chunks, {embeddings.shape}")
+        # Reused rows keep their int8 vector and scale as stored, so
+        # incremental builds never requantize them
+        rows = [known[key] for key in hashes]
+        embeddings = QuantizedVectors(
+            np.stack([source.vectors[row] for source, row in rows]),
+            np.array([source.scales[row] for source, row in rows], dtype=np.float32),
+            np.stack([source[row] for source, row in rows]) if KEEP_FLOAT32 else None,
+        )
+        _save_vectors(build_dir, embeddings)
+
+        # Keep the ANN index in step: reused rows keep their cluster
+        from ann_utils import update_ann_index
+
+        previous_rows = np.array(
+            [row if matrix is old_embeddings else -1 for matrix, row in rows],
+            dtype=np.int64,
+        )
+        ann = update_ann_index(
+            str(build_dir),
+            embeddings,
+            previous_rows,
+            len(old_embeddings) if old_embeddings is not None else 0,
+            previous_dir=str(previous_dir),
+        )
+
+        manifest = {
+            "version": INDEX_VERSION,
+            "model": embedding_model_key(),
+            "built_ns": built_ns,
+            "chunks": count,
+            "files": files,
+        }
+        with open(build_dir / MANIFEST_FILE, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        generation = publish_index(index_dir, build_dir)
+    except BaseException:
+        shutil.rmtree(build_dir, ignore_errors=True)
+        raise
+    print(
+        f"Index saved: {count} chunks, {embeddings.shape} -> {generation}",
+        file=sys.stderr,
+    )
 
-    return {"embeddings": embeddings, "chunks": all_chunks}
+    return {"embeddings": embeddings, "chunks": ChunkStore(generation), "ann": ann}
 
 
 def semantic_search(
@@ -258,29 +1408,89 @@ def semantic_search(
     chunks: List[Dict],
     top_k: int = 5,
     threshold: float = 0.3,
+    ann=None,
+    nprobe: Optional[int] = None,
+    rescore: bool = True,
+    category=None,
+    source=None,
+    since: Union[str, date, None] = None,
+    until: Union[str, date, None] = None,
 ) -> List[Dict]:
-    """Search for similar chunks using cosine similarity."""
-    from sklearn.metrics.pairwise import cosine_similarity
-
-    model = load_model()
-    query_embedding = model.encode([query], convert_to_numpy=True)
-
-    similarities = cosine_similarity(query_embedding, embeddings)[0]
-
-    # Get top-k indices
-    top_indices = np.argsort(similarities)[::-1][:top_k]
+    """
+    Search for similar chunks using cosine similarity.
+    `embeddings` are the L2-normalized index vectors, so the similarity is
+    a matrix-vector product with the normalized query. For a
+    QuantizedVectors (what load_index() returns) the scan reads the int8
+    rows; if the index keeps a float32 copy, `rescore` re-ranks the best
+    RESCORE_FACTOR * top_k candidates with it, giving the exact top-k in
+    practice (see QuantizedVectors.search).
+    With `ann` (the index's IVFIndex, see ann_utils) only the `nprobe`
+    nearest clusters are scanned instead of every chunk, in the same way.
+    Arguments come from load_index(); see search_index().
+    category / source / since / until restrict the search to matching
+    chunks (see filter_mask); only matching rows are scored. Fewer than
+    ANN_MIN_CHUNKS matches are scanned exactly instead of through `ann`;
+    with `ann` the probed clusters are widened until they hold top_k
+    matches (see IVFIndex.search), so a selective filter is not cut short.
+    """
+    mask = filter_mask(chunks, category, source, since, until)
+    rows = None if mask is None else np.flatnonzero(mask)
+    if rows is not None and len(rows) == 0:
+        return []
+
+    query_embedding = normalize_embeddings(
+        generate_embeddings([query], show_progress=False)
+    )[0]
+
+    from ann_utils import ANN_MIN_CHUNKS, ANN_NPROBE
+
+    if ann is not None and (rows is None or len(rows) >= ANN_MIN_CHUNKS):
+        top_indices, scores = ann.search(
+            embeddings,
+            query_embedding,
+            top_k,
+            nprobe or ANN_NPROBE,
+            mask=mask,
+            rescore=rescore,
+        )
+    elif isinstance(embeddings, QuantizedVectors):
+        top_indices, scores = embeddings.search(query_embedding, top_k, rows, rescore)
+    else:
+        # A small filtered subset skips the ANN index: scoring it is cheap
+        subset = embeddings if rows is None else np.asarray(embeddings[rows])
+        similarities = subset @ query_embedding
+        best = top_k_indices(similarities, top_k)
+        top_indices = best if rows is None else rows[best]
+        scores = similarities[best]
 
     results = []
-    for idx in top_indices:
-        score = float(similarities[idx])
+    for idx, score in zip(top_indices, scores):
+        score = float(score)
         if score >= threshold:
             result = chunks[idx].copy()
+            if result["text"] is None:
+                continue  # memory edited away since the index was built
             result["score"] = score
             results.append(result)
 
     return results
 
 
+def search_index(
+    index: Dict, query: str, top_k: int = 5, threshold: float = 0.3, **options
+) -> List[Dict]:
+    """semantic_search over a load_index()/build_index() result."""
+    return semantic_search(
+        query,
+        index["embeddings"],
+        index["chunks"],
+        top_k=top_k,
+        threshold=threshold,
+        ann=index.get("ann"),
+        **options,
+    )
+
+
 def calculate_chunk_importance(
     chunk: Dict,
     access_log: Dict,
@@ -291,8 +1501,8 @@ def calculate_chunk_importance(
     Calculate importance score for a memory chunk using access log data.
 
     Args:
-        chunk: Chunk dict with 'text' and optionally 'hash' or computed hash
-        access_log: Dict mapping chunk_hash -> access record
+        chunk: Chunk dict with 'text' and optionally 'hash' / 'section_id'
+        access_log: Dict mapping chunk or section ID -> access record
         semantic_score: Current semantic similarity score (from search)
         recent_messages: Last few user messages for context relevance
 
@@ -308,11 +1518,10 @@ def calculate_chunk_importance(
         calculate_importance,
     )
 
-    # Get or compute chunk hash
-    chunk_hash = chunk.get("hash") or str(hash(chunk.get("text", "")))
-
-    # Get access record (default values if not found)
-    access_record = access_log.get(chunk_hash, {})
+    # Access is logged per chunk or per section (recall works on sections);
+    # both IDs are stable content hashes, see chunk_catalog
+    key = chunk.get("hash") or chunk_hash(chunk.get("text", ""))
+    access_record = access_log.get(key) or access_log.get(chunk.get("section_id"), {})
 
     # Calculate days since last access
     last_access_str = access_record.get("last_access")
@@ -340,6 +1549,11 @@ def calculate_chunk_importance(
 
 
 if __name__ == "__main__":
+    if "--cache-stats" in sys.argv:
+        cache = get_embedding_cache()
+        print(json.dumps(cache.stats() if cache else {"enabled": False}, indent=2))
+        sys.exit(0)
+
     # Quick self-test
     print("Testing embedding_utils...")
 
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+Resident embedding worker: keeps the SentenceTransformer model loaded and
+serves encode requests over a Unix socket.
+
+Requests from concurrent clients are queued and encoded together in one
+model call (up to --max-batch texts, waiting at most --max-wait-ms for more
+requests to arrive). `embedding_utils.generate_embeddings` uses the worker
+automatically when its socket is up and owned by the same user, and falls
+back to in-process loading otherwise. The socket is created inside a private
+0700 directory (see ipc_utils.private_socket_dir).
+
+Every encode request carries the client's embedding_model_key(); the worker
+refuses a key that differs from the backend it actually loaded, and the
+client then encodes in-process.
+
+Usage:
+  python embedding_worker.py            # run in the foreground
+  python embedding_worker.py --status   # check whether a worker is running
+  python embedding_worker.py --stop     # ask the running worker to exit
+"""
+
+import os
+import sys
+import json
+import queue
+import argparse
+import threading
+import socketserver
+from pathlib import Path
+from typing import List
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+import embedding_utils
+from embedding_utils import MODEL_NAME, WORKER_SOCKET_PATH, embedding_model_key, load_model
+from ipc_utils import IPCError, private_socket_dir, recv_message, request, send_message
+
+DEFAULT_MAX_BATCH = 256
+DEFAULT_MAX_WAIT_MS = 5.0
+
+
+class _Job:
+    def __init__(self, texts: List[str]):
+        self.texts = texts
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class EncodeBatcher:
+    """Collects queued jobs and encodes them together on a single thread."""
+
+    def __init__(self, model, max_batch: int, max_wait: float):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.jobs: "queue.Queue[_Job]" = queue.Queue()
+        self.batches = 0
+        self.texts = 0
+        thread = threading.Thread(target=self._run, daemon=True)
+        thread.start()
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        job = _Job(texts)
+        self.jobs.put(job)
+        job.done.wait()
+        if job.error is not None:
+            raise job.error
+        return job.result
+
+    def _run(self) -> None:
+        while True:
+            batch = [self.jobs.get()]
+            size = len(batch[0].texts)
+            while size < self.max_batch:
+                try:
+                    job = self.jobs.get(timeout=self.max_wait)
+                except queue.Empty:
+                    break
+                batch.append(job)
+                size += len(job.texts)
+
+            texts = [text for job in batch for text in job.texts]
+            try:
+                embeddings = self.model.encode(
+                    texts, show_progress_bar=False, convert_to_numpy=True
+                ).astype(np.float32)
+            except Exception as e:
+                for job in batch:
+                    job.error = e
+                    job.done.set()
+                continue
+
+            self.batches += 1
+            self.texts += len(texts)
+            start = 0
+            for job in batch:
+                job.result = embeddings[start : start + len(job.texts)]
+                start += len(job.texts)
+                job.done.set()
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self) -> None:
+        server = self.server
+        try:
+            header, _ = recv_message(self.request)
+            op = header.get("op")
+            if op == "encode":
+                if header.get("model_key") != embedding_model_key():
+                    # The client caches and indexes vectors under its own model
+                    # key; vectors from another backend must not end up there
+                    send_message(
+                        self.request,
+                        {
+                            "ok": False,
+                            "error": "model mismatch",
+                            "model_key": embedding_model_key(),
+                        },
+                    )
+                    return
+                embeddings = server.batcher.encode(header.get("texts") or [])
+                send_message(
+                    self.request,
+                    {"ok": True, "shape": list(embeddings.shape), "dtype": "float32"},
+                    np.ascontiguousarray(embeddings).tobytes(),
+                )
+            elif op == "ping":
+                send_message(
+                    self.request,
+                    {
+                        "ok": True,
+                        "model": MODEL_NAME,
+                        "backend": embedding_utils.EMBED_BACKEND,
+                        "model_key": embedding_model_key(),
+                        "pid": os.getpid(),
+                        "batches": server.batcher.batches,
+                        "texts": server.batcher.texts,
+                    },
+                )
+            elif op == "shutdown":
+                send_message(self.request, {"ok": True})
+                threading.Thread(target=server.shutdown, daemon=True).start()
+            else:
+                send_message(self.request, {"ok": False, "error": f"unknown op {op!r}"})
+        except (IPCError, OSError):
+            return
+        except Exception as e:
+            send_message(self.request, {"ok": False, "error": str(e)})
+
+
+class EmbeddingServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, path: str, batcher: EncodeBatcher):
+        self.batcher = batcher
+        super().__init__(path, _Handler)
+
+
+def _socket_in_use(path: str) -> bool:
+    try:
+        request(path, {"op": "ping"}, timeout=2.0)
+        return True
+    except (OSError, IPCError):
+        return False
+
+
+def serve(path: str, max_batch: int, max_wait_ms: float) -> None:
+    try:
+        private_socket_dir(path)
+    except PermissionError as e:
+        sys.exit(f"Refusing to listen on {path}: {e}")
+    if os.path.exists(path):
+        if _socket_in_use(path):
+            print(f"Embedding worker already running on {path}", file=sys.stderr)
+            return
+        os.remove(path)  # stale socket left behind by a crashed worker
+
+    print(f"Loading {MODEL_NAME}...", file=sys.stderr)
+    batcher = EncodeBatcher(load_model(), max_batch, max_wait_ms / 1000)
+    with EmbeddingServer(path, batcher) as server:
+        os.chmod(path, 0o600)
+        print(
+            f"Embedding worker listening on {path} ({embedding_model_key()})",
+            file=sys.stderr,
+        )
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Resident embedding worker")
+    parser.add_argument(
+        "--socket",
+        default=WORKER_SOCKET_PATH,
+        help=(
+            f"Unix socket path (default: {WORKER_SOCKET_PATH}, env LIZI_EMBED_SOCKET);"
+            " its directory must be private to this user (mode 0700)"
+        ),
+    )
+    parser.add_argument(
+        "--max-batch",
+        type=int,
+        default=DEFAULT_MAX_BATCH,
+        help=f"Max texts per model call (default: {DEFAULT_MAX_BATCH})",
+    )
+    parser.add_argument(
+        "--max-wait-ms",
+        type=float,
+        default=DEFAULT_MAX_WAIT_MS,
+        help=f"How long to wait for more requests to batch (default: {DEFAULT_MAX_WAIT_MS})",
+    )
+    parser.add_argument(
+        "--status", action="store_true", help="Report whether a worker is running"
+    )
+    parser.add_argument(
+        "--stop", action="store_true", help="Stop the running worker"
+    )
+    args = parser.parse_args()
+
+    if args.status or args.stop:
+        try:
+            header, _ = request(
+                args.socket, {"op": "shutdown" if args.stop else "ping"}, timeout=5.0
+            )
+        except (OSError, IPCError):
+            print(json.dumps({"running": False}))
+            sys.exit(1)
+        print(json.dumps({"running": not args.stop, **header}))
+        return
+
+    serve(args.socket, args.max_batch, args.max_wait_ms)
+
+
+if __name__ == "__main__":
+    main()
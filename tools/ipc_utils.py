@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Length-prefixed message framing for the local Unix-socket workers.
+
+Each message is a fixed 8-byte prefix (header length, payload length, both
+big-endian uint32), a UTF-8 JSON header and an optional raw binary payload.
+The payload carries bulk data such as embedding matrices without going
+through JSON.
+
+The sockets live in a per-user directory with mode 0700 ($XDG_RUNTIME_DIR
+or the temp dir, see private_socket_dir()), created before the server binds,
+and clients only connect to sockets owned by their own uid (owned_socket()).
+"""
+
+import os
+import json
+import stat
+import socket
+import struct
+from typing import Dict, Optional, Tuple
+
+_PREFIX = struct.Struct("!II")
+
+
+class IPCError(Exception):
+    """The peer closed the connection or sent a malformed message."""
+
+
+def private_socket_dir(path: str) -> None:
+    """
+    Create the directory that will hold the socket at `path` with mode 0700,
+    or accept an existing one. Raises PermissionError unless it is a real
+    directory owned by this user with no group/other access, so another user
+    cannot pre-create it or reach the socket between bind and chmod.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    try:
+        os.mkdir(directory, 0o700)
+    except FileExistsError:
+        pass
+    st = os.lstat(directory)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+        raise PermissionError(
+            f"{directory} must be a directory owned by uid {os.getuid()} with mode 0700"
+        )
+
+
+def owned_socket(path: str) -> bool:
+    """True if `path` is a Unix socket owned by the current user."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    return stat.S_ISSOCK(st.st_mode) and st.st_uid == os.getuid()
+
+
+def send_message(sock: socket.socket, header: Dict, payload: bytes = b"") -> None:
+    """Send one framed message."""
+    header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    sock.sendall(_PREFIX.pack(len(header_bytes), len(payload)) + header_bytes)
+    if payload:
+        sock.sendall(payload)
+
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    buf = bytearray(size)
+    view = memoryview(buf)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:])
+        if n == 0:
+            raise IPCError("connection closed")
+        received += n
+    return bytes(buf)
+
+
+def recv_message(sock: socket.socket) -> Tuple[Dict, bytes]:
+    """Receive one framed message, returns (header, payload)."""
+    header_len, payload_len = _PREFIX.unpack(_recv_exact(sock, _PREFIX.size))
+    try:
+        header = json.loads(_recv_exact(sock, header_len).decode("utf-8"))
+    except (UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise IPCError(f"bad header: {e}") from e
+    payload = _recv_exact(sock, payload_len) if payload_len else b""
+    return header, payload
+
+
+def request(
+    path: str,
+    header: Dict,
+    payload: bytes = b"",
+    timeout: Optional[float] = None,
+    connect_timeout: float = 0.5,
+) -> Tuple[Dict, bytes]:
+    """
+    One request/response round trip to the worker listening on `path`.
+    Raises OSError (including ConnectionRefusedError / FileNotFoundError)
+    or IPCError when the worker is unavailable.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(connect_timeout)
+        sock.connect(path)
+        sock.settimeout(timeout)
+        send_message(sock, header, payload)
+        return recv_message(sock)
@@ -18,8 +18,11 @@ from embedding_utils import (
     load_index,
     build_index,
     get_memory_files,
+    is_index_stale,
     chunk_markdown,
     generate_embeddings,
+    normalize_embeddings,
+    EMBED_WORKERS,
 )
 
 MEMORIES_DIR = "/home/sanmu/.config/lizi/memories"
@@ -33,61 +36,78 @@ def find_duplicates(
     length_ratio_threshold: float = 0.8,
 ) -> list:
     """Find duplicate pairs using cosine similarity."""
-    from sklearn.metrics.pairwise import cosine_similarity
-
     n = len(chunks)
     if n < 2:
         return []
 
-    # Compute similarity matrix (upper triangular only)
-    sim_matrix = cosine_similarity(embeddings)
+    # Index vectors come back dequantized from int8 (see QuantizedVectors),
+    # close to but not exactly unit length; renormalized, the similarity
+    # matrix is one matrix product
+    normalized = normalize_embeddings(embeddings)
+    sim_matrix = normalized @ normalized.T
 
     duplicates = []
-    processed_pairs = set()
-
-    for i in range(n):
-        for j in range(i + 1, n):
-            sim = sim_matrix[i, j]
-
-            if sim < threshold:
-                continue
-
-            # Check length ratio to avoid false positives
-            len_i = len(chunks[i]["text"])
-            len_j = len(chunks[j]["text"])
-            length_ratio = min(len_i, len_j) / max(len_i, len_j)
-
-            if length_ratio < length_ratio_threshold:
-                continue
-
-            # Determine recommendation
-            recommendation = "auto_merge" if sim >= 0.95 else "review"
-
-            duplicates.append(
-                {
-                    "similarity": round(float(sim), 4),
-                    "length_ratio": round(length_ratio, 4),
-                    "recommendation": recommendation,
-                    "chunks": [
-                        {
-                            "index": i,
-                            "source": chunks[i]["source"],
-                            "section": chunks[i]["section"],
-                            "text": chunks[i]["text"][:200]
-                            + ("..." if len(chunks[i]["text"]) > 200 else ""),
-                            "full_length": len(chunks[i]["text"]),
-                        },
-                        {
-                            "index": j,
-                            "source": chunks[j]["source"],
-                            "section": chunks[j]["section"],
-                            "text": chunks[j]["text"][:200]
-                            + ("..." if len(chunks[j]["text"]) > 200 else ""),
-                            "full_length": len(chunks[j]["text"]),
-                        },
-                    ],
-                }
-            )
+    unreadable = set()
+
+    # Candidate pairs above threshold, upper triangle only, in (i, j) order
+    rows, cols = np.nonzero(np.triu(sim_matrix >= threshold, k=1))
+    for i, j in zip(rows.tolist(), cols.tolist()):
+        sim = sim_matrix[i, j]
+
+        # Text is None when the index generation was replaced while we read
+        # it (see ChunkStore.text); such chunks cannot be compared
+        missing = {k for k in (i, j) if chunks[k]["text"] is None}
+        if missing:
+            unreadable |= missing
+            continue
+
+        # Check length ratio to avoid false positives
+        len_i = len(chunks[i]["text"])
+        len_j = len(chunks[j]["text"])
+        length_ratio = min(len_i, len_j) / max(len_i, len_j)
+
+        if length_ratio < length_ratio_threshold:
+            continue
+
+        # Determine recommendation
+        recommendation = "auto_merge" if sim >= 0.95 else "review"
+
+        duplicates.append(
+            {
+                "similarity": round(float(sim), 4),
+                "length_ratio": round(length_ratio, 4),
+                "recommendation": recommendation,
+                "chunks": [
+                    {
+                        "index": i,
+                        "id": chunks[i].get("hash"),
+                        "section_id": chunks[i].get("section_id"),
+                        "source": chunks[i]["source"],
+                        "section": chunks[i]["section"],
+                        "text": chunks[i]["text"][:200]
+                        + ("..." if len(chunks[i]["text"]) > 200 else ""),
+                        "full_length": len(chunks[i]["text"]),
+                    },
+                    {
+                        "index": j,
+                        "id": chunks[j].get("hash"),
+                        "section_id": chunks[j].get("section_id"),
+                        "source": chunks[j]["source"],
+                        "section": chunks[j]["section"],
+                        "text": chunks[j]["text"][:200]
+                        + ("..." if len(chunks[j]["text"]) > 200 else ""),
+                        "full_length": len(chunks[j]["text"]),
+                    },
+                ],
+            }
+        )
+
+    if unreadable:
+        print(
+            f"Warning: skipped {len(unreadable)} chunks whose text is gone "
+            "(index rebuilt meanwhile); run again to check them",
+            file=sys.stderr,
+        )
 
     # Sort by similarity descending
     duplicates.sort(key=lambda x: x["similarity"], reverse=True)
@@ -115,17 +135,31 @@ def main():
         action="store_true",
         help="Force rebuild the index before checking",
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=EMBED_WORKERS,
+        help=f"Encoding processes when (re)building the index (default: {EMBED_WORKERS})",
+    )
 
     args = parser.parse_args()
 
-    # Load or build index
+    # Load or build index; a stale index is updated incrementally, so only
+    # new or changed chunks get re-embedded
     index_data = None
-    if not args.rebuild_index:
+    if not args.rebuild_index and not is_index_stale(
+        INDEX_DIR, get_memory_files(MEMORIES_DIR)
+    ):
         index_data = load_index(INDEX_DIR)
 
     if index_data is None:
         print("Building index...", file=sys.stderr)
-        index_data = build_index(MEMORIES_DIR, INDEX_DIR)
+        index_data = build_index(
+            MEMORIES_DIR,
+            INDEX_DIR,
+            incremental=not args.rebuild_index,
+            workers=args.workers,
+        )
 
     if len(index_data["chunks"]) == 0:
         print("[]")  # Empty JSON array
@@ -133,7 +167,10 @@ def main():
 
     # Find duplicates
     duplicates = find_duplicates(
-        index_data["embeddings"], index_data["chunks"], threshold=args.threshold
+        index_data["embeddings"],
+        # Chunk metadata is read lazily from disk; every pair reads texts
+        list(index_data["chunks"]),
+        threshold=args.threshold,
     )
 
     # Output as JSON
@@ -3,47 +3,142 @@
 
 import sys
 import os
-import re
 import random
 import argparse
 import json
+import hashlib
+import tempfile
+from contextlib import contextmanager
 from datetime import datetime
-from typing import Dict
+from typing import Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 MEMORIES_DIR = "/home/sanmu/.config/lizi/memories"
 INDEX_DIR = "/home/sanmu/.config/lizi/memories/.index"
 
 ACCESS_LOG_PATH = os.path.join(INDEX_DIR, "access_log.json")
+BM25_INDEX_PATH = os.path.join(INDEX_DIR, "bm25_index.pkl")
+KEYWORD_INDEX_DIR = os.path.join(INDEX_DIR, "keyword")
+CATALOG_DIR = os.path.join(INDEX_DIR, "catalog")
+RESULT_CACHE_PATH = os.path.join(INDEX_DIR, "recall_cache.json")
+MAX_RESULT_CACHE_BYTES = 2 * 1024 * 1024
 MAX_ACCESS_LOG_ENTRIES = 10000
+# 访问日志的追加记录超过这个大小才合并回 access_log.json
+ACCESS_JOURNAL_MAX_BYTES = 256 * 1024
+
+# 搜索模式与关键词匹配方式，命令行参数和 --batch 请求共用
+SEARCH_MODES = ["keyword", "semantic", "auto"]
+MATCH_MODES = ["phrase", "all", "any"]
+
+# 常驻回忆服务（recall_server.py）的 socket，每个用户一个；服务不在时本进程内执行。
+# 放在 $XDG_RUNTIME_DIR（没有则临时目录）下的私有 0700 目录里（ipc_utils.private_socket_dir）
+RECALL_SOCKET_PATH = os.environ.get("LIZI_RECALL_SOCKET") or os.path.join(
+    os.environ.get("XDG_RUNTIME_DIR") or tempfile.gettempdir(),
+    f"lizi-{os.getuid()}",
+    "recall.sock",
+)
+RECALL_TIMEOUT = 60.0
+
+
+@contextmanager
+def _locked(path: str):
+    """
+    以 path + ".lock" 为锁文件的跨进程互斥（fcntl.flock），保护读-改-写。
+    锁文件建不出来（如目录只读）时不加锁，后续写入本来也会失败。
+    """
+    import fcntl
+
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        lock_file = open(path + ".lock", "a")
+    except OSError:
+        yield
+        return
+    with lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+
+def _stat_signature(path: str):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+# 访问日志的内存副本：(路径, 快照与追加记录的文件签名, 内容)，两者都没变就不再重读
+_access_log_cache = (None, None, None)
+
+
+def _access_journal_path() -> str:
+    """访问日志的追加记录：每次回忆追加一行 {"t": 时间, "ids": [段落 ID...]}"""
+    return ACCESS_LOG_PATH + ".journal"
+
+
+def _replay_access_journal(journal_path: str, access_log: Dict) -> None:
+    """把追加记录逐行合并进 access_log；写到一半的坏行直接跳过"""
+    try:
+        with open(journal_path, "r", encoding="utf-8") as f:
+            lines = f.readlines()
+    except (OSError, UnicodeDecodeError):
+        return
+    for line in lines:
+        try:
+            record = json.loads(line)
+            now, ids = record["t"], record["ids"]
+        except (json.JSONDecodeError, TypeError, KeyError):
+            continue
+        for key in ids:
+            update_access_record(key, access_log, now)
 
 
 def load_access_log() -> Dict:
-    """Load access log from JSON, return {} if missing/corrupted."""
+    """
+    Load access log: the access_log.json snapshot plus the not yet compacted
+    journal (see record_access), return {} if missing/corrupted.
+    """
+    global _access_log_cache
+    journal_path = _access_journal_path()
+    signature = (_stat_signature(ACCESS_LOG_PATH), _stat_signature(journal_path))
+    path, cached_signature, cached = _access_log_cache
+    if signature != (None, None) and (path, cached_signature) == (ACCESS_LOG_PATH, signature):
+        return cached
+
+    access_log = {}
     try:
-        if os.path.exists(ACCESS_LOG_PATH):
+        if signature[0] is not None:
             with open(ACCESS_LOG_PATH, "r", encoding="utf-8") as f:
-                return json.load(f)
+                access_log = json.load(f)
     except (json.JSONDecodeError, IOError):
         pass
-    return {}
+    if signature[1] is not None:
+        _replay_access_journal(journal_path, access_log)
+    _access_log_cache = (ACCESS_LOG_PATH, signature, access_log)
+    return access_log
 
 
-def save_access_log(access_log: Dict) -> None:
-    """Atomic save using temp file + rename."""
+def save_access_log(access_log: Dict) -> bool:
+    """Atomic save using temp file + rename (compact JSON, no indent); False on failure."""
     temp_path = ACCESS_LOG_PATH + ".tmp"
     try:
         with open(temp_path, "w", encoding="utf-8") as f:
-            json.dump(access_log, f, ensure_ascii=False, indent=2)
+            json.dump(access_log, f, ensure_ascii=False, separators=(",", ":"))
         os.replace(temp_path, ACCESS_LOG_PATH)
+        return True
     except IOError:
         # Silently fail - access log is non-critical
         if os.path.exists(temp_path):
             os.remove(temp_path)
+        return False
 
 
-def update_access_record(chunk_hash: str, access_log: Dict) -> None:
-    """Update last_access and access_count for a chunk."""
-    now = datetime.now().isoformat()
+def update_access_record(
+    chunk_hash: str, access_log: Dict, now: Optional[str] = None
+) -> None:
+    """Update last_access and access_count for a chunk (now: ISO time, default current)."""
+    now = now or datetime.now().isoformat()
     if chunk_hash in access_log:
         access_log[chunk_hash]["last_access"] = now
         access_log[chunk_hash]["access_count"] += 1
@@ -56,6 +151,72 @@ def update_access_record(chunk_hash: str, access_log: Dict) -> None:
         }
 
 
+def _section_ids(sections: List[str]) -> List[str]:
+    """
+    片段的段落 ID。片段占了语料的一大半时（如命中大半文件的关键词），
+    直接查切分目录记好的 ID，比逐段重新哈希快
+    """
+    from chunk_catalog import section_id
+
+    catalog = _catalog()
+    if len(sections) * 4 < len(catalog.sections()):
+        return [section_id(s) for s in sections]
+    known = {}
+    for filename in LONG_TERM_FILES:
+        known.update(zip(catalog.sections(filename), catalog.section_ids(filename)))
+    return [known.get(s) or section_id(s) for s in sections]
+
+
+def record_access(sections: List[str]) -> None:
+    """
+    记录被回忆到的片段。键是段落 ID（chunk_catalog.section_id，blake2b 内容哈希），
+    跨进程稳定，且与语义索引里各块的 section_id 一致，两边的访问统计能对上。
+    每次只往追加记录里写一行；追加记录超过 ACCESS_JOURNAL_MAX_BYTES 时才在锁内
+    合并回 access_log.json（见 compact_access_log），不再每次查询重写整个日志。
+    """
+    if not sections:
+        return
+    line = json.dumps(
+        {"t": datetime.now().isoformat(), "ids": _section_ids(sections)},
+        separators=(",", ":"),
+    )
+    try:
+        with _locked(ACCESS_LOG_PATH):
+            with open(_access_journal_path(), "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+                size = f.tell()
+            if size > ACCESS_JOURNAL_MAX_BYTES:
+                _compact_access_log()
+    except OSError:
+        pass  # 访问日志不影响回忆结果
+
+
+def compact_access_log() -> None:
+    """把追加记录合并进 access_log.json（裁剪到 MAX_ACCESS_LOG_ENTRIES）并清空追加记录"""
+    with _locked(ACCESS_LOG_PATH):
+        _compact_access_log()
+
+
+def _compact_access_log() -> None:
+    """compact_access_log 的主体，调用方持有访问日志的锁"""
+    global _access_log_cache
+    journal_path = _access_journal_path()
+    access_log = prune_access_log(load_access_log())
+    if not save_access_log(access_log):
+        return  # 快照没写成，追加记录留着下次再合并
+    # 快照写成后、清空前进程被杀，下次会把这批记录再合并一遍，多计几次访问，
+    # 访问统计只用来排重要度，能接受
+    try:
+        os.truncate(journal_path, 0)
+    except OSError:
+        return
+    _access_log_cache = (
+        ACCESS_LOG_PATH,
+        (_stat_signature(ACCESS_LOG_PATH), _stat_signature(journal_path)),
+        access_log,
+    )
+
+
 def prune_access_log(access_log: Dict) -> Dict:
     """Keep only most recent MAX_ACCESS_LOG_ENTRIES, FIFO removal."""
     if len(access_log) <= MAX_ACCESS_LOG_ENTRIES:
@@ -80,63 +241,235 @@ LONG_TERM_FILES = [
 ]
 
 
-def get_all_sections():
-    """获取所有记忆片段"""
-    all_sections = []
-
+def get_file_signatures() -> Dict[str, Tuple[int, int]]:
+    """各长期记忆文件的 (mtime_ns, size)，任一变化即视为语料已更新"""
+    signatures = {}
     for filename in LONG_TERM_FILES:
-        filepath = os.path.join(MEMORIES_DIR, filename)
-        if not os.path.exists(filepath):
+        try:
+            st = os.stat(os.path.join(MEMORIES_DIR, filename))
+        except OSError:
             continue
+        signatures[filename] = (st.st_mtime_ns, st.st_size)
+    return signatures
 
-        with open(filepath, "r", encoding="utf-8") as f:
-            content = f.read()
 
-        # 按段落分割（以 ## 开头的标题为分隔）
-        sections = re.split(r"\n(?=## )", content)
-        category = filename.replace(".md", "")
+def corpus_version(signatures: Dict[str, Tuple[int, int]]) -> str:
+    """由文件签名得到的语料版本号"""
+    raw = json.dumps(sorted(signatures.items()))
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
 
-        for section in sections:
-            section = section.strip()
-            if section and not section.startswith("# "):  # 跳过一级标题
-                all_sections.append(f"【{category}】\n{section}")
 
-    return all_sections
+def _catalog():
+    """
+    记忆切分目录（memories/.index/catalog/，只存段落 ID 和字节区间）：
+    段落供 BM25 / 关键词索引 / 随机回忆使用，切分方式与 ID 与语义索引共用
+    """
+    from chunk_catalog import get_catalog
 
+    return get_catalog(MEMORIES_DIR, CATALOG_DIR, LONG_TERM_FILES)
 
-def search_memories(keyword):
-    """搜索包含关键词的记忆片段"""
-    results = []
-    keyword_lower = keyword.lower()
 
-    for section in get_all_sections():
-        if keyword_lower in section.lower():
-            results.append(section)
+def read_file_sections(filename):
+    """读取单个记忆文件的所有片段（文件未变时按切分目录记录的字节区间切出）"""
+    return _catalog().sections(filename)
+
+
+def read_file_spans(filename):
+    """
+    读取单个记忆文件，返回 (片段列表, 各片段在文件中的字节区间)。
+    含 \r 的文件文本模式读取会转换换行，字节区间对不上，此时区间为 None。
+    """
+    catalog = _catalog()
+    return catalog.sections(filename), catalog.byte_ranges(filename)
+
 
+def get_all_sections():
+    """获取所有记忆片段"""
+    return _catalog().sections()
+
+
+# 本进程已打开的关键词索引：filename → NgramIndex
+_keyword_indexes = {}
+
+
+def load_keyword_index(filename, signature):
+    """
+    打开单个记忆文件的 bigram 关键词索引（memories/.index/keyword/<文件>.ngram），
+    文件签名变化时只重建这一个文件的索引。写索引失败时返回 None。
+    """
+    from ngram_utils import NgramIndex, build_ngram_index
+
+    index = _keyword_indexes.get(filename)
+    if index is not None and index.meta.get("signature") == list(signature):
+        return index
+
+    path = os.path.join(KEYWORD_INDEX_DIR, filename + ".ngram")
+    index = NgramIndex.open(path)
+    if index is None or index.meta.get("signature") != list(signature):
+        sections, byte_ranges = read_file_spans(filename)
+        meta = {"signature": list(signature), "ranges": byte_ranges}
+        build_ngram_index(sections, path, meta)
+        index = NgramIndex.open(path)
+    if index is not None:
+        _keyword_indexes[filename] = index
+    return index
+
+
+def _search_file(filename, signature, terms, match):
+    """在单个记忆文件中检索：bigram 倒排取候选，按字节区间读出片段后精确校验"""
+    from ngram_utils import matches
+
+    index = load_keyword_index(filename, signature)
+    doc_ids = index.candidates(terms, match) if index is not None else None
+    byte_ranges = index.meta.get("ranges") if index is not None else None
+
+    # 候选占了文件的一大半时，逐段 seek 不如整文件读一遍
+    if (
+        doc_ids is not None
+        and byte_ranges is not None
+        and len(doc_ids) * 4 < len(byte_ranges)
+    ):
+        category = filename.replace(".md", "")
+        results = []
+        try:
+            with open(os.path.join(MEMORIES_DIR, filename), "rb") as f:
+                for doc_id in doc_ids:
+                    start, end = byte_ranges[doc_id]
+                    f.seek(start)
+                    text = f.read(end - start).decode("utf-8")
+                    section = f"【{category}】\n{text}"
+                    if matches(section.lower(), terms, match):
+                        results.append(section)
+            return results
+        except (OSError, UnicodeDecodeError, IndexError):
+            pass  # 文件在签名检查后被改动，退回整文件校验
+
+    sections = read_file_sections(filename)
+    if doc_ids is not None:
+        sections = [sections[i] for i in doc_ids if i < len(sections)]
+    return [s for s in sections if matches(s.lower(), terms, match)]
+
+
+def search_memories(keyword, sections=None, match="phrase"):
+    """
+    搜索包含关键词的记忆片段，结果按文件与片段顺序排列。
+    match: phrase=整串作为子串（默认），all=空格分隔的词全部出现，any=任一出现
+    sections: 传入已读取的片段时直接线性扫描，否则走 bigram 关键词索引
+    """
+    from ngram_utils import split_terms, matches
+
+    terms = split_terms(keyword, match)
+    if sections is not None:
+        return [s for s in sections if matches(s.lower(), terms, match)]
+
+    results = []
+    signatures = get_file_signatures()
+    for filename in LONG_TERM_FILES:
+        if filename in signatures:
+            results.extend(_search_file(filename, signatures[filename], terms, match))
     return results
 
 
-def random_memory():
+def random_memory(log_access=True):
     """随机返回一段记忆"""
     all_sections = get_all_sections()
     if all_sections:
-        return random.choice(all_sections)
+        memory = random.choice(all_sections)
+        if log_access:
+            record_access([memory])
+        return memory
     return None
 
 
-def bm25_search_memories(query, top_k=5):
-    """使用 BM25 进行模糊语义搜索（纯标准库，零依赖）"""
-    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+def _refresh_bm25_index(bm25, signatures):
+    """
+    只重新读取签名变化的文件，按片段原文比对后增量更新索引：
+    原文未变的片段保留 doc_id，变化的片段原地 update，多出/消失的片段 add/remove。
+    """
+    files = bm25.meta["files"]
+    old_signatures = bm25.meta["signatures"]
+
+    for filename in LONG_TERM_FILES:
+        if old_signatures.get(filename) == signatures.get(filename):
+            continue
+
+        unmatched = {}
+        for doc_id in files.get(filename, []):
+            unmatched.setdefault(bm25.corpus[doc_id], []).append(doc_id)
+
+        doc_ids = []
+        new_sections = []
+        for section in read_file_sections(filename):
+            bucket = unmatched.get(section)
+            if bucket:
+                doc_ids.append(bucket.pop())
+            else:
+                new_sections.append(section)
+
+        stale_ids = [doc_id for bucket in unmatched.values() for doc_id in bucket]
+        # 追加一条 ### 记忆通常只改变文件最后一个片段，直接原地更新
+        while stale_ids and new_sections:
+            doc_id = stale_ids.pop()
+            bm25.update_document(doc_id, new_sections.pop())
+            doc_ids.append(doc_id)
+        bm25.remove_documents(stale_ids)
+        doc_ids.extend(bm25.add_documents(new_sections))
+
+        files[filename] = doc_ids
+
+    if bm25.needs_compaction():
+        mapping = bm25.compact()
+        for filename, doc_ids in files.items():
+            files[filename] = [mapping[doc_id] for doc_id in doc_ids]
+
+
+# 本进程已加载的 BM25 索引，常驻进程（recall_server.py）里跨查询复用
+_bm25_index = None
+
+
+def load_bm25_index():
+    """
+    加载持久化的 BM25 索引（memories/.index/bm25_index.pkl）。
+    记忆文件的 mtime/size 与索引记录一致时直接复用，
+    否则只增量更新发生变化的文件并写回。
+    本进程加载过的索引留在内存里，之后只做签名检查，文件变了就原地增量更新。
+    """
+    global _bm25_index
     from bm25_utils import BM25
 
-    sections = get_all_sections()
-    if not sections:
+    signatures = get_file_signatures()
+    bm25 = _bm25_index if _bm25_index is not None else BM25.load(BM25_INDEX_PATH)
+    if bm25 is not None and bm25.meta.get("signatures") == signatures:
+        _bm25_index = bm25
+        return bm25
+
+    # 先取签名再读文件：读取期间文件若被修改，下次加载时签名不符会再次更新
+    if bm25 is not None and "files" in bm25.meta:
+        _refresh_bm25_index(bm25, signatures)
+    else:
+        bm25 = BM25([])
+        bm25.meta["files"] = {}
+        for filename in LONG_TERM_FILES:
+            bm25.meta["files"][filename] = bm25.add_documents(
+                read_file_sections(filename)
+            )
+
+    bm25.meta["signatures"] = signatures
+    bm25.meta["version"] = corpus_version(signatures)
+    bm25.save(BM25_INDEX_PATH)
+    _bm25_index = bm25
+    return bm25
+
+
+def bm25_search_memories(query, top_k=5):
+    """使用 BM25 进行模糊语义搜索（纯标准库，零依赖）"""
+    bm25 = load_bm25_index()
+    if bm25.n == 0:
         return []
 
-    bm25 = BM25(sections)
     results = bm25.search(query, top_k=top_k, threshold=0.0)
 
-    return [sections[doc_id] for doc_id, score in results if score > 0]
+    return [bm25.corpus[doc_id] for doc_id, score in results if score > 0]
 
 
 # 保留旧函数名作为别名，兼容外部调用
@@ -144,21 +477,358 @@ def semantic_search_memories(query, top_k=5):
     return bm25_search_memories(query, top_k=top_k)
 
 
+def merge_results(keyword_results, semantic_results):
+    """合并关键词与语义结果，按文本内容去重，关键词结果在前"""
+    seen_texts = set()
+    all_results = []
+    for r in keyword_results + semantic_results:
+        text_key = r.strip()
+        if text_key not in seen_texts:
+            seen_texts.add(text_key)
+            all_results.append(r)
+    return all_results
+
+
+def result_cache_key(req: Dict) -> str:
+    """
+    结果缓存键：(mode, match, top_k, 规范化 query)。
+    规范化只做不影响结果的变换：一律转小写；整串子串匹配对空白敏感，其余情况合并空白。
+    """
+    query = req["query"].lower()
+    if req["mode"] == "semantic" or req["match"] != "phrase":
+        query = " ".join(query.split())
+    return "\x1f".join([req["mode"], req["match"], str(req["top_k"]), query])
+
+
+def load_result_cache(version: str) -> Dict:
+    """
+    读取结果缓存；语料版本变化（记忆文件被追加或手工修改）时丢弃全部条目。
+    本进程的命中/未命中计数记在 "delta"，用到或新增的条目键记在 "touched"，
+    save_result_cache 据此合并回磁盘上的最新内容。
+    """
+    cache = {}
+    try:
+        if os.path.exists(RESULT_CACHE_PATH):
+            with open(RESULT_CACHE_PATH, "r", encoding="utf-8") as f:
+                cache = json.load(f)
+    except (json.JSONDecodeError, IOError):
+        pass
+    stats = cache.get("stats") or {"hits": 0, "misses": 0, "invalidations": 0}
+    entries = cache.get("entries") or {}
+    if cache.get("version") != version:
+        if entries:
+            stats["invalidations"] += 1
+        entries = {}
+    return {
+        "version": version,
+        "entries": entries,
+        "stats": stats,
+        "delta": {"hits": 0, "misses": 0},
+        "touched": [],
+    }
+
+
+def save_result_cache(cache: Dict) -> None:
+    """
+    加锁后重新读取磁盘上的缓存，并入本进程的计数与条目（移到 LRU 末尾），
+    按最近最少使用淘汰到 MAX_RESULT_CACHE_BYTES 以内，临时文件 + rename 写回。
+    并发回忆互不覆盖对方写入的条目和统计。
+    """
+    if not cache["touched"] and not any(cache["delta"].values()):
+        return
+    with _locked(RESULT_CACHE_PATH):
+        current = load_result_cache(cache["version"])
+        stats = current["stats"]
+        for name, count in cache["delta"].items():
+            stats[name] += count
+        entries = current["entries"]
+        for key in cache["touched"]:
+            entry = cache["entries"].get(key)
+            if entry is not None:
+                entries.pop(key, None)
+                entries[key] = entry
+
+        total = sum(entry["bytes"] for entry in entries.values())
+        for key in list(entries):
+            if total <= MAX_RESULT_CACHE_BYTES:
+                break
+            total -= entries.pop(key)["bytes"]
+
+        temp_path = f"{RESULT_CACHE_PATH}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(
+                    {"version": current["version"], "entries": entries, "stats": stats},
+                    f,
+                    ensure_ascii=False,
+                )
+            os.replace(temp_path, RESULT_CACHE_PATH)
+        except IOError:
+            # 缓存写失败不影响检索
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+    cache["delta"] = {"hits": 0, "misses": 0}
+    cache["touched"] = []
+
+
+# 常驻进程（recall_server.py）置为 True：允许分片打分（LIZI_BM25_SHARDS > 1 时），
+# 分片 worker 在查询之间保留，索引变了才重建。单次调用的进程从不建分片
+KEEP_BM25_SHARDS = False
+_bm25_shards = (None, None)  # (建立时的索引签名, ShardedBM25 或 BM25)
+
+
+def _bm25_searcher(bm25):
+    """
+    返回给 bm25 打分用的对象。只有常驻进程（KEEP_BM25_SHARDS）在开启分片且语料
+    够大时返回 ShardedBM25，并在查询之间复用，调用方不要 close；
+    建分片要解码全部倒排、拉起 worker，单次调用付不起，一律直接用 bm25。
+    """
+    global _bm25_shards
+    from bm25_utils import ShardedBM25, shard_if_large
+
+    if not KEEP_BM25_SHARDS:
+        return bm25
+    version = corpus_version(bm25.meta.get("signatures") or {})
+    cached_version, searcher = _bm25_shards
+    if cached_version == version and getattr(searcher, "bm25", searcher) is bm25:
+        return searcher
+    if isinstance(searcher, ShardedBM25):
+        searcher.close()
+    searcher = shard_if_large(bm25)
+    _bm25_shards = (version, searcher)
+    return searcher
+
+
+def _compute_recall(requests: List[Dict]) -> List[Dict]:
+    """实际执行检索，返回与 requests 对应的 {"results", "keyword_count"}"""
+    outputs = []
+    semantic_jobs: Dict[int, List[int]] = {}  # top_k → 需要语义检索的请求下标
+
+    for i, req in enumerate(requests):
+        output = {"results": [], "keyword_count": 0}
+        if req["mode"] in ("keyword", "auto"):
+            output["results"] = search_memories(req["query"], match=req["match"])
+            output["keyword_count"] = len(output["results"])
+        if req["mode"] == "semantic" or (
+            req["mode"] == "auto" and len(output["results"]) < 2
+        ):
+            semantic_jobs.setdefault(req["top_k"], []).append(i)
+        outputs.append(output)
+
+    if semantic_jobs:
+        bm25 = load_bm25_index()
+        # 常驻进程开启分片时多进程并行打分，结果与单进程一致
+        searcher = _bm25_searcher(bm25)
+        for top_k, indices in semantic_jobs.items():
+            hits = searcher.search_many(
+                [requests[i]["query"] for i in indices], top_k=top_k
+            )
+            for i, results in zip(indices, hits):
+                semantic_results = [
+                    bm25.corpus[doc_id] for doc_id, score in results if score > 0
+                ]
+                outputs[i]["results"] = merge_results(
+                    outputs[i]["results"], semantic_results
+                )
+
+    return outputs
+
+
+def batch_recall(
+    requests: List[Dict], use_cache: bool = True, log_access: bool = True
+) -> List[Dict]:
+    """
+    批量回忆：requests 为 [{"query", "mode", "top_k", "match"}, ...]，
+    返回 [{"query", "mode", "results", "keyword_count"}, ...]。
+    先查跨进程结果缓存（memories/.index/recall_cache.json），未命中的 query
+    共用已打开的关键词索引和同一个 BM25 索引，语义检索走 search_many，
+    共享分词、倒排解码与 term 权重。auto 模式与单次调用的规则一致。
+    log_access 时把每条 query 排在前面的片段记入访问日志（见 accessed_sections）。
+    """
+    cache = load_result_cache(corpus_version(get_file_signatures())) if use_cache else None
+    outputs: List[Dict] = [None] * len(requests)
+    pending = []
+
+    for i, req in enumerate(requests):
+        entry = cache["entries"].get(result_cache_key(req)) if cache else None
+        if entry is not None:
+            cache["delta"]["hits"] += 1
+            cache["touched"].append(result_cache_key(req))  # 写回时移到末尾，保持 LRU 顺序
+            outputs[i] = entry["value"]
+        else:
+            pending.append(i)
+
+    if pending:
+        computed = _compute_recall([requests[i] for i in pending])
+        for i, value in zip(pending, computed):
+            outputs[i] = value
+            if cache is None:
+                continue
+            cache["delta"]["misses"] += 1
+            size = len(json.dumps(value, ensure_ascii=False).encode("utf-8"))
+            # 单条过大的结果（如命中上千段的关键词）不缓存，免得把其他条目挤光
+            if size <= MAX_RESULT_CACHE_BYTES // 8:
+                key = result_cache_key(requests[i])
+                cache["entries"][key] = {"value": value, "bytes": size}
+                cache["touched"].append(key)
+
+    if cache is not None:
+        save_result_cache(cache)
+    if log_access:
+        record_access(accessed_sections(requests, outputs))
+
+    return [
+        {"query": req["query"], "mode": req["mode"], **value}
+        for req, value in zip(requests, outputs)
+    ]
+
+
+def accessed_sections(requests: List[Dict], outputs: List[Dict]) -> List[str]:
+    """
+    要记入访问日志的片段：每条 query 只记排在前面的 top_k 条，命中上千段的宽泛
+    关键词不会把整批结果写进追加记录、逼着提前合并；同一批里重复的 query 只记一次。
+    """
+    seen = set()
+    sections = []
+    for req, value in zip(requests, outputs):
+        key = result_cache_key(req)
+        if key not in seen:
+            seen.add(key)
+            sections.extend(value["results"][: req["top_k"]])
+    return sections
+
+
+def result_cache_stats() -> Dict:
+    """结果缓存的命中统计与占用"""
+    cache = load_result_cache(corpus_version(get_file_signatures()))
+    stats = dict(cache["stats"])
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+    stats["entries"] = len(cache["entries"])
+    stats["bytes"] = sum(entry["bytes"] for entry in cache["entries"].values())
+    stats["corpus_version"] = cache["version"]
+    return stats
+
+
+def ask_recall_server(header: Dict):
+    """
+    把请求交给常驻回忆服务处理，返回其应答；服务未运行、出错、socket 不属于
+    当前用户，或服务读的记忆目录与本进程不同时返回 None，由调用方在本进程内执行。
+    """
+    if not os.path.exists(RECALL_SOCKET_PATH):
+        return None
+    from ipc_utils import IPCError, owned_socket, request
+
+    if not owned_socket(RECALL_SOCKET_PATH):
+        return None
+    try:
+        reply, _ = request(
+            RECALL_SOCKET_PATH,
+            {**header, "memories_dir": MEMORIES_DIR},
+            timeout=RECALL_TIMEOUT,
+        )
+    except (OSError, IPCError):
+        return None
+    return reply if reply.get("ok") else None
+
+
+def recall(requests: List[Dict]) -> List[Dict]:
+    """回忆入口：优先交给常驻服务（索引常驻内存），服务不在时本进程内 batch_recall"""
+    reply = ask_recall_server({"op": "recall", "requests": requests})
+    if reply is not None:
+        return reply["outputs"]
+    return batch_recall(requests)
+
+
+def read_batch_requests(stream, default_mode, default_match="phrase") -> List[Dict]:
+    """
+    从 JSON Lines 读取批量请求，每行可以是字符串，
+    或 {"query": ..., "mode": ..., "top_k": ..., "match": ...} 对象（后三项可省略）。
+    格式不对的行抛出 ValueError，消息里带行号。
+    """
+    requests = []
+    for line_no, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            item = json.loads(line)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"第 {line_no} 行不是合法的 JSON：{e}")
+        if isinstance(item, str):
+            item = {"query": item}
+        if not isinstance(item, dict) or not isinstance(item.get("query"), str):
+            raise ValueError(f"第 {line_no} 行缺少字符串类型的 query")
+
+        try:
+            top_k = int(item.get("top_k", 5))
+        except (TypeError, ValueError):
+            top_k = 0
+        request = {
+            "query": item["query"],
+            "mode": item.get("mode", default_mode),
+            "top_k": top_k,
+            "match": item.get("match", default_match),
+        }
+        if request["mode"] not in SEARCH_MODES:
+            raise ValueError(
+                f"第 {line_no} 行的 mode {request['mode']!r} 无效，可选 {SEARCH_MODES}"
+            )
+        if request["match"] not in MATCH_MODES:
+            raise ValueError(
+                f"第 {line_no} 行的 match {request['match']!r} 无效，可选 {MATCH_MODES}"
+            )
+        if top_k < 1:
+            raise ValueError(f"第 {line_no} 行的 top_k 必须是正整数")
+        requests.append(request)
+    return requests
+
+
 def main():
     parser = argparse.ArgumentParser(description="栗子的回忆工具")
     parser.add_argument("keyword", nargs="*", help="搜索关键词")
     parser.add_argument(
         "--mode",
-        choices=["keyword", "semantic", "auto"],
+        choices=SEARCH_MODES,
         default="keyword",
         help="搜索模式: keyword(默认), semantic(语义), auto(智能)",
     )
+    parser.add_argument(
+        "--match",
+        choices=MATCH_MODES,
+        default="phrase",
+        help="关键词匹配: phrase(整串，默认), all(空格分隔的词全部出现), any(任一出现)",
+    )
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="批量模式：从 stdin 按行读取 JSON（字符串或 {query, mode, top_k, match}），输出 JSON 结果",
+    )
+
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="输出结果缓存的命中/未命中统计",
+    )
 
     args = parser.parse_args()
 
+    if args.stats:
+        print(json.dumps(result_cache_stats(), ensure_ascii=False, indent=2))
+        return
+
+    if args.batch:
+        try:
+            requests = read_batch_requests(sys.stdin, args.mode, args.match)
+        except ValueError as e:
+            parser.error(str(e))
+        print(json.dumps(recall(requests), ensure_ascii=False, indent=2))
+        return
+
     if not args.keyword:
         # 没有参数，随机回忆
-        memory = random_memory()
+        reply = ask_recall_server({"op": "random"})
+        memory = reply["memory"] if reply is not None else random_memory()
         if memory:
             print("突然想起来...\n")
             print(memory)
@@ -168,9 +838,11 @@ def main():
 
     keyword = " ".join(args.keyword)
     mode = args.mode
+    request = {"query": keyword, "mode": mode, "top_k": 5, "match": args.match}
+    outcome = recall([request])[0]
+    results = outcome["results"]
 
     if mode == "keyword":
-        results = search_memories(keyword)
         if results:
             print(f"找到 {len(results)} 条相关记忆：\n")
             print("\n---\n".join(results))
@@ -178,7 +850,6 @@ def main():
             print(f"没有找到关于「{keyword}」的记忆")
 
     elif mode == "semantic":
-        results = semantic_search_memories(keyword)
         if results:
             print(f"找到 {len(results)} 条语义相关记忆：\n")
             print("\n---\n".join(results))
@@ -187,41 +858,19 @@ def main():
 
     elif mode == "auto":
         # 智能模式：先关键词搜索，结果不足时补充语义搜索
-        keyword_results = search_memories(keyword)
-
-        if len(keyword_results) >= 2:
+        kw_count = outcome["keyword_count"]
+        if kw_count >= 2:
             # 关键词结果足够
-            print(f"找到 {len(keyword_results)} 条相关记忆：\n")
-            print("\n---\n".join(keyword_results))
+            print(f"找到 {len(results)} 条相关记忆：\n")
+            print("\n---\n".join(results))
+        elif results:
+            sem_count = len(results) - kw_count
+            print(
+                f"找到 {len(results)} 条记忆（关键词{kw_count}条，语义{sem_count}条）：\n"
+            )
+            print("\n---\n".join(results))
         else:
-            # 需要语义搜索补充
-            semantic_results = semantic_search_memories(keyword)
-
-            # 合并去重（基于文本内容）
-            seen_texts = set()
-            all_results = []
-
-            for r in keyword_results:
-                text_key = r.strip()
-                if text_key not in seen_texts:
-                    seen_texts.add(text_key)
-                    all_results.append(r)
-
-            for r in semantic_results:
-                text_key = r.strip()
-                if text_key not in seen_texts:
-                    seen_texts.add(text_key)
-                    all_results.append(r)
-
-            if all_results:
-                kw_count = len(keyword_results)
-                sem_count = len(all_results) - kw_count
-                print(
-                    f"找到 {len(all_results)} 条记忆（关键词{kw_count}条，语义{sem_count}条）：\n"
-                )
-                print("\n---\n".join(all_results))
-            else:
-                print(f"没有找到关于「{keyword}」的记忆")
+            print(f"没有找到关于「{keyword}」的记忆")
 
 
 if __name__ == "__main__":
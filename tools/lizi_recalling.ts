@@ -7,6 +7,7 @@ export default tool({
   args: {
     keyword: tool.schema.string().optional().describe("要搜索的关键词，不传则随机回忆"),
     mode: tool.schema.enum(["keyword", "semantic", "auto"]).optional().default("auto").describe("搜索模式：keyword=关键词匹配，semantic=语义搜索，auto=智能模式（关键词优先，不足时补充语义结果）"),
+    match: tool.schema.enum(["phrase", "all", "any"]).optional().default("phrase").describe("关键词匹配方式：phrase=整串匹配，all=空格分隔的词全部出现，any=任一出现"),
   },
   async execute(args, context) {
     const liziDir = path.join(os.homedir(), ".config/lizi")
@@ -14,7 +15,7 @@ export default tool({
     const script = path.join(liziDir, "tools/lizi_recalling.py")
     
     const cmd = args.keyword 
-      ? [venvPython, script, args.keyword, "--mode", args.mode || "auto"]
+      ? [venvPython, script, args.keyword, "--mode", args.mode || "auto", "--match", args.match || "phrase"]
       : [venvPython, script]
     
     const proc = Bun.spawn(cmd, {
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+关键词检索用的字符 bigram 倒排索引 - 纯标准库实现，零依赖。
+
+- 文档统一小写后切成字符 bigram，倒排只记 doc_id（升序，varint 差值编码）
+- 查询串所有 bigram 的倒排求交得到候选，再做精确子串校验，结果与线性扫描一致
+- 索引文件按 bigram 排序存放，打开时只读入很小的词典，倒排用 mmap 按需读取
+"""
+
+import os
+import json
+import mmap
+import struct
+import operator
+from array import array
+from bisect import bisect_left
+from itertools import accumulate
+from typing import Dict, List, Optional, Set
+
+NGRAM_FORMAT_VERSION = 1
+
+# 文件头：magic、格式版本、meta 长度、文档数、bigram 数、倒排区长度
+_MAGIC = b"LZNG"
+_HEADER = struct.Struct("<4sIIQQQ")
+
+
+def _gram_keys(text: str) -> Set[int]:
+    """文本中所有字符 bigram，编码为整数：高位第一个字符，低 21 位第二个字符。"""
+    return {
+        ord(a) << 21 | ord(b) for a, b in set(map(operator.add, text, text[1:]))
+    }
+
+
+def _encode_ids(doc_ids: List[int]) -> bytes:
+    out = bytearray()
+    prev = 0
+    for doc_id in doc_ids:
+        value = doc_id - prev
+        while value >= 0x80:
+            out.append(value & 0x7F | 0x80)
+            value >>= 7
+        out.append(value)
+        prev = doc_id
+    return bytes(out)
+
+
+def _decode_ids(blob: bytes) -> List[int]:
+    if max(blob) < 0x80:
+        return list(accumulate(blob))
+    values = []
+    value = shift = 0
+    for byte in blob:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            values.append(value)
+            value = shift = 0
+    return list(accumulate(values))
+
+
+def split_terms(keyword: str, match: str) -> List[str]:
+    """把查询拆成小写的检索词：phrase 整串作为一个词，all/any 按空白切分。"""
+    if match == "phrase":
+        return [keyword.lower()]
+    return keyword.lower().split()
+
+
+def matches(text_lower: str, terms: List[str], match: str) -> bool:
+    """精确校验：any 要求任一词是子串，phrase/all 要求全部是子串。"""
+    if match == "any":
+        return any(term in text_lower for term in terms)
+    return all(term in text_lower for term in terms)
+
+
+def build_ngram_index(
+    docs: List[str], path: str, meta: Optional[Dict] = None
+) -> None:
+    """
+    为 docs 建 bigram 倒排并写入 path（先写临时文件再 rename）。
+    meta 为调用方的附加信息（JSON 可序列化），随索引一起保存。
+    """
+    postings: Dict[int, List[int]] = {}
+    for doc_id, text in enumerate(docs):
+        for key in _gram_keys(text.lower()):
+            ids = postings.get(key)
+            if ids is None:
+                postings[key] = [doc_id]
+            else:
+                ids.append(doc_id)
+
+    keys = array("Q", sorted(postings))
+    offsets = array("Q", [0])
+    blobs = []
+    for key in keys:
+        blob = _encode_ids(postings[key])
+        blobs.append(blob)
+        offsets.append(offsets[-1] + len(blob))
+
+    meta_bytes = json.dumps(meta or {}, ensure_ascii=False).encode("utf-8")
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(temp_path, "wb") as f:
+            f.write(
+                _HEADER.pack(
+                    _MAGIC,
+                    NGRAM_FORMAT_VERSION,
+                    len(meta_bytes),
+                    len(docs),
+                    len(keys),
+                    offsets[-1],
+                )
+            )
+            f.write(meta_bytes)
+            f.write(keys.tobytes())
+            f.write(offsets.tobytes())
+            for blob in blobs:
+                f.write(blob)
+        os.replace(temp_path, path)
+    except OSError:
+        # 索引只是加速，写失败时调用方会退回线性扫描
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+class NgramIndex:
+    """只读的 bigram 倒排索引，由 build_ngram_index 生成的文件打开。"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            header = f.read(_HEADER.size)
+            magic, version, meta_len, n_docs, n_keys, postings_len = _HEADER.unpack(
+                header
+            )
+            if magic != _MAGIC or version != NGRAM_FORMAT_VERSION:
+                raise ValueError(f"不支持的索引格式: {path}")
+            self.meta: Dict = json.loads(f.read(meta_len).decode("utf-8"))
+            self.n_docs = n_docs
+            self.keys = array("Q")
+            self.keys.frombytes(f.read(n_keys * 8))
+            self.offsets = array("Q")
+            self.offsets.frombytes(f.read((n_keys + 1) * 8))
+            self._postings_start = f.tell()
+            self._mm = (
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                if postings_len
+                else None
+            )
+
+    @classmethod
+    def open(cls, path: str) -> Optional["NgramIndex"]:
+        """打开索引，文件缺失、损坏或格式版本不符时返回 None。"""
+        try:
+            return cls(path)
+        except (OSError, ValueError, struct.error):
+            return None
+
+    def _postings(self, key: int) -> List[int]:
+        i = bisect_left(self.keys, key)
+        if i == len(self.keys) or self.keys[i] != key:
+            return []
+        start = self._postings_start + self.offsets[i]
+        end = self._postings_start + self.offsets[i + 1]
+        return _decode_ids(self._mm[start:end])
+
+    def _term_candidates(self, term: str) -> Optional[Set[int]]:
+        """包含 term 的候选 doc_id；term 不足两个字符时无法用 bigram 过滤，返回 None。"""
+        keys = _gram_keys(term)
+        if not keys:
+            return None
+        # 先取最短的倒排，候选集合只会越求交越小
+        ordered = sorted(keys, key=self._postings_size)
+        candidates = set(self._postings(ordered[0]))
+        for key in ordered[1:]:
+            if not candidates:
+                break
+            candidates.intersection_update(self._postings(key))
+        return candidates
+
+    def _postings_size(self, key: int) -> int:
+        i = bisect_left(self.keys, key)
+        if i == len(self.keys) or self.keys[i] != key:
+            return 0
+        return self.offsets[i + 1] - self.offsets[i]
+
+    def candidates(self, terms: List[str], match: str) -> Optional[List[int]]:
+        """
+        按 match 规则合并各检索词的候选，返回升序 doc_id；
+        无法用索引过滤时（如单字查询）返回 None，表示需要校验全部文档。
+        """
+        per_term = [self._term_candidates(term) for term in terms]
+        if match == "any":
+            if any(c is None for c in per_term):
+                return None
+            merged: Set[int] = set()
+            for c in per_term:
+                merged |= c
+        else:
+            known = [c for c in per_term if c is not None]
+            if not known:
+                return None
+            merged = set.intersection(*known)
+        return sorted(merged)
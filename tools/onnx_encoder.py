@@ -0,0 +1,426 @@
+#!/usr/bin/env python3
+"""
+ONNX Runtime CPU backend for the embedding model.
+
+Runs all-MiniLM-L6-v2 exported to ONNX without importing torch or
+sentence_transformers: text is tokenized by a pure-Python BERT WordPiece
+tokenizer reading the exported vocab.txt, and mean pooling and L2
+normalization are done in NumPy, matching the SentenceTransformer pipeline
+(Transformer -> mean Pooling -> Normalize). Enable it with
+LIZI_EMBED_BACKEND=onnx; LIZI_ONNX_INT8=1 uses the dynamically quantized
+int8 model (smaller and faster, slightly less exact).
+
+Usage:
+  python onnx_encoder.py --export [--quantize]   # one-off; needs torch + sentence_transformers
+  python onnx_encoder.py --quantize              # int8 model from an existing export
+  python onnx_encoder.py --compare [--memories DIR]
+      # agreement with the torch backend, cold start and throughput
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import unicodedata
+import numpy as np
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from embedding_utils import MODEL_NAME, normalize_embeddings
+
+ONNX_MODEL_DIR = os.environ.get("LIZI_ONNX_DIR") or os.path.expanduser(
+    f"~/.cache/lizi/onnx/{MODEL_NAME}"
+)
+MODEL_FILE = "model.onnx"
+QUANT_MODEL_FILE = "model.int8.onnx"
+VOCAB_FILE = "vocab.txt"
+CONFIG_FILE = "encoder.json"
+
+# Minimum per-text cosine similarity to the torch embedding
+FP32_MIN_COSINE = 0.9999
+INT8_MIN_COSINE = 0.98
+
+# Tokenized words kept per tokenizer; memories repeat words a lot
+WORD_CACHE_SIZE = 100000
+
+
+def _is_whitespace(char: str) -> bool:
+    return char in " \t\n\r" or unicodedata.category(char) == "Zs"
+
+
+def _is_control(char: str) -> bool:
+    return char not in "\t\n\r" and unicodedata.category(char).startswith("C")
+
+
+def _is_punctuation(char: str) -> bool:
+    cp = ord(char)
+    # BERT treats all non-alphanumeric ASCII as punctuation
+    if 33 <= cp <= 47 or 58 <= cp <= 64 or 91 <= cp <= 96 or 123 <= cp <= 126:
+        return True
+    return unicodedata.category(char).startswith("P")
+
+
+def _is_cjk(cp: int) -> bool:
+    return (
+        0x4E00 <= cp <= 0x9FFF
+        or 0x3400 <= cp <= 0x4DBF
+        or 0x20000 <= cp <= 0x2A6DF
+        or 0x2A700 <= cp <= 0x2B73F
+        or 0x2B740 <= cp <= 0x2B81F
+        or 0x2B820 <= cp <= 0x2CEAF
+        or 0xF900 <= cp <= 0xFAFF
+        or 0x2F800 <= cp <= 0x2FA1F
+    )
+
+
+class WordPieceTokenizer:
+    """
+    BERT (uncased) tokenizer in pure Python, equivalent to the HuggingFace
+    BertTokenizer the model was trained with: text cleanup, CJK characters
+    as single tokens, lowercasing and accent stripping, punctuation split,
+    then greedy longest-match WordPiece.
+    """
+
+    def __init__(self, vocab_path: str, do_lower_case: bool = True, max_length: int = 256):
+        with open(vocab_path, "r", encoding="utf-8") as f:
+            self.vocab = {line.rstrip("\n"): i for i, line in enumerate(f)}
+        self.do_lower_case = do_lower_case
+        self.max_length = max_length
+        self.cls_id = self.vocab["[CLS]"]
+        self.sep_id = self.vocab["[SEP]"]
+        self.pad_id = self.vocab["[PAD]"]
+        self.unk_id = self.vocab["[UNK]"]
+        self._word_cache: Dict[str, List[int]] = {}
+
+    def basic_tokens(self, text: str) -> List[str]:
+        """Whitespace/punctuation/CJK split of cleaned, normalized text."""
+        chars = []
+        for char in text:
+            cp = ord(char)
+            if cp == 0 or cp == 0xFFFD or _is_control(char):
+                continue
+            if _is_whitespace(char):
+                chars.append(" ")
+            elif _is_cjk(cp):
+                chars.append(f" {char} ")
+            else:
+                chars.append(char)
+
+        tokens = []
+        for word in "".join(chars).split():
+            if self.do_lower_case:
+                word = "".join(
+                    c
+                    for c in unicodedata.normalize("NFD", word.lower())
+                    if unicodedata.category(c) != "Mn"
+                )
+            start = 0
+            for i, char in enumerate(word):
+                if _is_punctuation(char):
+                    if start < i:
+                        tokens.append(word[start:i])
+                    tokens.append(char)
+                    start = i + 1
+            if start < len(word):
+                tokens.append(word[start:])
+        return tokens
+
+    def _wordpiece(self, word: str) -> List[int]:
+        cached = self._word_cache.get(word)
+        if cached is not None:
+            return cached
+        if len(word) > 100:
+            ids = [self.unk_id]
+        else:
+            ids = []
+            start = 0
+            while start < len(word):
+                end = len(word)
+                while end > start:
+                    piece = word[start:end] if start == 0 else f"##{word[start:end]}"
+                    if piece in self.vocab:
+                        ids.append(self.vocab[piece])
+                        break
+                    end -= 1
+                else:
+                    ids = [self.unk_id]
+                    break
+                start = end
+        if len(self._word_cache) >= WORD_CACHE_SIZE:
+            self._word_cache.clear()
+        self._word_cache[word] = ids
+        return ids
+
+    def encode(self, text: str) -> List[int]:
+        """Token ids with [CLS]/[SEP], truncated to max_length."""
+        ids = [self.cls_id]
+        limit = self.max_length - 1
+        for word in self.basic_tokens(text):
+            ids.extend(self._wordpiece(word))
+            if len(ids) >= limit:
+                del ids[limit:]
+                break
+        ids.append(self.sep_id)
+        return ids
+
+
+class OnnxEncoder:
+    """
+    Drop-in for SentenceTransformer.encode backed by an ONNX Runtime CPU
+    session. Batches are formed from texts of similar token length, so
+    padding stays small.
+    """
+
+    def __init__(
+        self, model_dir: str = ONNX_MODEL_DIR, quantized: bool = False, threads: int = 0
+    ):
+        import onnxruntime as ort
+
+        model_path = Path(model_dir)
+        with open(model_path / CONFIG_FILE, "r", encoding="utf-8") as f:
+            config = json.load(f)
+        self.tokenizer = WordPieceTokenizer(
+            str(model_path / VOCAB_FILE),
+            do_lower_case=config.get("do_lower_case", True),
+            max_length=config.get("max_seq_length", 256),
+        )
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        model_file = model_path / (QUANT_MODEL_FILE if quantized else MODEL_FILE)
+        try:
+            self.session = ort.InferenceSession(
+                str(model_file), options, providers=["CPUExecutionProvider"]
+            )
+        except Exception as e:
+            # onnxruntime's own errors (NoSuchFile, InvalidProtobuf, Fail, ...)
+            # derive from Exception only; surface them as RuntimeError so
+            # load_model() can fall back to sentence_transformers
+            raise RuntimeError(f"cannot load {model_file}: {e}") from e
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    def _run(self, batch: List[List[int]]) -> np.ndarray:
+        width = max(len(ids) for ids in batch)
+        input_ids = np.full((len(batch), width), self.tokenizer.pad_id, dtype=np.int64)
+        attention_mask = np.zeros((len(batch), width), dtype=np.int64)
+        for row, ids in enumerate(batch):
+            input_ids[row, : len(ids)] = ids
+            attention_mask[row, : len(ids)] = 1
+        feed = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.input_names:
+            feed["token_type_ids"] = np.zeros_like(input_ids)
+        hidden = self.session.run(None, feed)[0]
+
+        # Mean over real (non-padding) tokens
+        mask = attention_mask[:, :, None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        return normalize_embeddings(pooled.astype(np.float32))
+
+    def encode(
+        self,
+        texts: List[str],
+        batch_size: int = 32,
+        show_progress_bar: bool = False,
+        convert_to_numpy: bool = True,
+        **kwargs,
+    ) -> np.ndarray:
+        if isinstance(texts, str):
+            return self.encode([texts], batch_size)[0]
+        token_ids = [self.tokenizer.encode(text) for text in texts]
+        order = sorted(range(len(texts)), key=lambda i: len(token_ids[i]))
+        out = None
+        for start in range(0, len(order), batch_size):
+            rows = order[start : start + batch_size]
+            vectors = self._run([token_ids[i] for i in rows])
+            if out is None:
+                out = np.empty((len(texts), vectors.shape[1]), dtype=np.float32)
+            out[rows] = vectors
+        return out if out is not None else np.empty((0, 0), dtype=np.float32)
+
+
+def export(model_dir: str = ONNX_MODEL_DIR, opset: int = 14) -> None:
+    """Export the SentenceTransformer's transformer to model_dir (needs torch)."""
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    os.environ.setdefault("HF_HUB_OFFLINE", "1")
+    model = SentenceTransformer(MODEL_NAME, device="cpu")
+    transformer = model[0]
+    tokenizer = transformer.tokenizer
+    model_path = Path(model_dir)
+    model_path.mkdir(parents=True, exist_ok=True)
+    tokenizer.save_vocabulary(str(model_path))
+
+    class _LastHiddenState(torch.nn.Module):
+        def __init__(self, auto_model):
+            super().__init__()
+            self.auto_model = auto_model
+
+        def forward(self, input_ids, attention_mask, token_type_ids):
+            return self.auto_model(
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                token_type_ids=token_type_ids,
+            )[0]
+
+    sample = tokenizer(["export sample", "导出样例"], padding=True, return_tensors="pt")
+    dynamic = {0: "batch", 1: "sequence"}
+    torch.onnx.export(
+        _LastHiddenState(transformer.auto_model).eval(),
+        (sample["input_ids"], sample["attention_mask"], sample["token_type_ids"]),
+        str(model_path / MODEL_FILE),
+        input_names=["input_ids", "attention_mask", "token_type_ids"],
+        output_names=["last_hidden_state"],
+        dynamic_axes={
+            "input_ids": dynamic,
+            "attention_mask": dynamic,
+            "token_type_ids": dynamic,
+            "last_hidden_state": dynamic,
+        },
+        opset_version=opset,
+    )
+    config = {
+        "model": MODEL_NAME,
+        "max_seq_length": model.max_seq_length,
+        "do_lower_case": bool(getattr(tokenizer, "do_lower_case", True)),
+        "dimension": model.get_sentence_embedding_dimension(),
+    }
+    with open(model_path / CONFIG_FILE, "w", encoding="utf-8") as f:
+        json.dump(config, f, indent=2)
+    print(f"Exported {MODEL_NAME} to {model_path / MODEL_FILE}", file=sys.stderr)
+
+
+def quantize(model_dir: str = ONNX_MODEL_DIR) -> None:
+    """Dynamic int8 quantization of the exported model (weights int8, activations fp32)."""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    model_path = Path(model_dir)
+    quantize_dynamic(
+        str(model_path / MODEL_FILE),
+        str(model_path / QUANT_MODEL_FILE),
+        weight_type=QuantType.QInt8,
+    )
+    print(f"Quantized model written to {model_path / QUANT_MODEL_FILE}", file=sys.stderr)
+
+
+_SAMPLE_TEXTS = [
+    "Semantic search over long-term memories with sentence embeddings.",
+    "今天把 BM25 索引改成了分片并行查询，延迟降了不少。",
+    "DDS QoS settings: reliability, durability and history depth.",
+    "Rust ownership rules make the borrow checker reject this code.",
+    "基金定投三年，年化收益大约百分之六。",
+    "The embedding worker batches concurrent requests into one model call.",
+]
+
+
+def _sample_texts(memories_dir: Optional[str], count: int) -> List[str]:
+    if memories_dir:
+        from embedding_utils import collect_chunks
+
+        texts = [chunk["text"] for chunk in collect_chunks(memories_dir)]
+        if texts:
+            return texts[:count]
+    return [
+        f"{_SAMPLE_TEXTS[i % len(_SAMPLE_TEXTS)]} ({i})" * (1 + i % 5)
+        for i in range(count)
+    ]
+
+
+def _cold_start(backend: str, int8: bool) -> float:
+    """Seconds for a fresh process to import, load the model and encode one text."""
+    code = (
+        "import sys; sys.path.insert(0, %r); import embedding_utils as e; "
+        "e.load_model().encode(['warm up'])" % str(Path(__file__).parent)
+    )
+    env = dict(os.environ, LIZI_EMBED_BACKEND=backend, LIZI_ONNX_INT8="1" if int8 else "")
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", code], env=env, check=True)
+    return time.perf_counter() - start
+
+
+def _throughput(model, texts: List[str]) -> Tuple[np.ndarray, float]:
+    start = time.perf_counter()
+    vectors = model.encode(texts, batch_size=64, show_progress_bar=False, convert_to_numpy=True)
+    elapsed = time.perf_counter() - start
+    return normalize_embeddings(np.asarray(vectors, dtype=np.float32)), len(texts) / elapsed
+
+
+def compare(model_dir: str, memories_dir: Optional[str], count: int) -> bool:
+    """
+    Encode the same texts with torch, ONNX fp32 and (if exported) ONNX int8;
+    report per-text cosine agreement with torch, cold start and chunks/s.
+    Returns False if a backend is outside its tolerance.
+    """
+    from sentence_transformers import SentenceTransformer
+
+    os.environ.setdefault("HF_HUB_OFFLINE", "1")
+    texts = _sample_texts(memories_dir, count)
+    backends = [("torch", False, lambda: SentenceTransformer(MODEL_NAME, device="cpu"))]
+    backends.append(("onnx", False, lambda: OnnxEncoder(model_dir)))
+    if (Path(model_dir) / QUANT_MODEL_FILE).exists():
+        backends.append(("onnx", True, lambda: OnnxEncoder(model_dir, quantized=True)))
+
+    print(f"{len(texts)} texts")
+    print(
+        f"{'backend':<10} {'cold start':>10} {'chunks/s':>9} {'min cos':>8} {'mean cos':>9} "
+        f"{'max |diff|':>10}"
+    )
+    reference = None
+    ok = True
+    for backend, int8, load in backends:
+        name = f"{backend}-int8" if int8 else backend
+        cold = _cold_start(backend, int8)
+        vectors, rate = _throughput(load(), texts)
+        if reference is None:
+            reference = vectors
+            print(f"{name:<10} {cold:>9.2f}s {rate:>9.1f} {'-':>8} {'-':>9} {'-':>10}")
+            continue
+        cosines = (vectors * reference).sum(axis=1)
+        max_diff = float(np.abs(vectors - reference).max())
+        print(
+            f"{name:<10} {cold:>9.2f}s {rate:>9.1f} {cosines.min():>8.5f} "
+            f"{cosines.mean():>9.5f} {max_diff:>10.2e}"
+        )
+        if cosines.min() < (INT8_MIN_COSINE if int8 else FP32_MIN_COSINE):
+            print(f"  {name} is outside tolerance", file=sys.stderr)
+            ok = False
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ONNX Runtime embedding backend")
+    parser.add_argument(
+        "--dir",
+        default=ONNX_MODEL_DIR,
+        help=f"Exported model directory (default: {ONNX_MODEL_DIR}, env LIZI_ONNX_DIR)",
+    )
+    parser.add_argument("--export", action="store_true", help="Export the model to ONNX")
+    parser.add_argument(
+        "--quantize", action="store_true", help="Write the dynamic int8 model"
+    )
+    parser.add_argument(
+        "--compare", action="store_true", help="Compare with the torch backend"
+    )
+    parser.add_argument("--memories", help="Take --compare texts from this memories dir")
+    parser.add_argument("--texts", type=int, default=512, help="Texts for --compare")
+    args = parser.parse_args()
+
+    if not (args.export or args.quantize or args.compare):
+        parser.print_help()
+        return
+    if args.export:
+        export(args.dir)
+    if args.quantize:
+        quantize(args.dir)
+    if args.compare and not compare(args.dir, args.memories, args.texts):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
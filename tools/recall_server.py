@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+常驻回忆服务：把记忆片段、BM25 索引和关键词索引留在内存里，
+通过 Unix socket 回答 keyword / semantic / auto / random 查询。
+
+每次调用 lizi_recalling.py 都是一个冷启动的 Python 进程，大部分时间花在
+import、读切分目录和加载 BM25 上。服务在运行时 lizi_recalling.py
+只做参数解析和转发，服务不在（或 socket 不属于当前用户）时仍在本进程内执行，
+输出完全一致。socket 建在私有的 0700 目录里（见 ipc_utils.private_socket_dir）。
+记忆文件变化由 lizi_recalling 的签名检查发现：段落、关键词索引按文件重新
+读取，BM25 原地增量更新，和单次调用的规则相同。
+
+访问记录先攒在内存里，每 ACCESS_FLUSH_SECONDS 秒及退出时追加到访问日志
+（见 lizi_recalling.record_access）。
+
+用法:
+  python recall_server.py            # 前台运行
+  python recall_server.py --status   # 查看服务是否在运行
+  python recall_server.py --stop     # 让运行中的服务退出
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import socketserver
+from pathlib import Path
+from typing import List
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+import lizi_recalling as recall
+from bm25_utils import ShardedBM25
+from ipc_utils import IPCError, private_socket_dir, recv_message, request, send_message
+
+# 内存中的访问记录追加到访问日志的间隔（秒）
+ACCESS_FLUSH_SECONDS = 5.0
+
+
+class RecallService:
+    """持有热索引的回忆逻辑；检索串行执行，lizi_recalling 的模块级缓存不是线程安全的"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending_access: List[str] = []
+        self.queries = 0
+        self.started = time.time()
+
+    def warm_up(self) -> None:
+        """启动时加载段落和 BM25，第一条查询不再付加载的代价"""
+        with self.lock:
+            recall.get_all_sections()
+            recall.load_bm25_index()
+
+    def recall(self, requests: List[dict]) -> List[dict]:
+        with self.lock:
+            # 结果缓存是给冷启动进程用的，常驻时检索比读写缓存文件还快
+            outputs = recall.batch_recall(requests, use_cache=False, log_access=False)
+            self.queries += len(requests)
+            self.pending_access.extend(recall.accessed_sections(requests, outputs))
+        return outputs
+
+    def random(self):
+        with self.lock:
+            memory = recall.random_memory(log_access=False)
+            self.queries += 1
+            if memory is not None:
+                self.pending_access.append(memory)
+        return memory
+
+    def flush_access(self) -> None:
+        with self.lock:
+            sections, self.pending_access = self.pending_access, []
+            recall.record_access(sections)
+
+    def stats(self) -> dict:
+        return {
+            "memories_dir": recall.MEMORIES_DIR,
+            "pid": os.getpid(),
+            "uptime": round(time.time() - self.started, 1),
+            "queries": self.queries,
+            "sections": len(recall.get_all_sections()),
+        }
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self) -> None:
+        service = self.server.service
+        try:
+            header, _ = recv_message(self.request)
+            op = header.get("op")
+            memories_dir = header.get("memories_dir")
+            if op in ("recall", "random") and memories_dir not in (None, recall.MEMORIES_DIR):
+                # 客户端读的是另一份记忆，交回给它自己执行
+                send_message(
+                    self.request,
+                    {"ok": False, "error": f"serving {recall.MEMORIES_DIR}"},
+                )
+            elif op == "recall":
+                outputs = service.recall(header.get("requests") or [])
+                send_message(self.request, {"ok": True, "outputs": outputs})
+            elif op == "random":
+                send_message(self.request, {"ok": True, "memory": service.random()})
+            elif op == "ping":
+                send_message(self.request, {"ok": True, **service.stats()})
+            elif op == "shutdown":
+                send_message(self.request, {"ok": True})
+                threading.Thread(target=self.server.shutdown, daemon=True).start()
+            else:
+                send_message(self.request, {"ok": False, "error": f"unknown op {op!r}"})
+        except (IPCError, OSError):
+            return
+        except Exception as e:
+            send_message(self.request, {"ok": False, "error": str(e)})
+
+
+class RecallServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, path: str, service: RecallService):
+        self.service = service
+        super().__init__(path, _Handler)
+
+
+def _socket_in_use(path: str) -> bool:
+    try:
+        request(path, {"op": "ping"}, timeout=2.0)
+        return True
+    except (OSError, IPCError):
+        return False
+
+
+def _flush_loop(service: RecallService, stop: threading.Event) -> None:
+    while not stop.wait(ACCESS_FLUSH_SECONDS):
+        service.flush_access()
+
+
+def serve(path: str) -> None:
+    try:
+        private_socket_dir(path)
+    except PermissionError as e:
+        sys.exit(f"拒绝在 {path} 上监听：{e}")
+    if os.path.exists(path):
+        if _socket_in_use(path):
+            print(f"回忆服务已在运行：{path}", file=sys.stderr)
+            return
+        os.remove(path)  # 上次异常退出留下的 socket
+
+    service = RecallService()
+    start = time.perf_counter()
+    service.warm_up()
+    print(
+        f"已加载 {recall.MEMORIES_DIR}（{time.perf_counter() - start:.2f}s）",
+        file=sys.stderr,
+    )
+
+    # 开启分片（LIZI_BM25_SHARDS > 1）时分片 worker 随服务常驻，只在索引变化后重建
+    recall.KEEP_BM25_SHARDS = True
+    stop = threading.Event()
+    flusher = threading.Thread(target=_flush_loop, args=(service, stop), daemon=True)
+    flusher.start()
+    with RecallServer(path, service) as server:
+        os.chmod(path, 0o600)
+        print(f"回忆服务监听 {path}", file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            stop.set()
+            service.flush_access()
+            if os.path.exists(path):
+                os.remove(path)
+            _, searcher = recall._bm25_shards
+            if isinstance(searcher, ShardedBM25):
+                searcher.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="常驻回忆服务")
+    parser.add_argument(
+        "--socket",
+        default=recall.RECALL_SOCKET_PATH,
+        help=(
+            f"Unix socket 路径（默认 {recall.RECALL_SOCKET_PATH}，环境变量 LIZI_RECALL_SOCKET），"
+            "所在目录须只属于当前用户（权限 0700）"
+        ),
+    )
+    parser.add_argument("--status", action="store_true", help="查看服务是否在运行")
+    parser.add_argument("--stop", action="store_true", help="让运行中的服务退出")
+    args = parser.parse_args()
+
+    if args.status or args.stop:
+        try:
+            header, _ = request(
+                args.socket, {"op": "shutdown" if args.stop else "ping"}, timeout=5.0
+            )
+        except (OSError, IPCError):
+            print(json.dumps({"running": False}))
+            sys.exit(1)
+        print(json.dumps({"running": not args.stop, **header}, ensure_ascii=False))
+        return
+
+    serve(args.socket)
+
+
+if __name__ == "__main__":
+    main()